@@ -0,0 +1,365 @@
+'''
+Classifiers from per-class sufficient statistics.
+
+Gaussian naive Bayes (GaussianNB), LDA, QDA and NearestCentroid are fully
+determined by the number of samples, the mean, and the scatter (the sum of
+the outer products of the deviations from the mean) of each class. The
+statistics of a data set are calculated once, the statistics of a CV train
+set are derived from them by subtracting those of its test set, and those of
+a feature subset by slicing. The predictions are obtained from the
+statistics as the scikit-learn 0.14 classifiers fitted on the train set
+make them, up to rounding (the LDA and QDA use the eigenvalues of the
+scatter matrices instead of the singular values of the data, which only
+matters for (nearly) collinear features).
+'''
+
+import numpy
+
+from sklearn import lda
+from sklearn import qda
+from sklearn import naive_bayes
+from sklearn import neighbors
+
+from spice import metrics as spice_metrics
+
+# maximal number of floats in the statistics of a data set, see possible
+max_stats_size = 2 ** 25
+
+# variance added to each feature by GaussianNB
+gnb_epsilon = 1e-9
+
+# tolerance of the singular values of LDA
+lda_tol = 1.0e-4
+
+
+def possible(classifier, scoring, num_classes, num_features, num_folds=1):
+    '''
+    Returns True if the classifier is determined by the class statistics,
+    the scoring can be derived from its predictions, and the statistics of
+    num_folds train sets with num_features features fit in max_stats_size.
+    NearestCentroids are supported with euclidean metric and without
+    shrinking, for scorings that use the class predictions only.
+    '''
+
+    if(isinstance(classifier, neighbors.NearestCentroid)):
+        if(classifier.shrink_threshold or
+           not(classifier.metric == 'euclidean') or
+           not(scoring in spice_metrics.pred_score_names)):
+            return False
+    elif not(isinstance(classifier, (naive_bayes.GaussianNB, lda.LDA,
+                                     qda.QDA))):
+        return False
+
+    if not(scoring in spice_metrics.pred_score_names +
+           spice_metrics.proba_score_names):
+        return False
+
+    if(needs_cov(classifier)):
+        size = num_features * num_features
+    else:
+        size = num_features
+    return num_folds * num_classes * size <= max_stats_size
+
+
+def needs_cov(classifier):
+    '''
+    Returns True if the classifier requires the full scatter matrices,
+    instead of only the diagonal.
+    '''
+    return isinstance(classifier, (lda.LDA, qda.QDA))
+
+
+def class_stats(data, y, num_classes, cov=True):
+    '''
+    Returns the statistics (counts, means, scatters) of the rows of data per
+    class, y holds the class index (0 to num_classes - 1) of each row. The
+    scatters are num_features x num_features matrices if cov is True, or only
+    their diagonals (sums of squared deviations) otherwise.
+    '''
+
+    num_features = data.shape[1]
+
+    counts = numpy.bincount(y, minlength=num_classes)
+    means = numpy.zeros((num_classes, num_features))
+    if(cov):
+        scatters = numpy.zeros((num_classes, num_features, num_features))
+    else:
+        scatters = numpy.zeros((num_classes, num_features))
+
+    for class_i in xrange(num_classes):
+        if(counts[class_i] > 0):
+            class_data = data[y == class_i, :]
+            means[class_i] = class_data.mean(axis=0)
+            dev = class_data - means[class_i]
+            if(cov):
+                scatters[class_i] = numpy.dot(dev.T, dev)
+            else:
+                scatters[class_i] = (dev ** 2).sum(axis=0)
+
+    return (counts, means, scatters)
+
+
+def subtract(stats, part):
+    '''
+    Returns the statistics of the samples in stats that are not in part,
+    part holds the statistics of a subset of the samples.
+    '''
+
+    (counts, means, scatters) = stats
+    (part_counts, part_means, part_scatters) = part
+
+    rest_counts = counts - part_counts
+    rest_means = numpy.zeros(means.shape)
+    rest_scatters = numpy.zeros(scatters.shape)
+
+    for class_i in xrange(counts.size):
+
+        n = counts[class_i]
+        n_part = part_counts[class_i]
+        n_rest = rest_counts[class_i]
+
+        if(n_rest == 0):
+            continue
+        elif(n_part == 0):
+            rest_means[class_i] = means[class_i]
+            rest_scatters[class_i] = scatters[class_i]
+            continue
+
+        rest_means[class_i] = (n * means[class_i] -
+                               n_part * part_means[class_i]) / float(n_rest)
+
+        # the scatter of a union is the sum of the scatters plus the scatter
+        # of the two means
+        delta = rest_means[class_i] - part_means[class_i]
+        if(scatters.ndim == 3):
+            between = numpy.outer(delta, delta)
+        else:
+            between = delta ** 2
+        rest_scatters[class_i] = (scatters[class_i] - part_scatters[class_i] -
+                                  (n_rest * n_part / float(n)) * between)
+
+    return (rest_counts, rest_means, rest_scatters)
+
+
+def select(stats, feat_is):
+    '''
+    Returns the statistics of the features (column indices) feat_is.
+    '''
+    (counts, means, scatters) = stats
+    if(scatters.ndim == 3):
+        scatters = scatters[:, feat_is, :][:, :, feat_is]
+    else:
+        scatters = scatters[:, feat_is]
+    return (counts, means[:, feat_is], scatters)
+
+
+def predict(classifier, stats, data):
+    '''
+    Returns the tuple (pred, proba) of the classifier (GaussianNB, LDA, QDA,
+    or NearestCentroid with its parameters) trained on the samples with
+    statistics stats, for the rows of data. The pred are class indices, the
+    proba are the values of the second class that the scikit-learn scorers
+    use: the decision function of LDA and QDA, the probability of
+    GaussianNB, and None for NearestCentroid or if there are not two
+    classes. Only the classes with samples are used, as the classifier
+    fitted on the samples would.
+
+    Raises:
+        ValueError: If there are less than two classes for a LDA, QDA, or
+                    NearestCentroid.
+    '''
+
+    (counts, means, scatters) = stats
+
+    # the classes that occur in the train samples
+    class_is = numpy.where(counts > 0)[0]
+    counts = counts[class_is]
+    means = means[class_is]
+    scatters = scatters[class_is]
+
+    if(class_is.size < 2 and
+       not(isinstance(classifier, naive_bayes.GaussianNB))):
+        raise ValueError('y has less than 2 classes')
+
+    priors = counts / float(counts.sum())
+    if(isinstance(classifier, (lda.LDA, qda.QDA)) and
+       not(classifier.priors is None)):
+        priors = numpy.asarray(classifier.priors)
+
+    if(isinstance(classifier, naive_bayes.GaussianNB)):
+        values = _gnb_log_likelihood(counts, means, scatters, priors, data)
+    elif(isinstance(classifier, lda.LDA)):
+        values = _lda_decision(counts, means, scatters, priors, data)
+    elif(isinstance(classifier, qda.QDA)):
+        values = _qda_decision(counts, means, scatters, priors, data,
+                               classifier.reg_param)
+    else:
+        # minus the squared distance to the centroids
+        values = -((data[:, numpy.newaxis, :] - means) ** 2).sum(axis=2)
+
+    pred = class_is[values.argmax(axis=1)]
+
+    if(class_is.size == 2 and
+       isinstance(classifier, naive_bayes.GaussianNB)):
+        top = values.max(axis=1)
+        log_prob = numpy.log(numpy.exp(values - top[:, numpy.newaxis]).sum(
+            axis=1)) + top
+        proba = numpy.exp(values[:, 1] - log_prob)
+    elif(class_is.size == 2 and
+         isinstance(classifier, (lda.LDA, qda.QDA))):
+        proba = values[:, 1] - values[:, 0]
+    else:
+        proba = None
+
+    return (pred, proba)
+
+
+def _gnb_log_likelihood(counts, means, scatters, priors, data):
+    '''
+    Returns the joint log likelihood of the classes of GaussianNB.
+    '''
+    sigma = scatters / counts[:, numpy.newaxis] + gnb_epsilon
+    values = numpy.zeros((data.shape[0], counts.size))
+    for class_i in xrange(counts.size):
+        values[:, class_i] = (
+            numpy.log(priors[class_i]) -
+            0.5 * numpy.sum(numpy.log(numpy.pi * sigma[class_i])) -
+            0.5 * numpy.sum((data - means[class_i]) ** 2 / sigma[class_i],
+                            axis=1))
+    return values
+
+
+def _lda_decision(counts, means, scatters, priors, data):
+    '''
+    Returns the decision function values of the classes of LDA.
+    '''
+
+    num_samples = counts.sum()
+    num_classes = counts.size
+    fac = 1.0 / (num_samples - num_classes)
+
+    # pooled within class scatter, scaled as the standardized centered data
+    within = scatters.sum(axis=0)
+    std = numpy.sqrt(numpy.diag(within) / num_samples)
+    std[std == 0] = 1.0
+    corr = fac * within / numpy.outer(std, std)
+
+    # the eigenvalues are the squared singular values of the centered data
+    (evals, evecs) = numpy.linalg.eigh(corr)
+    order = numpy.argsort(evals)[::-1]
+    s = numpy.sqrt(numpy.maximum(evals[order], 0.0))
+    v = evecs[:, order].T
+    rank = numpy.sum(s > lda_tol)
+    scalings = (v[:rank] / std).T / s[:rank]
+
+    xbar = numpy.dot(priors, means)
+    between = numpy.dot(((numpy.sqrt((num_samples * priors) * fac)) *
+                         (means - xbar).T).T, scalings)
+    (_, s, v) = numpy.linalg.svd(between, full_matrices=0)
+    rank = numpy.sum(s > lda_tol * s[0])
+    scalings = numpy.dot(scalings, v.T[:, :rank])
+
+    coef = numpy.dot(means - xbar, scalings)
+    intercept = -0.5 * numpy.sum(coef ** 2, axis=1) + numpy.log(priors)
+
+    return numpy.dot(numpy.dot(data - xbar, scalings), coef.T) + intercept
+
+
+def _qda_decision(counts, means, scatters, priors, data, reg_param):
+    '''
+    Returns the decision function values of the classes of QDA.
+    '''
+
+    values = numpy.zeros((data.shape[0], counts.size))
+
+    for class_i in xrange(counts.size):
+
+        # the eigenvalues are the squared singular values of the centered
+        # class data, of which there are at most as many as samples
+        (evals, evecs) = numpy.linalg.eigh(scatters[class_i])
+        order = numpy.argsort(evals)[::-1][:counts[class_i]]
+        evals = numpy.maximum(evals[order],
+                              numpy.finfo(float).eps * evals[order[0]])
+        rotation = evecs[:, order]
+
+        s2 = evals / (counts[class_i] - 1)
+        s2 = ((1 - reg_param) * s2) + reg_param
+
+        dev = numpy.dot(data - means[class_i], rotation * (s2 ** (-0.5)))
+        values[:, class_i] = (-0.5 * (numpy.sum(dev ** 2, axis=1) +
+                                      numpy.sum(numpy.log(s2))) +
+                              numpy.log(priors[class_i]))
+
+    return values
+
+
+class CVStats(object):
+    '''
+    Class statistics of the train sets of CV folds, from which the CV scores
+    of a classifier on feature subsets are obtained without fitting it (see
+    scores). The statistics of the data set and of each test set are
+    calculated once, for the feature columns (all if None), the train set
+    statistics are their difference. Train sets that are not the complement
+    of their test set are calculated separately.
+
+    The data set consists of the rows (all if None) of data, the folds index
+    into these rows. Only the rows and columns of the statistics are sliced
+    out (once). The object keeps the statistics and the test rows of each
+    fold, not the data, which is passed to scores, so that it stays small
+    when it is sent to worker processes.
+    '''
+
+    def __init__(self, data, target, folds, cov=True, columns=None,
+                 rows=None):
+
+        if(columns is None):
+            columns = range(data.shape[1])
+        if(rows is None):
+            rows = range(data.shape[0])
+
+        rows = numpy.asarray(rows)
+        self.columns = numpy.asarray(columns)
+        (self.classes, y) = numpy.unique(target[rows], return_inverse=True)
+
+        num_classes = self.classes.size
+        column_data = data[numpy.ix_(rows, self.columns)]
+        total = class_stats(column_data, y, num_classes, cov=cov)
+
+        # per fold the train statistics, and the data rows and class indices
+        # of the test samples
+        self.fold_stats = []
+        self.tst_rows = []
+        self.tst_y = []
+        for trn_indices, tst_indices in folds:
+            if(len(trn_indices) + len(tst_indices) == len(rows)):
+                self.fold_stats.append(subtract(total, class_stats(
+                    column_data[tst_indices, :], y[tst_indices], num_classes,
+                    cov=cov)))
+            else:
+                self.fold_stats.append(class_stats(
+                    column_data[trn_indices, :], y[trn_indices], num_classes,
+                    cov=cov))
+            self.tst_rows.append(rows[tst_indices])
+            self.tst_y.append(y[tst_indices])
+
+    def scores(self, data, classifier, scoring, feat_is):
+        '''
+        Returns the scores on the test sets of the classifier trained on the
+        train sets, using the features (data column indices) feat_is, which
+        should be in the columns of the statistics. The data is the matrix
+        of which the statistics were calculated (or a memory-mapped copy).
+        '''
+
+        stats_is = [numpy.searchsorted(self.columns, fi) for fi in feat_is]
+
+        scores = numpy.zeros(len(self.fold_stats))
+
+        for fold_i, fold_stats in enumerate(self.fold_stats):
+            stats = select(fold_stats, stats_is)
+            tst_data = data[numpy.ix_(self.tst_rows[fold_i], feat_is)]
+            (pred, proba) = predict(classifier, stats, tst_data)
+            scores[fold_i] = spice_metrics.score(
+                scoring, self.classes[self.tst_y[fold_i]],
+                self.classes[pred], proba)
+
+        return scores
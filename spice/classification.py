@@ -1,8 +1,20 @@
 import os
 import sys
+import time
 import operator
+import StringIO
+import glob
+import json
+import hashlib
+import tempfile
+import shutil
+import atexit
+import signal
+import errno
+import multiprocessing.pool
 
 import numpy
+from scipy import stats
 
 # HACK TODO remove if sklearn is updated to 0.14 on compute servers...
 #import sklearn
@@ -19,26 +31,26 @@ from sklearn import naive_bayes
 from sklearn import tree
 from sklearn import ensemble
 from sklearn.grid_search import GridSearchCV
+from sklearn.grid_search import ParameterGrid
 from sklearn import preprocessing
 from sklearn import cross_validation
-from sklearn import metrics
+from sklearn.metrics import scorer
+from sklearn.utils.class_weight import compute_class_weight
+from sklearn.utils.extmath import weighted_mode
+from sklearn.neighbors.base import _get_weights
+from sklearn.externals import joblib
 
 from biopy import roc
 
+from spice import featmat
+from spice import metrics as spice_metrics
+from spice import class_stats
+from spice import telemetry
+
 
 # classification performance measures
 all_score_names = ['roc_auc', 'mcc', 'f1', 'precision', 'average_precision',
                    'recall', 'accuracy']
-all_score_funcs = dict(zip(all_score_names, [
-    metrics.roc_auc_score,
-    metrics.matthews_corrcoef,
-    metrics.f1_score,
-    metrics.precision_score,
-    metrics.average_precision_score,
-    metrics.recall_score,
-    metrics.accuracy_score]))
-all_score_input = {'pred': ['f1', 'precision', 'recall', 'accuracy'],
-                   'proba': ['roc_auc', 'average_precision']}
 
 # minimal and maximal score per score measure
 # TODO extend, only used in ffs now
@@ -71,6 +83,19 @@ default_param_range = {
     'gamma': 10.0 ** numpy.arange(-1, 2)
 }
 
+# parameter search methods, see param_search
+param_search_methods = ['grid', 'path', 'halving']
+
+# feature selection methods, see run_experiment
+feature_selection_methods = ['none', 'ffs', 'bfs']
+
+# directory for shared data files, see SharedDataset
+default_shared_dir = '/dev/shm'
+
+# shared data files of this process that are not removed yet, with the id of
+# the process that stored them
+_shared_files = {}
+
 # timed parameters
 # timed_param = ['C', 'radius', 'n_neighbors']
 
@@ -86,8 +111,10 @@ def cv_scores_no_scaling(data, target, classifier, n, scoring, cv=None):
         cv = cross_validation.StratifiedKFold(target, n)
 
     # return cross-validation scores
-    return cross_validation.cross_val_score(classifier, data, target, cv=cv,
-                                            scoring=scoring)
+    scores = cross_validation.cross_val_score(classifier, data, target, cv=cv,
+                                              scoring=scoring)
+    telemetry.count_fits(len(scores))
+    return scores
 
 
 def grid_search(data, target, classifier, n, scoring, param, cv=None, cpu=1,
@@ -117,6 +144,8 @@ def grid_search(data, target, classifier, n, scoring, param, cv=None, cpu=1,
     clf = GridSearchCV(classifier, param, scoring=scoring, cv=cv, refit=False,
                        n_jobs=cpu)
     clf.fit(data, target)
+    telemetry.count_fits(sum([len(scores) for params, mean_score, scores
+                              in clf.grid_scores_]))
 
     # log results if requested
     if(log_f):
@@ -128,472 +157,2318 @@ def grid_search(data, target, classifier, n, scoring, param, cv=None, cpu=1,
     # return best parameters, and score
     return (clf.best_score_, clf.best_params_)
 
+
+def param_search(data, target, classifier, n, scoring, param, cv=None, cpu=1,
+                 log_f=None, search='grid', timeout=None):
+    '''
+    This method returns the average CV-performance of the best classifier
+    parameters and the best parameters, like grid_search.
+
+    If search is 'path' and the classifier is a linear SVM with only the C
+    parameter to optimize for a two class problem, the regularization path
+    search is used (see path_search). If search is 'halving', the successive
+    halving search is used, which stops after timeout seconds (see
+    halving_search). Otherwise the grid search is used, for nearest neighbors
+    classifiers the grid search on a neighbor table per fold (see
+    neighbor_search).
+
+    NOTE: data is assumed to be already scaled properly!
+    '''
+
+    if not(search in param_search_methods):
+        raise ValueError('Parameter search does not exist: %s' % (search))
+
+    if(search == 'path' and _path_search_possible(classifier, target, param,
+                                                  scoring)):
+        return path_search(data, target, classifier, n, scoring, param, cv=cv,
+                           log_f=log_f)
+    elif(search == 'halving'):
+        return halving_search(data, target, classifier, n, scoring, param,
+                              cv=cv, log_f=log_f, timeout=timeout)
+    elif(_neighbor_search_possible(classifier, target, param, scoring)):
+        return neighbor_search(data, target, classifier, n, scoring, param,
+                               cv=cv, log_f=log_f)
+    else:
+        return grid_search(data, target, classifier, n, scoring, param, cv=cv,
+                           cpu=cpu, log_f=log_f)
+
+
+def narrow_grid(param, best_param, radius):
+    '''
+    Returns the parameter grid param narrowed to the best parameters
+    best_param and the radius nearest values on each side of them (in sorted
+    order), such as the best parameters of a previous feature selection
+    round. The values keep their grid order. Parameters of which the best
+    value is not in the grid are not narrowed.
+    '''
+
+    narrowed = {}
+
+    for name, values in param.iteritems():
+
+        values = list(values)
+        best = best_param.get(name, None)
+
+        if(best in values):
+            ranked = sorted(set(values))
+            best_i = ranked.index(best)
+            near = set(ranked[max(0, best_i - radius):best_i + radius + 1])
+            values = [v for v in values if v in near]
+
+        narrowed[name] = values
+
+    return narrowed
+
+
+def round_grid(param, prev_param, round_i, radius, full_every):
+    '''
+    Returns the parameter grid of feature selection round round_i (counted
+    from 0): param narrowed around the best parameters of the previous round
+    prev_param (see narrow_grid) if a radius is provided, or the full grid
+    param in the first round and every full_every rounds.
+    '''
+    if(not(param) or radius is None or not(prev_param) or
+       (full_every and round_i % full_every == 0)):
+        return param
+    else:
+        return narrow_grid(param, prev_param, radius)
+
+
+def path_search(data, target, classifier, n, scoring, param, cv=None,
+                log_f=None):
+    '''
+    This method does a CV search over the C parameter of a linear SVM for a
+    two class problem, and returns the same as grid_search: the average
+    CV-performance (weighted by test set size) of the best C and the best
+    parameters.
+
+    The C values are fitted from small to large. For a LinearSVC, the primal
+    problem that liblinear solves is solved with Newton's method, starting at
+    the solution of the previous C value (see _squared_hinge_path). For a SVC
+    with linear kernel, the kernel matrix is calculated once and used for all
+    C values.
+
+    NOTE: data is assumed to be already scaled properly!
+
+    data:       feature matrix
+    target:     target class labels
+    classifier: LinearSVC or SVC with linear kernel (with parameters set)
+    param:      {'C': [C values]}
+    n:          number of cross-validation folds
+    scoring:    scoring function to use as classifier performance measure
+    log_f:      (open) file to log data to
+    '''
+
+    # if no cv sets provided, split data in train and test sets
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    c_range = list(param['C'])
+    c_order = numpy.argsort(c_range)
+
+    # the rows of data that the folds use (see _inner_folds)
+    rows = numpy.unique(numpy.concatenate([numpy.r_[trn_is, tst_is]
+                                           for trn_is, tst_is in folds]))
+    classes = numpy.unique(target[rows])
+
+    # the kernel matrix of the svc on these rows, only calculated once
+    if(isinstance(classifier, svm.SVC)):
+        row_data = data if(rows.size == data.shape[0]) else data[rows, :]
+        gram = numpy.dot(row_data, row_data.T)
+        del row_data
+
+    # test scores per fold, per C value
+    scores = numpy.zeros((len(folds), len(c_range)))
+
+    for fold_i, (trn_indices, tst_indices) in enumerate(folds):
+
+        trn_target = target[trn_indices]
+        tst_target = target[tst_indices]
+
+        if(isinstance(classifier, svm.SVC)):
+
+            trn_is = numpy.searchsorted(rows, trn_indices)
+            tst_is = numpy.searchsorted(rows, tst_indices)
+            trn_gram = gram[numpy.ix_(trn_is, trn_is)]
+            tst_gram = gram[numpy.ix_(tst_is, trn_is)]
+
+            # decision values are sufficient for the scoring
+            classifier_param = classifier.get_params()
+            classifier_param.update({'kernel': 'precomputed',
+                                     'probability': False})
+
+            for c_i in c_order:
+                classifier_param['C'] = c_range[c_i]
+                cl = svm.SVC(**classifier_param)
+                cl.fit(trn_gram, trn_target)
+                scores[fold_i, c_i] = scorer.SCORERS[scoring](
+                    cl, tst_gram, tst_target)
+
+        else:
+
+            # cost weight per train sample
+            if(classifier.class_weight == 'auto'):
+                class_weight = compute_class_weight('auto', classes,
+                                                    trn_target)
+            else:
+                class_weight = numpy.array([
+                    (classifier.class_weight or {}).get(c, 1.0)
+                    for c in classes])
+            trn_labels = numpy.searchsorted(classes, trn_target)
+            sample_c = class_weight[trn_labels]
+
+            # second class positive, as decision_function of LinearSVC
+            trn_y = numpy.where(trn_labels == 1, 1.0, -1.0)
+
+            weights = _squared_hinge_path(
+                data[trn_indices, :], trn_y, sample_c,
+                [c_range[c_i] for c_i in c_order],
+                classifier.intercept_scaling)
+
+            for c_i, w in zip(c_order, weights):
+                decision = numpy.dot(data[tst_indices, :], w[:-1]) +\
+                    w[-1] * classifier.intercept_scaling
+                pred = classes[(decision > 0).astype(int)]
+                scores[fold_i, c_i] = spice_metrics.score(
+                    scoring, tst_target, pred, decision)
+
+    telemetry.count_fits(scores.size)
+
+    # average over the folds, weighted by the test set sizes
+    mean_scores = numpy.average(scores, axis=0, weights=[
+        len(tst_indices) for trn_indices, tst_indices in folds])
+
+    # log results if requested
+    if(log_f):
+        for c_i, c in enumerate(c_range):
+            log_f.write('%0.3f;%0.3f;[%s];%r\n' % (
+                mean_scores[c_i], scores[:, c_i].std(),
+                ', '.join(['%.3f' % (s) for s in scores[:, c_i]]), {'C': c}))
+        log_f.write('\n')
+
+    # first best C value, as grid_search
+    best_i = numpy.argmax(mean_scores)
+
+    # return best parameters, and score
+    return (mean_scores[best_i], {'C': c_range[best_i]})
+
+
+def kernel_search(base, num_features, target, classifier, n, scoring, param,
+                  cv=None, log_f=None):
+    '''
+    This method does a CV grid search for a SVC with rbf or linear kernel on
+    a precomputed base matrix, and returns the same as grid_search: the
+    average CV-performance (weighted by test set size) of the best parameters
+    and the best parameters.
+
+    The base matrix contains the squared euclidean distances between the
+    samples for the rbf kernel, or the inner products (Gram matrix) for the
+    linear kernel. The kernel matrix is calculated once per gamma value and
+    used for all C values.
+
+    base:         n x n base matrix of the data
+    num_features: number of features of the data, used for the default gamma
+    target:       target class labels
+    classifier:   SVC with rbf or linear kernel (with parameters set)
+    param:        grid parameters that are suitable for the given classifier
+    n:            number of cross-validation folds
+    scoring:      scoring function to use as classifier performance measure
+    log_f:        (open) file to log data to
+    '''
+
+    # if no cv sets provided, split data in train and test sets
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    # decision values are sufficient for the scoring
+    classifier_param = classifier.get_params()
+    classifier_param.update({'kernel': 'precomputed', 'probability': False})
+
+    # same parameter order as grid_search
+    param_grid = list(ParameterGrid(param))
+
+    # kernel matrix per gamma value
+    kernels = {}
+
+    # test scores per fold, per parameter setting
+    scores = numpy.zeros((len(folds), len(param_grid)))
+
+    for p_i, p in enumerate(param_grid):
+
+        cl_param = classifier_param.copy()
+        cl_param.update(p)
+
+        if(classifier.kernel == 'rbf'):
+            gamma = cl_param['gamma']
+            if(gamma in [0.0, 'auto']):
+                gamma = 1.0 / num_features
+            if not(gamma in kernels):
+                kernels[gamma] = numpy.exp(-gamma * base)
+            kernel = kernels[gamma]
+        else:
+            kernel = base
+
+        for fold_i, (trn_indices, tst_indices) in enumerate(folds):
+            cl = svm.SVC(**cl_param)
+            cl.fit(kernel[numpy.ix_(trn_indices, trn_indices)],
+                   target[trn_indices])
+            scores[fold_i, p_i] = scorer.SCORERS[scoring](
+                cl, kernel[numpy.ix_(tst_indices, trn_indices)],
+                target[tst_indices])
+
+    telemetry.count_fits(scores.size)
+
+    # average over the folds, weighted by the test set sizes
+    mean_scores = numpy.average(scores, axis=0, weights=[
+        len(tst_indices) for trn_indices, tst_indices in folds])
+
+    # log results if requested
+    if(log_f):
+        for p_i, p in enumerate(param_grid):
+            log_f.write('%0.3f;%0.3f;[%s];%r\n' % (
+                mean_scores[p_i], scores[:, p_i].std(),
+                ', '.join(['%.3f' % (s) for s in scores[:, p_i]]), p))
+        log_f.write('\n')
+
+    # first best parameters, as grid_search
+    best_i = numpy.argmax(mean_scores)
+
+    # return best parameters, and score
+    return (mean_scores[best_i], param_grid[best_i])
+
+
+def kernel_base(data, kernel):
+    '''
+    Returns the base matrix of the data for kernel_search: the squared
+    euclidean distances for the rbf kernel, or the Gram matrix for the linear
+    kernel. Both are sums over the features, so the base matrix of a feature
+    set is the sum of the base matrices of the features.
+    '''
+    if(kernel == 'rbf'):
+        sq_norms = (data ** 2).sum(axis=1)
+        base = sq_norms[:, numpy.newaxis] + sq_norms - 2.0 * numpy.dot(
+            data, data.T)
+        return numpy.maximum(base, 0.0)
+    elif(kernel == 'linear'):
+        return numpy.dot(data, data.T)
+    else:
+        raise ValueError('Kernel not supported: %s' % (kernel))
+
+
+def _cached_kernel(classifier):
+    '''
+    Returns the kernel of the classifier if the kernel_search can be used for
+    it, None otherwise.
+    '''
+    if(isinstance(classifier, svm.SVC) and
+            classifier.kernel in ['rbf', 'linear']):
+        return classifier.kernel
+    else:
+        return None
+
+
+def _path_search_possible(classifier, target, param, scoring):
+    '''
+    Returns True if path_search can be used for the classifier, target, and
+    parameters.
+    '''
+
+    if not(param.keys() == ['C'] and len(numpy.unique(target)) == 2):
+        return False
+
+    if(isinstance(classifier, svm.LinearSVC)):
+        p = classifier.get_params()
+        return (p['penalty'] == 'l2' and p['fit_intercept'] and
+                p['loss'] in ['l2', 'squared_hinge'] and
+                scoring in all_score_names)
+    elif(isinstance(classifier, svm.SVC)):
+        return (classifier.kernel == 'linear' and
+                scoring in scorer.SCORERS)
+    else:
+        return False
+
+
+def _squared_hinge_path(data, y, sample_c, c_range, intercept_scaling,
+                        tol=1e-6, max_iter=100):
+    '''
+    Solves the L2-regularized squared hinge loss problem that liblinear solves
+    for a LinearSVC:
+
+        min_w 0.5 w'w + sum_i C_i max(0, 1 - y_i w'x_i)^2
+
+    for each C value in c_range (small to large), in which C_i is C times the
+    cost weight sample_c of sample i, and x_i is sample i extended with the
+    (regularized) bias feature intercept_scaling. Newton's method is used,
+    starting at the solution of the previous C value. Returns the weight
+    vectors w, the last weight is the bias weight.
+
+    y:  labels, -1.0 or 1.0
+    '''
+
+    x = numpy.hstack([data, numpy.ones((data.shape[0], 1)) *
+                      intercept_scaling])
+    w = numpy.zeros(x.shape[1])
+    eye = numpy.eye(x.shape[1])
+
+    def objective(w, cost):
+        margin = numpy.maximum(0.0, 1.0 - y * numpy.dot(x, w))
+        return 0.5 * numpy.dot(w, w) + numpy.dot(cost, margin ** 2)
+
+    weights = []
+    for c in c_range:
+
+        cost = c * sample_c
+
+        # gradient norm at w = 0, to determine convergence
+        g0_norm = numpy.linalg.norm(2.0 * numpy.dot(x.T, cost * y))
+
+        for iter_i in xrange(max_iter):
+
+            # samples that contribute to the loss
+            margin = 1.0 - y * numpy.dot(x, w)
+            act = margin > 0.0
+            x_act = x[act, :]
+
+            grad = w - 2.0 * numpy.dot(x_act.T, cost[act] * y[act] *
+                                       margin[act])
+            if(numpy.linalg.norm(grad) <= tol * g0_norm):
+                break
+
+            # (generalized) Hessian
+            hess = eye + 2.0 * numpy.dot(x_act.T * cost[act], x_act)
+            step = -numpy.linalg.solve(hess, grad)
+
+            # backtracking line search
+            f = objective(w, cost)
+            descent = numpy.dot(grad, step)
+            t = 1.0
+            while(objective(w + t * step, cost) > f + 0.01 * t * descent and
+                  t > 1e-10):
+                t *= 0.5
+            w = w + t * step
+
+        weights.append(w.copy())
+
+    return weights
+
+
+def neighbor_search(data, target, classifier, n, scoring, param, cv=None,
+                    log_f=None):
+    '''
+    This method does a CV grid search for a k-nearest neighbors or radius
+    neighbors classifier, and returns the same as grid_search: the average
+    CV-performance (weighted by test set size) of the best parameters and the
+    best parameters.
+
+    The neighbors of the test samples of a fold are queried once, up to the
+    largest n_neighbors or radius in the grid, and the predictions and
+    probabilities of all parameter settings (n_neighbors or radius, and
+    weights) are obtained from this neighbor table, as the classifier with
+    these settings would, instead of fitting a classifier per setting. The
+    results are the same as those of grid_search, except that neighbors at
+    equal distance may be in a different order.
+
+    NOTE: data is assumed to be already scaled properly!
+
+    data:       feature matrix
+    target:     target class labels
+    classifier: KNeighborsClassifier or RadiusNeighborsClassifier (with
+                parameters set)
+    param:      grid parameters, n_neighbors or radius, and weights
+    n:          number of cross-validation folds
+    scoring:    scoring function to use as classifier performance measure
+    log_f:      (open) file to log data to
+    '''
+
+    # if no cv sets provided, split data in train and test sets
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    # same parameter order as grid_search
+    param_grid = list(ParameterGrid(param))
+    classifier_param = classifier.get_params()
+    is_radius = isinstance(classifier, neighbors.RadiusNeighborsClassifier)
+
+    # test scores per fold, per parameter setting
+    scores = numpy.zeros((len(folds), len(param_grid)))
+
+    for fold_i, (trn_indices, tst_indices) in enumerate(folds):
+
+        tst_target = target[tst_indices]
+
+        # class index of the train samples, as the fitted classifier
+        (classes, trn_y) = numpy.unique(target[trn_indices],
+                                        return_inverse=True)
+
+        # neighbor tables per query algorithm (see _neighbor_table)
+        tables = {}
+
+        for p_i, p in enumerate(param_grid):
+
+            cl_param = classifier_param.copy()
+            cl_param.update(p)
+
+            if(is_radius):
+                key = None
+                size = max(param.get('radius', [cl_param['radius']]))
+            else:
+                key = _neighbor_algorithm(cl_param, len(trn_indices))
+                size = max([k for k in param.get('n_neighbors',
+                                                 [cl_param['n_neighbors']])
+                            if _neighbor_algorithm(dict(cl_param,
+                                                        n_neighbors=k),
+                                                   len(trn_indices)) == key])
+
+            # the fold data is only sliced out to fit and query the table
+            if not(key in tables):
+                tables[key] = _neighbor_table(
+                    classifier, cl_param, size, data[trn_indices, :], trn_y,
+                    data[tst_indices, :])
+            (dist, ind) = tables[key]
+
+            if(is_radius):
+                pred = _radius_neighbors_predict(
+                    dist, ind, trn_y, classes, cl_param)
+                proba = pred
+            else:
+                (pred, proba) = _kneighbors_predict(
+                    dist, ind, trn_y, classes, cl_param)
+
+            scores[fold_i, p_i] = spice_metrics.score(
+                scoring, tst_target, pred, proba)
+
+    telemetry.count_fits(len(folds) * len(tables))
+
+    # average over the folds, weighted by the test set sizes
+    mean_scores = numpy.average(scores, axis=0, weights=[
+        len(tst_indices) for trn_indices, tst_indices in folds])
+
+    # log results if requested
+    if(log_f):
+        for p_i, p in enumerate(param_grid):
+            log_f.write('%0.3f;%0.3f;[%s];%r\n' % (
+                mean_scores[p_i], scores[:, p_i].std(),
+                ', '.join(['%.3f' % (s) for s in scores[:, p_i]]), p))
+        log_f.write('\n')
+
+    # first best parameters, as grid_search
+    best_i = numpy.argmax(mean_scores)
+
+    # return best parameters, and score
+    return (mean_scores[best_i], param_grid[best_i])
+
+
+def _neighbor_search_possible(classifier, target, param, scoring):
+    '''
+    Returns True if neighbor_search can be used for the classifier, target,
+    and parameters.
+    '''
+
+    if(isinstance(classifier, neighbors.KNeighborsClassifier)):
+        size_param = 'n_neighbors'
+        score_names = all_score_names
+    elif(isinstance(classifier, neighbors.RadiusNeighborsClassifier)):
+        # the classifier has no probabilities, and the radius query of the
+        # brute force algorithm compares the squared distances
+        size_param = 'radius'
+        score_names = spice_metrics.pred_score_names
+        if(classifier.algorithm == 'brute'):
+            return False
+    else:
+        return False
+
+    return (set(param.keys()) <= set([size_param, 'weights']) and
+            set(param.get('weights', [])) <= set(['uniform', 'distance']) and
+            classifier.weights in ['uniform', 'distance'] and
+            scoring in score_names)
+
+
+def _neighbor_algorithm(cl_param, num_samples):
+    '''
+    Returns the neighbor query algorithm of a KNeighborsClassifier with
+    parameters cl_param, fitted on num_samples samples. The 'auto' algorithm
+    uses brute force if n_neighbors is at least half the number of samples,
+    a tree otherwise.
+    '''
+    if(cl_param['algorithm'] == 'auto'):
+        if(cl_param['n_neighbors'] < num_samples // 2):
+            return 'tree'
+        else:
+            return 'brute'
+    else:
+        return cl_param['algorithm']
+
+
+def _neighbor_table(classifier, cl_param, size, trn_data, trn_y, tst_data):
+    '''
+    Returns the tuple (dist, ind) with the neighbors in trn_data of the
+    tst_data samples, up to size neighbors or radius size, as the classifier
+    with parameters cl_param queries them.
+    '''
+
+    if(isinstance(classifier, neighbors.RadiusNeighborsClassifier)):
+        cl = type(classifier)(**dict(cl_param, radius=size))
+        cl.fit(trn_data, trn_y)
+        return cl.radius_neighbors(tst_data)
+    else:
+        cl = type(classifier)(**dict(cl_param, n_neighbors=size))
+        cl.fit(trn_data, trn_y)
+        return cl.kneighbors(tst_data)
+
+
+def _kneighbors_predict(dist, ind, trn_y, classes, cl_param):
+    '''
+    Returns the predictions and the probabilities of the second class of a
+    KNeighborsClassifier with parameters cl_param, given the table of nearest
+    neighbors (dist, ind).
+    '''
+
+    k = cl_param['n_neighbors']
+    neigh_y = trn_y[ind[:, :k]]
+    weights = _get_weights(dist[:, :k], cl_param['weights'])
+
+    if(weights is None):
+        (mode, _) = stats.mode(neigh_y, axis=1)
+        weights = numpy.ones_like(neigh_y)
+    else:
+        (mode, _) = weighted_mode(neigh_y, weights, axis=1)
+    pred = classes.take(mode.flatten().astype(numpy.int))
+
+    # the neighbor weights per class, in neighbor order
+    proba = numpy.zeros((neigh_y.shape[0], classes.size))
+    rows = numpy.arange(neigh_y.shape[0])
+    for i, idx in enumerate(neigh_y.T):
+        proba[rows, idx] += weights[:, i]
+    normalizer = proba.sum(axis=1)[:, numpy.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    proba /= normalizer
+
+    # probabilities of the second class, as classify
+    return (pred, proba[:, 1] if classes.size > 1 else proba[:, 0])
+
+
+def _radius_neighbors_predict(dist, ind, trn_y, classes, cl_param):
+    '''
+    Returns the predictions of a RadiusNeighborsClassifier with parameters
+    cl_param, given the neighbors (dist, ind) within a radius that is at
+    least as large.
+
+    Raises:
+        ValueError: If a sample has no neighbors and there is no outlier
+                    label.
+    '''
+
+    radius = cl_param['radius']
+    outlier_label = cl_param['outlier_label']
+
+    # neighbors within radius, in query order
+    within = [sample_dist <= radius for sample_dist in dist]
+    neigh_dist = numpy.empty(len(dist), dtype=object)
+    neigh_y = numpy.empty(len(dist), dtype=object)
+    for i, (sample_dist, sample_ind) in enumerate(zip(dist, ind)):
+        neigh_dist[i] = sample_dist[within[i]]
+        neigh_y[i] = trn_y[sample_ind[within[i]]]
+
+    weights = _get_weights(neigh_dist, cl_param['weights'])
+
+    pred = numpy.empty(len(dist), dtype=classes.dtype)
+    outliers = []
+
+    for i in xrange(len(dist)):
+        if(neigh_y[i].size == 0):
+            outliers.append(i)
+        elif(weights is None):
+            pred[i] = classes.take(numpy.int(stats.mode(neigh_y[i])[0]))
+        else:
+            pred[i] = classes.take(numpy.int(
+                weighted_mode(neigh_y[i], weights[i])[0]))
+
+    if(outliers):
+        if(outlier_label is None):
+            raise ValueError('No neighbors found for test samples %r.' %
+                             (outliers))
+        pred[outliers] = outlier_label
+
+    return pred
+
+
+def halving_search(data, target, classifier, n, scoring, param, cv=None,
+                   log_f=None, timeout=None, eta=3):
+    '''
+    This method does a CV successive halving search over the parameter grid,
+    and returns the same as grid_search: the average CV-performance
+    (weighted by test set size) of the best parameters and the best
+    parameters.
+
+    The parameters are evaluated in rounds. In each round, the remaining
+    parameters are evaluated on the first folds of the CV, using a
+    stratified subsample of the train samples, and only the best 1/eta of
+    them are kept for the next round. The number of folds and the subsample
+    grow by a factor eta each round, the last round evaluates the last eta
+    (or fewer) parameters on all folds with all train samples.
+
+    If timeout (seconds) is provided, the search stops when the time is up,
+    and returns the best parameters of the last round that was evaluated
+    for at least one parameter setting.
+
+    NOTE: data is assumed to be already scaled properly!
+
+    data:       feature matrix
+    target:     target class labels
+    classifier: scikit-learn classifier object (with parameters set)
+    param:      grid parameters that are suitable for the given classifier
+    n:          number of cross-validation folds
+    scoring:    scoring function to use as classifier performance measure
+    log_f:      (open) file to log data to
+    timeout:    time budget in seconds
+    '''
+
+    start_time = time.time()
+
+    # if no cv sets provided, split data in train and test sets
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    # same parameter order as grid_search
+    param_grid = list(ParameterGrid(param))
+    classifier_param = classifier.get_params()
+
+    # number of rounds, such that eta or fewer parameters are left
+    num_rounds = 1
+    while(len(param_grid) > eta ** num_rounds):
+        num_rounds += 1
+
+    # the train samples in random order per fold, the subsamples are the
+    # first ones of each class, so that they grow with each round
+    random_state = numpy.random.RandomState(0)
+    perm_trn_indices = [random_state.permutation(trn_indices)
+                        for trn_indices, tst_indices in folds]
+
+    # subsamples should be large enough for all parameters
+    classes = numpy.unique(target)
+    min_size = max(list(param.get('n_neighbors', [])) + [5 * len(classes)])
+
+    # parameter indices left, and (round, score, param_i) of the best one
+    candidates = range(len(param_grid))
+    best = None
+
+    for round_i in xrange(num_rounds):
+
+        fraction = float(eta) ** (round_i + 1 - num_rounds)
+        num_folds = int(numpy.ceil(len(folds) * fraction))
+
+        # stratified subsamples of the train samples of the first folds
+        subsamples = []
+        for trn_indices in perm_trn_indices[:num_folds]:
+            trn_target = target[trn_indices]
+            frac = max(fraction, float(min_size) / len(trn_indices))
+            subsamples.append(numpy.sort(numpy.concatenate([
+                trn_indices[trn_target == c][:int(numpy.ceil(
+                    frac * numpy.sum(trn_target == c)))]
+                for c in classes])))
+
+        if(log_f):
+            log_f.write('round %i: %i parameters, %i folds, %.3f train\n' %
+                        (round_i, len(candidates), num_folds,
+                         min(1.0, float(len(subsamples[0])) /
+                             len(perm_trn_indices[0]))))
+
+        # test scores per evaluated parameter setting
+        round_scores = []
+
+        for param_i in candidates:
+
+            # stop if the time is up, after at least one evaluation
+            if(timeout and best and time.time() - start_time > timeout):
+                break
+
+            cl_param = classifier_param.copy()
+            cl_param.update(param_grid[param_i])
+
+            scores = numpy.zeros(num_folds)
+            for fold_i, trn_indices in enumerate(subsamples):
+                tst_indices = folds[fold_i][1]
+                cl = type(classifier)(**cl_param)
+                cl.fit(data[trn_indices, :], target[trn_indices])
+                telemetry.count_fits()
+                scores[fold_i] = scorer.SCORERS[scoring](
+                    cl, data[tst_indices, :], target[tst_indices])
+
+            # average over the folds, weighted by the test set sizes
+            mean_score = numpy.average(scores, weights=[
+                len(tst_indices) for trn_indices, tst_indices
+                in folds[:num_folds]])
+            round_scores.append((mean_score, param_i))
+
+            if(log_f):
+                log_f.write('%0.3f;%0.3f;[%s];%r\n' % (
+                    mean_score, scores.std(),
+                    ', '.join(['%.3f' % (s) for s in scores]),
+                    param_grid[param_i]))
+
+            # first best parameters of the latest round, as grid_search
+            if(best is None or round_i > best[0] or mean_score > best[1]):
+                best = (round_i, mean_score, param_i)
+
+        if(log_f):
+            log_f.write('\n')
+
+        if(len(round_scores) < len(candidates)):
+            if(log_f):
+                log_f.write('timeout after %i seconds\n\n' %
+                            (time.time() - start_time))
+            break
+
+        # keep the best 1/eta of the parameters, in grid order
+        num_keep = int(numpy.ceil(len(candidates) / float(eta)))
+        ranked = sorted(round_scores, key=lambda s: (-s[0], s[1]))
+        candidates = sorted([param_i for s, param_i in ranked[:num_keep]])
+
+    # return best parameters, and score
+    return (best[1], param_grid[best[2]])
+
+
 #
 # Methods for unscaled data
 #
 
 
-def cv_score(data, target, classifier, n, scoring, param=None, cv=None, cpu=1,
-             log_f=None, standardize=True, refit=True):
+def cv_score(data, target, classifier, n, scoring, param=None, cv=None, cpu=1,
+             log_f=None, standardize=True, refit=True, search='grid',
+             timeout=None, platt=False, copy=True):
+    '''
+    A parameter search (see param_search) is done if parameters (param) are
+    provided. Otherwise the parameters in the provided classifier are used.
+    The timeout is the time budget of each parameter search, if the search
+    supports it.
+
+    If copy is False, the data is standardized in place instead of in a
+    copy, for callers that do not need the unstandardized data afterwards.
+    The CV-loops only copy the train and test data they fit and score on.
+
+    If platt is True and the classifier of a two class problem does not
+    provide probabilities (such as a SVC without probability model), the
+    classifier trained on the full data set is Platt scaled (see
+    PlattClassifier). The sigmoid is fitted once, on the decision function
+    values of the CV test sets.
+
+    The CV-loops run in parallel if cpu > 1, see split_cpu.
+    '''
+
+    # create stratified train and test set generator
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    if(standardize):
+        # create scaler and scale the data with it (in place if not copy)
+        scaler = preprocessing.StandardScaler(copy=copy).fit(data)
+        data = scaler.transform(data)
+
+    print
+    print 'start cross-validation...'
+    print
+
+    # outer CV, the workers share the data
+    (outer_cpu, inner_cpus) = split_cpu(cpu, len(folds))
+    dataset = SharedDataset(data, target, shared=(outer_cpu > 1))
+    try:
+        fold_results = _run_parallel(_cv_fold, [
+            (fold_i, dataset, trn_indices, tst_indices, classifier, n,
+             scoring, param, inner_cpus[fold_i], not(log_f is None), search,
+             timeout)
+            for fold_i, (trn_indices, tst_indices) in enumerate(folds)],
+            outer_cpu, nested=(cpu > outer_cpu))
+    finally:
+        dataset.close()
+
+    (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+        predictions, _) = _gather_folds(fold_results, folds, target, log_f)
+
+    print
+    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
+    print
+    sys.stdout.flush()
+
+    # train classifier on full data set if requested
+    all_data_cl = None
+    if(refit):
+
+        '''
+        # scale the whole data set
+        if(standardize):
+
+            # create scaler for full data set
+            scaler = preprocessing.StandardScaler().fit(data)
+            # scale data set
+            data = scaler.transform(data)
+        '''
+
+        start_time = time.time()
+        start_fits = telemetry.num_fits()
+
+        # obtain the original classifier parameters
+        classifier_param = classifier.get_params()
+
+        # perform grid search, if parameters are provided
+        if(param):
+
+            # optimize parameters on train set (s is train score)
+            (s, p) = param_search(data, target, classifier, n, scoring,
+                                  param, cpu=cpu, log_f=log_f, search=search,
+                                  timeout=timeout)
+
+            # update parameters with the optimized ones
+            classifier_param.update(p)
+
+        # use parameters to create new classifier object and train it
+        all_data_cl = type(classifier)(**classifier_param)
+        all_data_cl.fit(data, target)
+        telemetry.count_fits()
+
+        # calibrate with the out-of-fold decision function values
+        if(platt and len(all_data_cl.classes_) == 2 and
+           not(_has_proba(all_data_cl)) and
+           hasattr(all_data_cl, 'decision_function')):
+            (a, b) = platt_scaling(
+                [p[1] for p in predictions],
+                [p[2] == all_data_cl.classes_[1] for p in predictions])
+            all_data_cl = PlattClassifier(all_data_cl, a, b)
+
+        telemetry.record('refit', seconds=time.time() - start_time,
+                         fits=telemetry.num_fits() - start_fits)
+
+    # return average score over the cv loops
+    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            predictions, all_data_cl)
+
+
+def _cv_fold(fold_i, dataset, trn_indices, tst_indices, classifier, n,
+             scoring, param, cpu, log, search, timeout):
+    '''
+    Runs CV-loop fold_i of cv_score on the (shared) dataset. Returns the test
+    results of the loop (see _test_fold) extended with the grid search log,
+    if log is True.
+    '''
+
+    data = dataset.data
+    target = dataset.target
+
+    # grid search log of this loop, written to the log file afterwards
+    log_f = StringIO.StringIO() if log else None
+
+    # obtain the original classifier parameters
+    classifier_param = classifier.get_params()
+
+    # perform grid search, if parameters are provided
+    if(param):
+
+        if(log_f):
+            log_f.write('CV-loop %i\n' % (fold_i))
+
+        start_time = time.time()
+        start_fits = telemetry.num_fits()
+
+        # optimize parameters on train set (s is train score), the inner
+        # folds index the full data, which is not copied
+        s, p = param_search(data, target, classifier, n, scoring, param,
+                            cv=_inner_folds(target, trn_indices, n),
+                            cpu=cpu, log_f=log_f, search=search,
+                            timeout=timeout)
+
+        telemetry.record('search', fold=fold_i, search=search,
+                         seconds=time.time() - start_time,
+                         fits=telemetry.num_fits() - start_fits, score=s)
+
+        # update parameters with the optimized ones
+        classifier_param.update(p)
+
+    result = _test_fold(fold_i, data, target, trn_indices, tst_indices,
+                        classifier, classifier_param, scoring, None)
+
+    return result + (log_f.getvalue() if log_f else None,)
+
+
+def ffs(data, target, classifier, n, scoring, param=None, cv=None,
+        feat_names=None, log_f=None, standardize=True, cpu=1, prefilter=None,
+        prefilter_measure='f', patience=None, max_features=None,
+        checkpoint_dir=None, search='grid', kernel_cache=False,
+        timeout=None, copy=True, grid_radius=None, full_grid_every=5):
+    '''
+    Forward feature selection. Grid search that includes parameters and all
+    possible combinations of features is to extensive. This method limits
+    the amount of explored feature combinations.
+
+    If prefilter is provided, only the prefilter best features according to
+    the univariate score prefilter_measure, calculated on the train data of
+    each CV-loop (see featmat.rank_features), are used as candidates.
+
+    The classifier parameters are optimized with param_search, using the
+    search method search with time budget timeout. If kernel_cache is True
+    and the classifier is a SVC with rbf or linear kernel, kernel_search is
+    used instead. The base matrix of the selected features is kept per
+    CV-loop, and only the contribution of the candidate feature is added to
+    it (see kernel_base).
+
+    Without parameters, classifiers that are determined by per-class
+    statistics (Gaussian naive Bayes, LDA, QDA, NearestCentroid) are not
+    fitted per candidate. The statistics of the inner CV folds of each
+    CV-loop are calculated once, and sliced per candidate feature set (see
+    class_stats.CVStats).
+
+    In each selection round, the candidate features of all CV-loops are
+    evaluated in parallel if cpu > 1. The selection of a CV-loop stops if the
+    score did not improve in the last patience rounds, if max_features
+    features are selected, if the maximal score is reached, or if there are
+    no candidate features left.
+
+    The selection rounds of each CV-loop, a list of (score, params, feat_is)
+    tuples, are returned as the last item (cv_rounds).
+
+    If grid_radius is provided, the parameters of a selection round are
+    searched on the grid narrowed to the grid_radius nearest values around
+    the best parameters of the previous round of the CV-loop (see
+    narrow_grid). The first round and every full_grid_every rounds use the
+    full grid, and so does the parameter search of the selected features of
+    each CV-loop, before its test.
+
+    If checkpoint_dir is provided, the selection state of each CV-loop is
+    stored in it after every round, and a run with the same settings resumes
+    from the stored state (see save_checkpoint).
+
+    If copy is False, the data is standardized in place (see cv_score).
+    '''
+    #TODO add all_data_cl
+
+    if(feat_names):
+        assert(data.shape[1] == len(feat_names))
+
+    # Create stratified train and test set generator
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    (rand_score, max_score) = metric_rand_max_score[scoring]
+
+    if(checkpoint_dir):
+        settings = checkpoint_settings(
+            'ffs', data, target, folds, classifier, n, scoring, param,
+            standardize=standardize, prefilter=prefilter,
+            prefilter_measure=prefilter_measure, patience=patience,
+            max_features=max_features, search=search,
+            kernel_cache=kernel_cache, timeout=timeout,
+            grid_radius=grid_radius, full_grid_every=full_grid_every)
+
+    if(standardize):
+        # create scaler and scale the data with it (in place if not copy)
+        scaler = preprocessing.StandardScaler(copy=copy).fit(data)
+        data = scaler.transform(data)
+
+    # candidate features per CV-loop, optionally only the best ranked ones
+    candidates = [_candidate_features(data, target, prefilter,
+                                      prefilter_measure, rows=trn_indices)
+                  for trn_indices, tst_indices in folds]
+
+    # keep track of selected features per CV-loop [(score, param, [feat_i])]
+    selects = [[(rand_score, None, [])] for fold in folds]
+
+    # base matrix of the selected features per CV-loop, if kernel_search
+    kernel = _cached_kernel(classifier) if(kernel_cache and param) else None
+    bases = [None for fold in folds]
+
+    # class statistics of the inner CV folds per CV-loop, if the classifier
+    # is determined by them
+    cv_stats = [None for fold in folds]
+    if(not(param) and class_stats.possible(
+            classifier, scoring, numpy.unique(target).size,
+            max([len(c) for c in candidates] or [0]), len(folds) * n)):
+        for fold_i, (trn_indices, tst_indices) in enumerate(folds):
+            cv_stats[fold_i] = class_stats.CVStats(
+                data, target, list(cross_validation.StratifiedKFold(
+                    target[trn_indices], n)),
+                cov=class_stats.needs_cov(classifier),
+                columns=candidates[fold_i], rows=trn_indices)
+
+    # CV-loops for which the selection is still running
+    active = range(len(folds))
+
+    # resume from stored selection state
+    if(checkpoint_dir):
+        for fold_i in xrange(len(folds)):
+            checkpoint = load_checkpoint(checkpoint_dir, fold_i, settings,
+                                         classifier)
+            if(checkpoint):
+                (selects[fold_i], done) = checkpoint
+                if(done):
+                    active.remove(fold_i)
+                print 'CV-loop %i resumed at feature %i' % (
+                    fold_i, len(selects[fold_i]))
+
+    # the workers share the data
+    dataset = SharedDataset(data, target, shared=(cpu > 1))
+
+    selection_i = min([len(selects[fold_i]) - 1 for fold_i in active] or [0])
+
+    try:
+        while(active):
+
+            print
+            print 'FEATURE SELECTION ROUND %i' % (selection_i)
+            print
+            sys.stdout.flush()
+
+            # all feature sets to try this round, for each running CV-loop
+            tasks = [(fold_i, selects[fold_i][-1][2] + [feat_i])
+                     for fold_i in active for feat_i in candidates[fold_i]
+                     if not(feat_i in selects[fold_i][-1][2])]
+
+            # parameter grid of this round per CV-loop, optionally narrowed
+            # around the best parameters of its previous round
+            round_params = dict([(fold_i, round_grid(
+                param, selects[fold_i][-1][1], len(selects[fold_i]) - 1,
+                grid_radius, full_grid_every)) for fold_i in active])
+
+            if(kernel):
+
+                # base matrices of selected features (at start or resume)
+                for fold_i in active:
+                    if(bases[fold_i] is None):
+                        bases[fold_i] = kernel_base(
+                            data[numpy.ix_(folds[fold_i][0],
+                                           selects[fold_i][-1][2])], kernel)
+
+                # evaluate the tasks in chunks of tasks of the same CV-loop,
+                # to send the base matrix once per chunk
+                chunks = _fold_chunks(tasks, active, cpu)
+                chunk_results = _run_parallel(_ffs_kernel_candidates, (
+                    (fold_i, bases[fold_i], dataset, folds[fold_i][0],
+                     [t[1][-1] for t in chunk], kernel, len(chunk[0][1]),
+                     classifier, n, scoring, round_params[fold_i],
+                     [_ffs_log_header(t[1], feat_names) if log_f else None
+                      for t in chunk])
+                    for fold_i, chunk in chunks), cpu)
+                results = [r for chunk_result in chunk_results
+                           for r in chunk_result]
+
+            elif not(cv_stats[active[0]] is None):
+
+                # evaluate the tasks in chunks of tasks of the same CV-loop,
+                # to send the statistics once per chunk
+                chunks = _fold_chunks(tasks, active, cpu)
+                chunk_results = _run_parallel(_ffs_stats_candidates, (
+                    (fold_i, cv_stats[fold_i], dataset, [t[1] for t in chunk],
+                     classifier, scoring)
+                    for fold_i, chunk in chunks), cpu)
+                results = [r for chunk_result in chunk_results
+                           for r in chunk_result]
+
+            else:
+
+                # evaluate the tasks in chunks of tasks of the same CV-loop,
+                # the workers copy the train data of the selected features
+                # once per chunk
+                chunks = _fold_chunks(tasks, active, cpu)
+                chunk_results = _run_parallel(_ffs_candidates, (
+                    (fold_i, dataset, folds[fold_i][0],
+                     selects[fold_i][-1][2], [t[1][-1] for t in chunk],
+                     classifier, n, scoring, round_params[fold_i],
+                     [_ffs_log_header(t[1], feat_names) if log_f else None
+                      for t in chunk], search, timeout)
+                    for fold_i, chunk in chunks), cpu)
+                results = [r for chunk_result in chunk_results
+                           for r in chunk_result]
+
+            still_active = []
+
+            for fold_i in active:
+
+                # results of this CV-loop, in candidate order
+                fold_results = [(best_s, best_p, feat_is)
+                                for (f_i, feat_is), (best_s, best_p, log)
+                                in zip(tasks, results) if f_i == fold_i]
+
+                # write grid search logs
+                if(log_f and param):
+                    log_f.write('CV-loop %i\n' % (fold_i))
+                    for (f_i, feat_is), (best_s, best_p, log) in zip(
+                            tasks, results):
+                        if(f_i == fold_i):
+                            log_f.write(log)
+
+                # obtain the best score of this loop
+                winner = sorted(fold_results,
+                                key=operator.itemgetter(0))[-1]
+                select = selects[fold_i]
+                select.append(winner)
+
+                # add the selected feature to the base matrix
+                if(kernel):
+                    bases[fold_i] = bases[fold_i] + kernel_base(
+                        data[folds[fold_i][0], :][:, winner[2][-1:]], kernel)
+
+                print('CV-loop %i, feature %i: %.3f %s' % (
+                      fold_i, len(select) - 1, winner[0], str(winner[2])))
+
+                # rounds since the best score was obtained
+                scores = [s[0] for s in select]
+                no_improvement = len(scores) - 1 - scores.index(max(scores))
+
+                # keep selecting new features as long as:
+                # - the score improved in the last patience rounds
+                # - max_features has not been reached
+                # - max score has not been reached
+                # - there are more features left
+                done = ((patience and no_improvement >= patience) or
+                        (max_features and len(winner[2]) >= max_features) or
+                        winner[0] >= max_score or
+                        len(winner[2]) >= len(candidates[fold_i]))
+                if not(done):
+                    still_active.append(fold_i)
+
+                if(checkpoint_dir):
+                    save_checkpoint(checkpoint_dir, fold_i, settings, select,
+                                    done, param)
+
+            sys.stdout.flush()
+
+            active = still_active
+            selection_i += 1
+
+    finally:
+        dataset.close()
+
+    fold_results = []
+
+    for fold_i, (trn_indices, tst_indices) in enumerate(folds):
+
+        # pick the best model
+        # TODO: plot scores for the selection iterations...
+        (trn_score, bestp, feat_is) = sorted(
+            selects[fold_i], key=operator.itemgetter(0))[-1]
+
+        # search the parameters of the selected features on the full grid
+        if(param and not(grid_radius is None) and feat_is):
+            (trn_score, bestp) = param_search(
+                data[numpy.ix_(trn_indices, feat_is)], target[trn_indices],
+                classifier, n, scoring, param, cpu=cpu, search=search,
+                timeout=timeout)
+
+        # obtain original classifier parameters and update optimized ones
+        classifier_param = classifier.get_params()
+        if(bestp):
+            classifier_param.update(bestp)
+
+        result = _test_fold(fold_i, data, target, trn_indices, tst_indices,
+                            classifier, classifier_param, scoring, feat_is)
+        fold_results.append(result + (None,))
+
+    (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+        predictions, cv_featis) = _gather_folds(fold_results, folds, target,
+                                                log_f)
+
+    cv_rounds = [select[1:] for select in selects]
+
+    print
+    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
+    print
+
+    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            cv_featis, predictions, cv_rounds)
+
+
+def _ffs_candidates(fold_i, dataset, trn_indices, selected, cand_is,
+                    classifier, n, scoring, param, log_headers, search,
+                    timeout):
+    '''
+    Evaluates candidate features cand_is of CV-loop fold_i of a forward
+    feature selection round, each added to the selected features, on the
+    train samples trn_indices of the (shared) dataset. The train data of the
+    selected features is copied once, into a buffer with a spare column that
+    holds the candidate feature (see _column_buffer). Returns a list of
+    (best_score, best_params, log) tuples, a log is only created if a log
+    header is provided.
+    '''
+
+    trn_data = _column_buffer(dataset.data, trn_indices, selected, spare=1)
+    trn_target = dataset.target[trn_indices]
+
+    results = []
+
+    for feat_i, log_header in zip(cand_is, log_headers):
+
+        start_time = time.time()
+        start_fits = telemetry.num_fits()
+
+        # write the candidate feature into the spare column
+        trn_data[:, -1] = dataset.data[trn_indices, feat_i]
+
+        log_f = StringIO.StringIO() if log_header else None
+
+        if(param):
+
+            # log to grid search file
+            if(log_f):
+                log_f.write(log_header)
+
+            # run parameter search
+            (best_s, best_p) = param_search(trn_data, trn_target, classifier,
+                                            n, scoring, param, log_f=log_f,
+                                            search=search, timeout=timeout)
+        else:
+            # obtain cv score (grid search not neccasary)
+            best_p = classifier.get_params()
+            best_s = numpy.mean(cv_scores_no_scaling(trn_data, trn_target,
+                                                     classifier, n, scoring))
+
+        telemetry.record('candidate', units=1, fold=fold_i,
+                         features=trn_data.shape[1],
+                         seconds=time.time() - start_time,
+                         fits=telemetry.num_fits() - start_fits, score=best_s)
+
+        results.append((best_s, best_p, log_f.getvalue() if log_f else None))
+
+    return results
+
+
+def _ffs_kernel_candidates(fold_i, base, dataset, trn_indices, feat_is,
+                           kernel, num_features, classifier, n, scoring,
+                           param, log_headers):
+    '''
+    Evaluates candidate features feat_is of CV-loop fold_i of a forward
+    feature selection round with kernel_search, on the train samples
+    trn_indices of the (shared) dataset. The base matrix of the selected
+    features (see kernel_base) is extended with each candidate feature in
+    turn. Returns a list of (best_score, best_params, log) tuples, a log is
+    only created if a log header is provided.
+    '''
+
+    # slice out the train data of the candidate features
+    columns = dataset.data[numpy.ix_(trn_indices, feat_is)]
+    trn_target = dataset.target[trn_indices]
+
+    results = []
+
+    for col_i, log_header in enumerate(log_headers):
+
+        start_time = time.time()
+        start_fits = telemetry.num_fits()
+
+        log_f = StringIO.StringIO() if log_header else None
+
+        # log to grid search file
+        if(log_f):
+            log_f.write(log_header)
+
+        # add contribution of the candidate feature to the base matrix
+        cand_base = base + kernel_base(columns[:, col_i:col_i + 1], kernel)
+
+        # run parameter grid search
+        (best_s, best_p) = kernel_search(cand_base, num_features, trn_target,
+                                         classifier, n, scoring, param,
+                                         log_f=log_f)
+
+        telemetry.record('candidate', units=1, fold=fold_i,
+                         features=num_features,
+                         seconds=time.time() - start_time,
+                         fits=telemetry.num_fits() - start_fits, score=best_s)
+
+        results.append((best_s, best_p, log_f.getvalue() if log_f else None))
+
+    return results
+
+
+def _ffs_stats_candidates(fold_i, cv_stats, dataset, cand_feat_is,
+                          classifier, scoring):
+    '''
+    Evaluates the candidate feature sets cand_feat_is of CV-loop fold_i of a
+    forward feature selection round without parameters, on the class
+    statistics cv_stats of the inner CV folds of its train data (see
+    class_stats.CVStats), and the test rows of the (shared) dataset. Returns
+    a list of (best_score, best_params, log) tuples, without logs.
+    '''
+
+    data = dataset.data
+
+    results = []
+
+    for feat_is in cand_feat_is:
+
+        start_time = time.time()
+
+        best_p = classifier.get_params()
+        best_s = numpy.mean(cv_stats.scores(data, classifier, scoring,
+                                            feat_is))
+
+        telemetry.record('candidate', units=1, fold=fold_i,
+                         features=len(feat_is),
+                         seconds=time.time() - start_time, fits=0,
+                         score=best_s)
+
+        results.append((best_s, best_p, None))
+
+    return results
+
+
+def _fold_chunks(tasks, active, cpu):
+    '''
+    Returns the (fold_i, feat_is) tasks of the active CV-loops of a forward
+    feature selection round, divided in chunks of tasks of the same CV-loop,
+    cpu chunks per round in total (at least one per CV-loop), as a list of
+    (fold_i, chunk_tasks) tuples.
+    '''
+    num_chunks = max(1, cpu / len(active))
+    chunks = []
+    for fold_i in active:
+        fold_tasks = [t for t in tasks if t[0] == fold_i]
+        for chunk in numpy.array_split(range(len(fold_tasks)), num_chunks):
+            if(len(chunk) > 0):
+                chunks.append((fold_i, [fold_tasks[i] for i in chunk]))
+    return chunks
+
+
+def _slice_rows(data, row_is, feat_is=None):
+    '''
+    Returns a copy of the rows row_is of data, of the columns feat_is (all if
+    None), for estimators that need the data in one array.
+    '''
+    if(feat_is is None):
+        return data[row_is, :]
+    else:
+        return data[numpy.ix_(row_is, feat_is)]
+
+
+def _inner_folds(target, trn_indices, n):
+    '''
+    Returns the stratified n-fold CV folds of the train samples trn_indices
+    (as param_search would create them for the train data), as indices into
+    the full data. A search on the full data with these folds slices each
+    inner fold from the full data, instead of from a copy of the train data.
+    '''
+    trn_indices = numpy.asarray(trn_indices)
+    return [(trn_indices[trn_is], trn_indices[tst_is]) for trn_is, tst_is
+            in cross_validation.StratifiedKFold(target[trn_indices], n)]
+
+
+def _column_buffer(data, row_is, col_is, spare=0):
+    '''
+    Returns a Fortran-ordered buffer with the rows row_is of the columns
+    col_is of data, followed by spare unused columns. The columns of the
+    buffer are contiguous, so that a column is written at once and the
+    leading columns are a view. The columns are copied one at a time,
+    without an intermediate copy of the data.
+    '''
+    buf = numpy.empty((len(row_is), len(col_is) + spare), order='F')
+    for col_i, feat_i in enumerate(col_is):
+        buf[:, col_i] = data[row_is, feat_i]
+    return buf
+
+
+def _swap_columns(buf, buf_feat_is, col_i, col_j):
+    '''
+    Swaps the columns col_i and col_j of the buffer buf, and their feature
+    indices in the list buf_feat_is.
+    '''
+    if not(col_i == col_j):
+        buf[:, [col_i, col_j]] = buf[:, [col_j, col_i]]
+        (buf_feat_is[col_i], buf_feat_is[col_j]) = (buf_feat_is[col_j],
+                                                    buf_feat_is[col_i])
+
+
+def _ffs_log_header(feat_is, feat_names):
+    '''
+    Returns the grid search log line with the feature set feat_is.
+    '''
+    header = '%s' % (str(feat_is))
+    if(feat_names):
+        header += '[%s]' % (', '.join([feat_names[i] for i in feat_is]))
+    return header + '\n'
+
+
+def bfs(data, target, classifier, n, scoring, param=None, cv=None,
+        feat_names=None, log_f=None, standardize=True, cpu=1, prefilter=None,
+        prefilter_measure='f', checkpoint_dir=None, search='grid',
+        timeout=None, copy=True, grid_radius=None, full_grid_every=5):
+    '''
+    Backward feature selection. Grid search that includes parameters and all
+    possible combinations of features is to extensive. This method limits
+    the amount of explored feature combinations.
+
+    If prefilter is provided, the selection starts with the prefilter best
+    features according to the univariate score prefilter_measure, calculated
+    on the train data of each CV-loop (see featmat.rank_features).
+
+    The classifier parameters are optimized with param_search, using the
+    search method search with time budget timeout. Without parameters,
+    classifiers that are determined by per-class statistics are not fitted
+    per candidate, as in ffs. The parameter grid of the selection rounds is
+    narrowed if grid_radius is provided, as in ffs.
+
+    The CV-loops run in parallel if cpu > 1, see split_cpu.
+
+    If checkpoint_dir is provided, the selection state of each CV-loop is
+    stored in it after every round, and a run with the same settings resumes
+    from the stored state (see save_checkpoint).
+
+    If copy is False, the data is standardized in place (see cv_score).
+    '''
+    # TODO add all_data_cl
+
+    if(feat_names):
+        assert(data.shape[1] == len(feat_names))
+
+    # Create stratified train and test set generator
+    if(cv is None):
+        cv = cross_validation.StratifiedKFold(target, n)
+    folds = list(cv)
+
+    settings = None
+    if(checkpoint_dir):
+        settings = checkpoint_settings(
+            'bfs', data, target, folds, classifier, n, scoring, param,
+            standardize=standardize, prefilter=prefilter,
+            prefilter_measure=prefilter_measure, search=search,
+            timeout=timeout, grid_radius=grid_radius,
+            full_grid_every=full_grid_every)
+
+    if(standardize):
+        # create scaler and scale the data with it (in place if not copy)
+        scaler = preprocessing.StandardScaler(copy=copy).fit(data)
+        data = scaler.transform(data)
+
+    # outer CV, the workers share the data
+    (outer_cpu, inner_cpus) = split_cpu(cpu, len(folds))
+    dataset = SharedDataset(data, target, shared=(outer_cpu > 1))
+    try:
+        fold_results = _run_parallel(_bfs_fold, [
+            (fold_i, dataset, trn_indices, tst_indices, classifier, n,
+             scoring, param, inner_cpus[fold_i], not(log_f is None),
+             feat_names, prefilter, prefilter_measure, checkpoint_dir,
+             settings, search, timeout, grid_radius, full_grid_every)
+            for fold_i, (trn_indices, tst_indices) in enumerate(folds)],
+            outer_cpu, nested=(cpu > outer_cpu))
+    finally:
+        dataset.close()
+
+    (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+        predictions, cv_featis) = _gather_folds(fold_results, folds, target,
+                                                log_f)
+
+    print
+    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
+    print
+
+    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            cv_featis, predictions)
+
+
+def _bfs_fold(fold_i, dataset, trn_indices, tst_indices, classifier, n,
+              scoring, param, cpu, log, feat_names, prefilter,
+              prefilter_measure, checkpoint_dir, settings, search, timeout,
+              grid_radius, full_grid_every):
     '''
-    A grid search is done if parameters (param) are provided. Otherwise the
-    parameters in the provided classifier are used.
+    Runs the backward feature selection of CV-loop fold_i of bfs on the
+    (shared) dataset. Returns the test results of the loop (see _test_fold)
+    extended with the grid search log, if log is True. The selection state is
+    checkpointed after every round if checkpoint_dir is provided.
     '''
 
-    # create stratified train and test set generator
-    if(cv is None):
-        cv = cross_validation.StratifiedKFold(target, n)
-
-    cv_scores = []
-    cv_params = []
-    cv_confusion = []
-    cv_all_scores = []
-    cv_roc_curves = roc.RocCollection()
-    predictions = []
+    (rand_score, max_score) = metric_rand_max_score[scoring]
 
-    if(standardize):
-        # create scaler and scale the data with it
-        scaler = preprocessing.StandardScaler().fit(data)
-        data = scaler.transform(data)
+    data = dataset.data
+    target = dataset.target
+
+    # slice out the train data, in a buffer of which the columns of the
+    # remaining features are kept in front (see _column_buffer)
+    trn_data = _column_buffer(data, trn_indices, range(data.shape[1]))
+    trn_target = target[trn_indices]
+
+    # grid search log of this loop, written to the log file afterwards
+    log_f = StringIO.StringIO() if log else None
+
+    # candidate features, optionally only the best ranked ones
+    candidates = _candidate_features(trn_data, trn_target, prefilter,
+                                     prefilter_measure)
+
+    # keep track of removed features, start without the filtered ones
+    filtered = sorted(set(xrange(data.shape[1])) - set(candidates))
+    select = [(rand_score, None, filtered),
+              (rand_score, None, filtered)]
+
+    # class statistics of the inner CV folds, if the classifier is
+    # determined by them
+    cv_stats = None
+    if(not(param) and class_stats.possible(
+            classifier, scoring, numpy.unique(trn_target).size,
+            len(candidates), n)):
+        cv_stats = class_stats.CVStats(
+            trn_data, trn_target,
+            list(cross_validation.StratifiedKFold(trn_target, n)),
+            cov=class_stats.needs_cov(classifier), columns=candidates)
+
+    # resume from stored selection state
+    if(checkpoint_dir):
+        checkpoint = load_checkpoint(checkpoint_dir, fold_i, settings,
+                                     classifier)
+        if(checkpoint):
+            select = checkpoint[0]
+            print 'CV-loop %i resumed at feature %i' % (fold_i,
+                                                         len(select) - 1)
+
+    # move the columns of the removed features behind the num_remaining
+    # columns of the remaining ones, the class statistics do not use the
+    # train data buffer
+    buf_feat_is = range(data.shape[1])
+    num_remaining = data.shape[1]
+    if(cv_stats is None):
+        for feat_i in select[-1][2]:
+            _swap_columns(trn_data, buf_feat_is, buf_feat_is.index(feat_i),
+                          num_remaining - 1)
+            num_remaining -= 1
 
     print
-    print 'start cross-validation...'
+    print 'FEATURE SELECTION CV-LOOP %i' % (fold_i)
     print
 
-    # outer CV
-    for fold_i, (trn_indices, tst_indices) in enumerate(cv):
+    # for now, let's test until we are at a single feature
+    for selection_i in xrange(len(select) - 2, len(candidates) - 1):
+
+        # store results for each added feature of this loop
+        results = []
+
+        # parameter grid of this round, optionally narrowed around the best
+        # parameters of the previous round
+        round_param = round_grid(param, select[-1][1], selection_i,
+                                 grid_radius, full_grid_every)
+
+        for cand_i, feat_i in enumerate(candidates):
+
+            sys.stdout.write('.')
+            if((cand_i + 1) % 80 == 0):
+                sys.stdout.write('\n')
+            sys.stdout.flush()
+
+            # only try features that are not already selected
+            if not(feat_i in select[-1][2]):
+
+                start_time = time.time()
+                start_fits = telemetry.num_fits()
+
+                # add current feature index to selection (copy)
+                remove_is = select[-1][2][:]
+                remove_is.append(feat_i)
+
+                removed = set(remove_is)
+                feat_is = [fi for fi in xrange(data.shape[1])
+                           if not fi in removed]
+
+                # leave the candidate feature out by swapping its column to
+                # the last remaining one, the leading columns are a view
+                if(cv_stats is None):
+                    _swap_columns(trn_data, buf_feat_is,
+                                  buf_feat_is.index(feat_i),
+                                  num_remaining - 1)
+                    trn_data_part = trn_data[:, :num_remaining - 1]
+
+                if(param):
+
+                    # log to grid search file
+                    if(log_f):
+                        log_f.write('%s' % (str(feat_is)))
+                        if(feat_names):
+                            log_f.write('[%s]' % (', '.join([feat_names[i]
+                                        for i in feat_is])))
+                        log_f.write('\n')
+
+                    # run parameter search
+                    (best_s, best_p) = param_search(
+                        trn_data_part, trn_target, classifier, n, scoring,
+                        round_param, log_f=log_f, cpu=cpu, search=search,
+                        timeout=timeout)
+                elif not(cv_stats is None):
+                    # obtain cv score from the class statistics
+                    best_p = classifier.get_params()
+                    best_s = numpy.mean(cv_stats.scores(
+                        trn_data, classifier, scoring, feat_is))
+                else:
+                    # obtain cv score (grid search not neccasary)
+                    best_p = classifier.get_params()
+                    best_s = numpy.mean(cv_scores_no_scaling(
+                        trn_data_part, trn_target, classifier, n, scoring))
+
+                telemetry.record('candidate', units=1, fold=fold_i,
+                                 features=len(feat_is),
+                                 seconds=time.time() - start_time,
+                                 fits=telemetry.num_fits() - start_fits,
+                                 score=best_s)
+
+                # store the result
+                results.append((best_s, best_p, remove_is))
+
+        # obtain the best score of this loop
+        winner = sorted(results, key=operator.itemgetter(0))[-1]
+
+        print('\nFeature %i: %s' % (len(select) - 1, str(winner)))
+
+        select.append(winner)
+
+        # remove the column of the removed feature
+        if(cv_stats is None):
+            _swap_columns(trn_data, buf_feat_is,
+                          buf_feat_is.index(winner[2][-1]), num_remaining - 1)
+            num_remaining -= 1
+
+        if(checkpoint_dir):
+            save_checkpoint(checkpoint_dir, fold_i, settings, select,
+                            selection_i == len(candidates) - 2, param)
+
+    # pick the best model (the one before last in the selection)
+    #if(len(select) == 3):
+    #    (trn_score, bestp, feat_is) = select[2]
+    #else:
+    #    (trn_score, bestp, feat_is) = select[-2]
+    # TODO: plot scores for the selection iterations...
+    (trn_score, bestp, remove_is) = sorted(
+        select, key=operator.itemgetter(0))[-1]
+
+    removed = set(remove_is)
+    feat_is = [fi for fi in xrange(data.shape[1]) if not fi in removed]
+
+    # search the parameters of the selected features on the full grid
+    if(param and not(grid_radius is None)):
+        (trn_score, bestp) = param_search(
+            data[numpy.ix_(trn_indices, feat_is)], trn_target, classifier,
+            n, scoring, param, cpu=cpu, search=search, timeout=timeout)
+
+    # obtain original classifier parameters and update optimized ones
+    classifier_param = classifier.get_params()
+    if(bestp):
+        classifier_param.update(bestp)
+
+    result = _test_fold(fold_i, data, target, trn_indices, tst_indices,
+                        classifier, classifier_param, scoring, feat_is)
+
+    return result + (log_f.getvalue() if log_f else None,)
+
+
+def run_experiment(method, data, target, classifier, n, scoring, param=None,
+                   cv=None, log_f=None, **kwargs):
+    '''
+    Runs a CV experiment with feature selection method (see
+    feature_selection_methods): cv_score ('none'), ffs, or bfs. The keyword
+    arguments are passed on to the method, the ones it does not use are
+    ignored.
+
+    Returns the tuple (cv_scores, cv_params, cv_confusion, cv_all_scores,
+    cv_roc_curves, cv_feat_is, predictions, all_data_cl, cv_rounds), in
+    which the items that a method does not provide are None.
+
+    The start and end of the experiment, and its folds and feature selection
+    candidates, are recorded in the telemetry file of the job, if it has one
+    (see spice.telemetry).
+    '''
 
-        # slice out the train and test data
-        trn_data = data[trn_indices, :]
-        tst_data = data[tst_indices, :]
-        trn_target = target[trn_indices]
-        tst_target = target[tst_indices]
+    if not(method in feature_selection_methods):
+        raise ValueError('Feature selection method does not exist: %s' %
+                         (method))
 
-        '''
-        if(standardize):
+    cv_feat_is = None
+    all_data_cl = None
+    cv_rounds = None
+
+    num_folds = n if(cv is None) else len(cv)
+    telemetry.start_experiment(
+        _experiment_units(method, data.shape[1], num_folds,
+                          kwargs.get('prefilter', None),
+                          kwargs.get('max_features', None)),
+        method=method, classifier=type(classifier).__name__,
+        samples=data.shape[0], features=data.shape[1], folds=num_folds)
+    start_time = time.time()
+
+    if(method == 'none'):
+        kwargs = dict([(k, v) for k, v in kwargs.iteritems()
+                       if k in ['cpu', 'standardize', 'refit', 'search',
+                                'timeout', 'platt', 'copy']])
+        (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            predictions, all_data_cl) = cv_score(
+                data, target, classifier, n, scoring, param=param, cv=cv,
+                log_f=log_f, **kwargs)
+
+    elif(method == 'ffs'):
+        kwargs = dict([(k, v) for k, v in kwargs.iteritems()
+                       if k in ['feat_names', 'cpu', 'standardize',
+                                'prefilter', 'prefilter_measure', 'patience',
+                                'max_features', 'checkpoint_dir', 'search',
+                                'kernel_cache', 'timeout', 'copy',
+                                'grid_radius', 'full_grid_every']])
+        (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            cv_feat_is, predictions, cv_rounds) = ffs(
+                data, target, classifier, n, scoring, param=param, cv=cv,
+                log_f=log_f, **kwargs)
+
+    elif(method == 'bfs'):
+        kwargs = dict([(k, v) for k, v in kwargs.iteritems()
+                       if k in ['feat_names', 'cpu', 'standardize',
+                                'prefilter', 'prefilter_measure',
+                                'checkpoint_dir', 'search', 'timeout',
+                                'copy', 'grid_radius', 'full_grid_every']])
+        (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            cv_feat_is, predictions) = bfs(
+                data, target, classifier, n, scoring, param=param, cv=cv,
+                log_f=log_f, **kwargs)
+
+    telemetry.end_experiment(seconds=time.time() - start_time)
 
-            # create scaler using the training instances
-            scaler = preprocessing.StandardScaler().fit(trn_data)
+    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            cv_feat_is, predictions, all_data_cl, cv_rounds)
 
-            # scale the train and test data
-            trn_data = scaler.transform(trn_data)
-            tst_data = scaler.transform(tst_data)
-        '''
 
-        # obtain the original classifier parameters
-        classifier_param = classifier.get_params()
+def _experiment_units(method, num_features, num_folds, prefilter,
+                      max_features):
+    '''
+    Returns the number of progress units of an experiment (see
+    run_experiment): a unit per test fold, and a unit per candidate feature
+    set that a feature selection evaluates at most.
+    '''
 
-        # perform grid search, if parameters are provided
-        if(param):
+    num_candidates = num_features
+    if(prefilter):
+        num_candidates = min(prefilter, num_features)
+
+    # evaluated candidates per CV-loop, in each selection round
+    if(method == 'ffs'):
+        num_rounds = num_candidates
+        if(max_features):
+            num_rounds = min(max_features, num_candidates)
+        round_sizes = [num_candidates - i for i in xrange(num_rounds)]
+    elif(method == 'bfs'):
+        round_sizes = [num_candidates - i
+                       for i in xrange(num_candidates - 1)]
+    else:
+        round_sizes = []
 
-            if(log_f):
-                log_f.write('CV-loop %i\n' % (fold_i))
+    return num_folds * (1 + sum(round_sizes))
 
-            # optimize parameters on train set (s is train score)
-            _, p = grid_search(trn_data, trn_target, classifier, n,
-                               scoring, param, cpu=cpu, log_f=log_f)
 
-            # update parameters with the optimized ones
-            classifier_param.update(p)
+def run_experiments(data, target, experiments, cpu=1):
+    '''
+    Runs a batch of CV experiments on the same data set, in parallel if
+    cpu > 1. Each experiment is a tuple (method, feat_is, classifier, n,
+    scoring, param, cv, kwargs), and uses the feature columns feat_is of the
+    data (see run_experiment).
 
-        # use parameters to create new classifier object and train it
-        best_cl = type(classifier)(**classifier_param)
-        best_cl.fit(trn_data, trn_target)
+    The workers share the data (see SharedDataset), only the feature columns
+    of the running experiments are copied. The cores are used for the
+    experiments first, as for the CV-loops in split_cpu.
 
-        # test the classifier on the test set
-        (score, all_scores, confusion, roc_curve, probas) = test_classifier(
-            tst_data, tst_target, best_cl, scoring)
+    Returns a (result, log) tuple per experiment in experiments order, the
+    result of run_experiment and the parameter search log.
+    '''
 
-        print 'fold %i: %.3f' % (fold_i, score)
-        sys.stdout.flush()
+    (outer_cpu, inner_cpus) = split_cpu(cpu, len(experiments))
+    dataset = SharedDataset(data, target, shared=(outer_cpu > 1))
+    try:
+        return _run_parallel(_batch_experiment, [
+            (dataset, method, feat_is, classifier, n, scoring, param, cv,
+             dict(kwargs, cpu=inner_cpus[exp_i]))
+            for exp_i, (method, feat_is, classifier, n, scoring, param, cv,
+                        kwargs) in enumerate(experiments)],
+            outer_cpu, nested=(cpu > outer_cpu))
+    finally:
+        dataset.close()
+
+
+def _batch_experiment(dataset, method, feat_is, classifier, n, scoring,
+                      param, cv, kwargs):
+    '''
+    Runs one experiment of run_experiments on the feature columns feat_is of
+    the (shared) dataset.
+    '''
 
-        # store test scores for this cv loop
-        cv_scores.append(score)
-        cv_all_scores.append(all_scores)
-        cv_confusion.append(confusion)
-        if(roc_curve):
-            cv_roc_curves.add(roc_curve)
-        predictions.extend(zip(tst_indices, probas, tst_target))
+    data = numpy.asarray(dataset.data[:, feat_is])
+    target = numpy.asarray(dataset.target)
 
-        # store classifier parameters
-        cv_params.append(classifier_param)
+    log_f = StringIO.StringIO()
+    result = run_experiment(method, data, target, classifier, n, scoring,
+                            param=param, cv=cv, log_f=log_f, **kwargs)
 
-    print
-    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
-    print
-    sys.stdout.flush()
+    return (result, log_f.getvalue())
 
-    # train classifier on full data set if requested
-    all_data_cl = None
-    if(refit):
 
-        '''
-        # scale the whole data set
-        if(standardize):
+def _test_fold(fold_i, data, target, trn_indices, tst_indices, classifier,
+               classifier_param, scoring, feat_is):
+    '''
+    Trains a classifier with parameters classifier_param on the train samples
+    trn_indices of the data, using only the features feat_is (all if None),
+    and tests it on the test samples tst_indices. Returns the tuple (score,
+    all_scores, confusion, roc_curve, probas, classifier_param, feat_is).
+    '''
 
-            # create scaler for full data set
-            scaler = preprocessing.StandardScaler().fit(data)
-            # scale data set
-            data = scaler.transform(data)
-        '''
+    trn_target = target[trn_indices]
+    tst_target = target[tst_indices]
+
+    # use parameters to create new classifier object and train it, the train
+    # and test data (selected features) are each sliced out when they are
+    # used, so that the train data copy is released before the test data
+    # is sliced out
+    start_time = time.time()
+    best_cl = type(classifier)(**classifier_param)
+    best_cl.fit(_slice_rows(data, trn_indices, feat_is), trn_target)
+    telemetry.count_fits()
+    fit_time = time.time() - start_time
+
+    # test the classifier on the test set
+    start_time = time.time()
+    (score, all_scores, confusion, roc_curve, probas) = test_classifier(
+        _slice_rows(data, tst_indices, feat_is), tst_target, best_cl,
+        scoring)
+    predict_time = time.time() - start_time
+
+    num_features = data.shape[1] if(feat_is is None) else len(feat_is)
+    telemetry.record('fold', units=1, fold=fold_i,
+                     features=num_features, fit_time=fit_time,
+                     predict_time=predict_time, score=score)
 
-        # obtain the original classifier parameters
-        classifier_param = classifier.get_params()
+    print
+    print 'fold %i: %.3f' % (fold_i, score)
+    sys.stdout.flush()
 
-        # perform grid search, if parameters are provided
-        if(param):
+    return (score, all_scores, confusion, roc_curve, probas, classifier_param,
+            feat_is)
 
-            # optimize parameters on train set (s is train score)
-            (s, p) = grid_search(data, target, classifier, n, scoring,
-                                 param, cpu=cpu, log_f=log_f)
 
-            # update parameters with the optimized ones
-            classifier_param.update(p)
+class SharedDataset(object):
+    '''
+    Data matrix and target that are shared with worker processes.
+
+    If shared is True, the data and target are stored once in numpy files in
+    shared_dir (default_shared_dir if available and with enough free space,
+    the temporary directory otherwise), which the workers open memory-mapped
+    (read-only). Only the file paths are pickled, so the workers get the
+    data without copies. Otherwise the arrays are kept in memory (and pickled
+    as usual).
+
+    The object that stored the files removes them with close. Files that are
+    not closed are removed when the process exits or is terminated
+    (SIGTERM), and files of killed processes are removed by the next
+    SharedDataset in the same dir.
+    '''
 
-        # use parameters to create new classifier object and train it
-        all_data_cl = type(classifier)(**classifier_param)
-        all_data_cl.fit(data, target)
+    def __init__(self, data, target, shared=True, shared_dir=None):
 
-    # return average score over the cv loops
-    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
-            predictions, all_data_cl)
+        self.shared = shared
+        self._owner = True
 
+        if(shared):
 
-def ffs(data, target, classifier, n, scoring, param=None, cv=None,
-        feat_names=None, log_f=None, standardize=True, cpu=1):
-    '''
-    Forward feature selection. Grid search that includes parameters and all
-    possible combinations of features is to extensive. This method limits
-    the amount of explored feature combinations.
-    '''
-    #TODO add all_data_cl
+            if(shared_dir is None):
+                size = data.nbytes + target.nbytes
+                if(os.path.isdir(default_shared_dir) and
+                        _free_space(default_shared_dir) > 2 * size):
+                    shared_dir = default_shared_dir
+                else:
+                    shared_dir = tempfile.gettempdir()
 
-    if(feat_names):
-        assert(data.shape[1] == len(feat_names))
+            _remove_stale_files(shared_dir)
+            _register_cleanup()
 
-    # Create stratified train and test set generator
-    if(cv is None):
-        cv = cross_validation.StratifiedKFold(target, n)
+            self.data_f = self._save_array(data, shared_dir)
+            self.target_f = self._save_array(target, shared_dir)
+            self._data = None
+            self._target = None
 
-    # keep track of selected features [(tst_score, param, [feat_i])]
-    cv_scores = []
-    cv_params = []
-    cv_confusion = []
-    cv_all_scores = []
-    cv_roc_curves = roc.RocCollection()
-    predictions = []
+        else:
+            self.data_f = None
+            self.target_f = None
+            self._data = data
+            self._target = target
+
+    @property
+    def data(self):
+        if(self._data is None):
+            self._data = numpy.load(self.data_f, mmap_mode='r')
+        return self._data
+
+    @property
+    def target(self):
+        if(self._target is None):
+            self._target = numpy.load(self.target_f, mmap_mode='r')
+        return self._target
+
+    def close(self):
+        '''
+        Removes the shared files, if stored by this object.
+        '''
+        if(self.shared and self._owner):
+            for f in [self.data_f, self.target_f]:
+                _shared_files.pop(f, None)
+                if(os.path.exists(f)):
+                    os.remove(f)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_owner'] = False
+        if(self.shared):
+            state['_data'] = None
+            state['_target'] = None
+        return state
+
+    def _save_array(self, array, shared_dir):
+        # the process id in the file name identifies stale files
+        (fd, f) = tempfile.mkstemp(prefix='spice_%i_' % (os.getpid()),
+                                   suffix='.npy', dir=shared_dir)
+        _shared_files[f] = os.getpid()
+        with os.fdopen(fd, 'wb') as fout:
+            numpy.save(fout, numpy.ascontiguousarray(array))
+        return f
+
+
+def _free_space(d):
+    '''
+    Returns the number of bytes available in the file system of dir d.
+    '''
+    st = os.statvfs(d)
+    return st.f_bavail * st.f_frsize
 
-    cv_featis = []
 
-    (rand_score, max_score) = metric_rand_max_score[scoring]
+def _remove_shared_files():
+    '''
+    Removes the shared data files (see SharedDataset) that this process
+    stored and did not remove yet.
+    '''
+    for f, pid in _shared_files.items():
+        if(pid == os.getpid() and os.path.exists(f)):
+            os.remove(f)
+        del _shared_files[f]
 
-    if(standardize):
-        # create scaler and scale the data with it
-        scaler = preprocessing.StandardScaler().fit(data)
-        data = scaler.transform(data)
 
-    # outer CV
-    for fold_i, (trn_indices, tst_indices) in enumerate(cv):
+def _remove_stale_files(shared_dir):
+    '''
+    Removes the shared data files in shared_dir of processes that do not
+    exist anymore, such as jobs that were killed.
+    '''
+    for f in glob.glob(os.path.join(shared_dir, 'spice_*_*.npy')):
+        try:
+            pid = int(os.path.basename(f).split('_')[1])
+            os.kill(pid, 0)
+        except ValueError:
+            continue
+        except OSError as e:
+            if(e.errno == errno.ESRCH and os.path.exists(f)):
+                os.remove(f)
 
-        # slice out the train and test data
-        trn_data = data[trn_indices, :]
-        tst_data = data[tst_indices, :]
-        trn_target = target[trn_indices]
-        tst_target = target[tst_indices]
 
-        '''
-        if(standardize):
-            # create scaler using the training instances
-            scaler = preprocessing.StandardScaler().fit(trn_data)
+def _terminate(signum, frame):
+    '''
+    SIGTERM handler, removes the shared data files and terminates the process
+    with the default handler.
+    '''
+    _remove_shared_files()
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
 
-            # scale the train and test data
-            trn_data = scaler.transform(trn_data)
-            tst_data = scaler.transform(tst_data)
-        '''
 
-        # initialize list of selected features
-        select = [(rand_score, None, []),
-                  (rand_score, None, [])]
-
-        print
-        print 'FEATURE SELECTION CV-LOOP %i' % (fold_i)
-        print
-
-        # keep selecting new features as long as:
-        # - the score does not decrease
-        # - max score has not been reached
-        # - there are more features left
-        #while((select[-1][0] >= select[-2][0]
-        #        and select[-1][0] < max_score)
-        #        and len(select) - 2 < data.shape[1]):
-        for selection_i in xrange(data.shape[1]):
-
-            # store results for each added feature of this loop
-            results = []
-
-            for feat_i in xrange(data.shape[1]):
-
-                sys.stdout.write('.')
-                if((feat_i + 1) % 80 == 0):
-                    sys.stdout.write('\n')
-                sys.stdout.flush()
-
-                # only try features that are not already selected
-                if not(feat_i in select[-1][2]):
-
-                    # add current feature index to selection (copy)
-                    feat_is = select[-1][2][:]
-                    feat_is.append(feat_i)
-
-                    # slice selected features from data
-                    trn_data_part = trn_data[:, feat_is]
-
-                    if(param):
-
-                        # log to grid search file
-                        if(log_f):
-                            log_f.write('%s' % (str(feat_is)))
-                            if(feat_names):
-                                log_f.write('[%s]' % (', '.join([feat_names[i]
-                                            for i in feat_is])))
-                            log_f.write('\n')
-
-                        # run parameter grid search
-                        (best_s, best_p) = grid_search(
-                            trn_data_part, trn_target, classifier, n, scoring,
-                            param, log_f=log_f, cpu=cpu)
-                    else:
-                        # obtain cv score (grid search not neccasary)
-                        best_p = classifier.get_params()
-                        best_s = numpy.mean(cv_scores_no_scaling(
-                            trn_data_part, trn_target, classifier, n, scoring))
-
-                    # store the result
-                    results.append((best_s, best_p, feat_is))
-
-            # obtain the best score of this loop
-            winner = sorted(results, key=operator.itemgetter(0))[-1]
-
-            print('\nFeature %i: %s' % (len(select) - 1, str(winner)))
-
-            select.append(winner)
-
-        # pick the best model (the one before last in the selection)
-        #if(len(select) == 3):
-        #    (trn_score, bestp, feat_is) = select[2]
-        #else:
-        #    (trn_score, bestp, feat_is) = select[-2]
-        # TODO: plot scores for the selection iterations...
-        (trn_score, bestp, feat_is) = sorted(
-            select, key=operator.itemgetter(0))[-1]
+def _register_cleanup():
+    '''
+    Removes the shared data files at exit and on SIGTERM. The SIGTERM handler
+    is only set in the main thread, if no other handler is set.
+    '''
+    if(getattr(_register_cleanup, 'done', False)):
+        return
+    _register_cleanup.done = True
+    atexit.register(_remove_shared_files)
+    try:
+        if(signal.getsignal(signal.SIGTERM) == signal.SIG_DFL):
+            signal.signal(signal.SIGTERM, _terminate)
+    except ValueError:
+        # not the main thread
+        pass
+
+
+def split_cpu(cpu, n_folds):
+    '''
+    Divides cpu cores over the outer CV-loops and their inner parameter
+    search. Returns the tuple (outer_cpu, inner_cpus), the number of
+    CV-loops that run in parallel, and the list with the number of cores of
+    the inner search of each of the n_folds CV-loops.
+
+    The cores are used for the CV-loops first. If there are more cores than
+    CV-loops, all CV-loops run at once and the remaining cores are divided
+    over their inner searches, which then run in a pool of their own (see
+    _run_parallel with nested).
+    '''
+    outer_cpu = max(1, min(cpu, n_folds))
+    (inner_cpu, rest) = divmod(max(1, cpu), outer_cpu)
+    inner_cpus = [inner_cpu + 1 if fold_i < rest else inner_cpu
+                  for fold_i in xrange(n_folds)]
+    return (outer_cpu, inner_cpus)
 
-        # obtain original classifier parameters and update optimized ones
-        classifier_param = classifier.get_params()
-        if(bestp):
-            classifier_param.update(bestp)
 
-        # use these to create new classifier object and train it
-        best_cl = type(classifier)(**classifier_param)
-        best_cl.fit(trn_data[:, feat_is], trn_target)
+def _run_parallel(func, func_args, cpu, nested=False):
+    '''
+    Calls func for each argument tuple in func_args, using a pool of cpu
+    processes if cpu > 1. The argument tuples are dispatched to the pool as
+    they are generated. Returns the results in func_args order.
 
-        # slice selected features from test data
-        tst_data = tst_data[:, feat_is]
+    The workers of a joblib pool are daemonic, and cannot start a process
+    pool themselves. If nested is True, the workers are not daemonic (see
+    _NestingPool), so that func can run a parallel parameter search.
+    '''
+    if(cpu > 1 and nested):
+        pool = _NestingPool(cpu)
+        try:
+            results = list(pool.imap(_call, ((func, args)
+                                             for args in func_args)))
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+        return results
+    elif(cpu > 1):
+        return joblib.Parallel(n_jobs=cpu)(
+            joblib.delayed(func)(*args) for args in func_args)
+    else:
+        return [func(*args) for args in func_args]
 
-        # test the classifier on the test set
-        (score, all_scores, confusion, roc_curve, probas) = test_classifier(
-            tst_data, tst_target, best_cl, scoring)
 
-        # store test scores for this cv loop
-        cv_scores.append(score)
-        cv_all_scores.append(all_scores)
-        cv_confusion.append(confusion)
-        if(roc_curve):
-            cv_roc_curves.add(roc_curve)
-        predictions.extend(zip(tst_indices, probas, tst_target))
+def _call(func_args):
+    '''
+    Calls func with args, given the tuple (func, args), in a worker of a
+    _NestingPool.
+    '''
+    (func, args) = func_args
+    return func(*args)
 
-        # store classifier parameters
-        cv_params.append(classifier_param)
 
-        # store selected feature indices
-        cv_featis.append(feat_is)
+class _NestingProcess(multiprocessing.Process):
+    '''
+    Process that stays non-daemonic, so that it can have child processes.
+    '''
 
-        print
-        print 'fold %i: %.3f' % (fold_i, score)
+    def _get_daemon(self):
+        return False
 
-    print
-    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
-    print
+    def _set_daemon(self, value):
+        pass
 
-    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
-            cv_featis, predictions)
+    daemon = property(_get_daemon, _set_daemon)
 
 
-def bfs(data, target, classifier, n, scoring, param=None, cv=None,
-        feat_names=None, log_f=None, standardize=True, cpu=1):
+class _NestingPool(multiprocessing.pool.Pool):
     '''
-    Backward feature selection. Grid search that includes parameters and all
-    possible combinations of features is to extensive. This method limits
-    the amount of explored feature combinations.
+    Process pool with non-daemonic workers, which can start a pool of their
+    own. The workers are stopped with the pool (close and join, or
+    terminate).
     '''
-    # TODO add all_data_cl
+    Process = _NestingProcess
 
-    if(feat_names):
-        assert(data.shape[1] == len(feat_names))
 
-    # Create stratified train and test set generator
-    if(cv is None):
-        cv = cross_validation.StratifiedKFold(target, n)
+def _gather_folds(fold_results, folds, target, log_f):
+    '''
+    Collects the results of the CV-loops in fold order, and writes their grid
+    search logs to log_f. Returns the tuple (cv_scores, cv_params,
+    cv_confusion, cv_all_scores, cv_roc_curves, predictions, cv_featis).
+    '''
 
-    # keep track of selected features [(tst_score, param, [feat_i])]
     cv_scores = []
     cv_params = []
     cv_confusion = []
     cv_all_scores = []
     cv_roc_curves = roc.RocCollection()
     predictions = []
-
     cv_featis = []
 
-    (rand_score, max_score) = metric_rand_max_score[scoring]
-
-    if(standardize):
-        # create scaler and scale the data with it
-        scaler = preprocessing.StandardScaler().fit(data)
-        data = scaler.transform(data)
-
-    # outer CV
-    for fold_i, (trn_indices, tst_indices) in enumerate(cv):
-
-        # slice out the train and test data
-        trn_data = data[trn_indices, :]
-        tst_data = data[tst_indices, :]
-        trn_target = target[trn_indices]
-        tst_target = target[tst_indices]
+    for (trn_indices, tst_indices), fold_result in zip(folds, fold_results):
 
-        '''
-        if(standardize):
-            # create scaler using the training instances
-            scaler = preprocessing.StandardScaler().fit(trn_data)
+        (score, all_scores, confusion, roc_curve, probas, classifier_param,
+            feat_is, log) = fold_result
 
-            # scale the train and test data
-            trn_data = scaler.transform(trn_data)
-            tst_data = scaler.transform(tst_data)
-        '''
+        # store test scores for this cv loop
+        cv_scores.append(score)
+        cv_all_scores.append(all_scores)
+        cv_confusion.append(confusion)
+        if(roc_curve):
+            cv_roc_curves.add(roc_curve)
+        predictions.extend(zip(tst_indices, probas, target[tst_indices]))
 
-        # keep track of removed features
-        select = [(rand_score, None, []),
-                  (rand_score, None, [])]
+        # store classifier parameters
+        cv_params.append(classifier_param)
 
-        print
-        print 'FEATURE SELECTION CV-LOOP %i' % (fold_i)
-        print
+        # store selected feature indices
+        cv_featis.append(feat_is)
 
-        # for now, let's test until we are at a single feature
-        for selection_i in xrange(data.shape[1] - 1):
+        # write grid search log of this cv loop
+        if(log_f and log):
+            log_f.write(log)
 
-            # store results for each added feature of this loop
-            results = []
+    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
+            predictions, cv_featis)
 
-            for feat_i in xrange(data.shape[1]):
 
-                sys.stdout.write('.')
-                if((feat_i + 1) % 80 == 0):
-                    sys.stdout.write('\n')
-                sys.stdout.flush()
+def checkpoint_settings(method, data, target, folds, classifier, n, scoring,
+                        param, **kwargs):
+    '''
+    Returns the settings of a feature selection run, a checkpoint is only
+    resumed by a run with the same settings. The data, target, and folds are
+    included as hash.
+    '''
 
-                # only try features that are not already selected
-                if not(feat_i in select[-1][2]):
+    sha1 = hashlib.sha1()
+    sha1.update(numpy.ascontiguousarray(data).tostring())
+    sha1.update(numpy.ascontiguousarray(target).tostring())
+    for trn_indices, tst_indices in folds:
+        sha1.update(numpy.asarray(trn_indices).tostring())
+        sha1.update(numpy.asarray(tst_indices).tostring())
+
+    settings = {
+        'method': method,
+        'data': sha1.hexdigest(),
+        'classifier': '%s %s' % (type(classifier).__name__,
+                                 str(sorted(classifier.get_params().items()))),
+        'n': n,
+        'scoring': scoring,
+        'param': str(sorted([(p, list(r)) for p, r in
+                             (param or {}).iteritems()]))
+    }
+    settings.update(kwargs)
+
+    # as it is stored
+    return json.loads(json.dumps(settings))
+
+
+def save_checkpoint(checkpoint_dir, fold_i, settings, select, done, param):
+    '''
+    Stores the feature selection state of CV-loop fold_i in checkpoint_dir,
+    in the file checkpoint_<fold_i>.json. The state consists of the selection
+    list of (score, params, feat_is) tuples and whether the selection is done.
+    The params are only stored if there is a grid search (param), otherwise
+    these are the classifier parameters and an empty dict is stored.
+    '''
 
-                    # add current feature index to selection (copy)
-                    remove_is = select[-1][2][:]
-                    remove_is.append(feat_i)
+    select = [(float(score), None if p is None else (p if param else {}),
+               [int(fi) for fi in fis]) for score, p, fis in select]
+    checkpoint = {'settings': settings, 'select': select, 'done': bool(done)}
 
-                    feat_is = [fi for fi in xrange(data.shape[1])
-                               if not fi in remove_is]
+    # write to temporary file first, a checkpoint is replaced at once
+    f = os.path.join(checkpoint_dir, 'checkpoint_%i.json' % (fold_i))
+    with open(f + '.tmp', 'w') as fout:
+        json.dump(checkpoint, fout)
+    os.rename(f + '.tmp', f)
 
-                    # slice selected features from data
-                    trn_data_part = trn_data[:, feat_is]
 
-                    if(param):
+def load_checkpoint(checkpoint_dir, fold_i, settings, classifier):
+    '''
+    Returns the feature selection state (select, done) of CV-loop fold_i that
+    is stored in checkpoint_dir (see save_checkpoint), or None if there is no
+    checkpoint with the same settings.
+    '''
 
-                        # log to grid search file
-                        if(log_f):
-                            log_f.write('%s' % (str(feat_is)))
-                            if(feat_names):
-                                log_f.write('[%s]' % (', '.join([feat_names[i]
-                                            for i in feat_is])))
-                            log_f.write('\n')
+    f = os.path.join(checkpoint_dir, 'checkpoint_%i.json' % (fold_i))
+    if not(os.path.exists(f)):
+        return None
+
+    with open(f, 'r') as fin:
+        checkpoint = json.load(fin)
+
+    if not(checkpoint['settings'] == settings):
+        print 'Checkpoint settings differ, ignoring: %s' % (f)
+        return None
+
+    # restore the parameters, empty if these are the classifier parameters
+    select = []
+    for score, p, fis in checkpoint['select']:
+        if(p is None):
+            select.append((score, None, fis))
+        elif(p):
+            select.append((score, dict([(str(k), v) for k, v in p.items()]),
+                           fis))
+        else:
+            select.append((score, classifier.get_params(), fis))
 
-                        # run parameter grid search
-                        (best_s, best_p) = grid_search(
-                            trn_data_part, trn_target, classifier, n, scoring,
-                            param, log_f=log_f, cpu=cpu)
-                    else:
-                        # obtain cv score (grid search not neccasary)
-                        best_p = classifier.get_params()
-                        best_s = numpy.mean(cv_scores_no_scaling(
-                            trn_data_part, trn_target, classifier, n, scoring))
+    return (select, checkpoint['done'])
 
-                    # store the result
-                    results.append((best_s, best_p, remove_is))
 
-            # obtain the best score of this loop
-            winner = sorted(results, key=operator.itemgetter(0))[-1]
+def clear_checkpoints(checkpoint_dir):
+    '''
+    Removes the feature selection checkpoints from checkpoint_dir.
+    '''
+    for f in glob.glob(os.path.join(checkpoint_dir, 'checkpoint_*.json')):
+        os.remove(f)
 
-            print('\nFeature %i: %s' % (len(select) - 1, str(winner)))
 
-            select.append(winner)
+def result_cache_key(data, target, folds, **settings):
+    '''
+    Returns the result cache key of a classification experiment: a hash of
+    the data (the feature columns used), the target, the CV folds, and the
+    settings that determine the result, such as the classifier and the
+    parameter grid (as strings).
+    '''
 
-        # pick the best model (the one before last in the selection)
-        #if(len(select) == 3):
-        #    (trn_score, bestp, feat_is) = select[2]
-        #else:
-        #    (trn_score, bestp, feat_is) = select[-2]
-        # TODO: plot scores for the selection iterations...
-        (trn_score, bestp, remove_is) = sorted(
-            select, key=operator.itemgetter(0))[-1]
+    sha1 = hashlib.sha1()
+    sha1.update(numpy.ascontiguousarray(data).tostring())
+    sha1.update(numpy.ascontiguousarray(target).tostring())
+    for trn_indices, tst_indices in folds:
+        sha1.update(numpy.asarray(trn_indices).tostring())
+        sha1.update(numpy.asarray(tst_indices).tostring())
+    sha1.update(json.dumps(settings, sort_keys=True))
+    return sha1.hexdigest()
 
-        feat_is = [fi for fi in xrange(data.shape[1]) if not fi in remove_is]
 
-        # obtain original classifier parameters and update optimized ones
-        classifier_param = classifier.get_params()
-        if(bestp):
-            classifier_param.update(bestp)
+def load_cached_result(cache_dir, key, out_dir):
+    '''
+    Copies the cached result files with the given key from cache_dir to
+    out_dir. Returns False if there is no cached result with this key.
+    '''
 
-        # use these to create new classifier object and train it
-        best_cl = type(classifier)(**classifier_param)
-        best_cl.fit(trn_data[:, feat_is], trn_target)
+    key_d = os.path.join(cache_dir, key)
+    if not(os.path.isdir(key_d)):
+        return False
 
-        # slice selected features from test data
-        tst_data = tst_data[:, feat_is]
+    for f in glob.glob(os.path.join(key_d, '*')):
+        shutil.copy(f, out_dir)
+    return True
 
-        # test the classifier on the test set
-        (score, all_scores, confusion, roc_curve, probas) = test_classifier(
-            tst_data, tst_target, best_cl, scoring)
 
-        # store test scores for this cv loop
-        cv_scores.append(score)
-        cv_all_scores.append(all_scores)
-        cv_confusion.append(confusion)
-        if(roc_curve):
-            cv_roc_curves.add(roc_curve)
-        predictions.extend(zip(tst_indices, probas, tst_target))
+def store_cached_result(cache_dir, key, out_dir):
+    '''
+    Copies the result files in out_dir (except checkpoints) to the result
+    cache in cache_dir, under the given key. The files are copied to a
+    temporary directory first, so that a cached result is always complete.
+    '''
 
-        # store classifier parameters
-        cv_params.append(classifier_param)
+    key_d = os.path.join(cache_dir, key)
+    if(os.path.exists(key_d)):
+        return
 
-        # store selected feature indices
-        cv_featis.append(feat_is)
+    tmp_d = tempfile.mkdtemp(prefix=key, dir=cache_dir)
+    for f in glob.glob(os.path.join(out_dir, '*')):
+        if(os.path.isfile(f) and not
+           os.path.basename(f).startswith('checkpoint_')):
+            shutil.copy(f, tmp_d)
 
-        print
-        print 'fold %i: %.3f' % (fold_i, score)
+    # another job might have stored the same result in the mean time
+    try:
+        os.rename(tmp_d, key_d)
+    except OSError:
+        shutil.rmtree(tmp_d)
 
-    print
-    print 'cross-validation result: %.3f' % (numpy.mean(cv_scores))
-    print
 
-    return (cv_scores, cv_params, cv_confusion, cv_all_scores, cv_roc_curves,
-            cv_featis, predictions)
+def _candidate_features(data, target, prefilter, measure, rows=None):
+    '''
+    Returns the (sorted) column indices of the prefilter best features, ranked
+    on the rows (all if None) of data, or of all features if prefilter is
+    None. The rows are only sliced out to rank the features.
+    '''
+    if(prefilter):
+        if not(rows is None):
+            (data, target) = (data[rows, :], target[rows])
+        return sorted(featmat.rank_features(data, target, measure)[:prefilter])
+    else:
+        return range(data.shape[1])
 
 
 def classify(data, classifier):
@@ -602,19 +2477,125 @@ def classify(data, classifier):
     pred = classifier.predict(data)
 
     # and predict probabilities (if possible)
-    if(hasattr(classifier, 'predict_proba')):
+    if(_has_proba(classifier)):
         proba = classifier.predict_proba(data)
         # get the probabilities of class one
         # TODO this only works for 2-class problems...
         proba = proba[:, 1]
     elif(hasattr(classifier, 'decision_function')):
         proba = classifier.decision_function(data)
+        # SVC returns a column for two class problems
+        if(proba.ndim == 2 and proba.shape[1] == 1):
+            proba = proba[:, 0]
     else:
         proba = pred
 
     return (pred, proba)
 
 
+def _has_proba(classifier):
+    '''
+    Returns True if the classifier provides probabilities, which SVCs without
+    probability model do not.
+    '''
+    return (hasattr(classifier, 'predict_proba') and
+            getattr(classifier, 'probability', True))
+
+
+def platt_scaling(decision, target, max_iter=100, min_step=1e-10,
+                  sigma=1e-12, eps=1e-5):
+    '''
+    Fits the sigmoid P(target is positive) = 1 / (1 + exp(a * decision + b))
+    to the decision function values of a two class classifier (Platt
+    scaling), using Newton's method with backtracking line search as libsvm
+    does for its probability model. The target contains True (or 1) for the
+    positive class. Returns the tuple (a, b).
+    '''
+
+    decision = numpy.asarray(decision, dtype=float)
+    target = numpy.asarray(target, dtype=bool)
+
+    # regularized targets, to prevent overfitting
+    prior1 = float(target.sum())
+    prior0 = target.size - prior1
+    t = numpy.where(target, (prior1 + 1.0) / (prior1 + 2.0),
+                    1.0 / (prior0 + 2.0))
+
+    def objective(a, b):
+        f_ab = decision * a + b
+        return numpy.sum((t - 1.0) * f_ab + numpy.logaddexp(0.0, f_ab))
+
+    a = 0.0
+    b = numpy.log((prior0 + 1.0) / (prior1 + 1.0))
+    fval = objective(a, b)
+
+    for iter_i in xrange(max_iter):
+
+        # gradient and Hessian (with sigma added to the diagonal)
+        f_ab = decision * a + b
+        p = numpy.exp(-numpy.logaddexp(0.0, f_ab))
+        d1 = t - p
+        d2 = p * (1.0 - p)
+        h11 = sigma + numpy.sum(decision * decision * d2)
+        h22 = sigma + numpy.sum(d2)
+        h21 = numpy.sum(decision * d2)
+        g1 = numpy.sum(decision * d1)
+        g2 = numpy.sum(d1)
+
+        if(abs(g1) < eps and abs(g2) < eps):
+            break
+
+        # Newton direction
+        det = h11 * h22 - h21 * h21
+        d_a = -(h22 * g1 - h21 * g2) / det
+        d_b = -(-h21 * g1 + h11 * g2) / det
+        gd = g1 * d_a + g2 * d_b
+
+        # line search
+        step = 1.0
+        while(step >= min_step):
+            new_f = objective(a + step * d_a, b + step * d_b)
+            if(new_f < fval + 0.0001 * step * gd):
+                a += step * d_a
+                b += step * d_b
+                fval = new_f
+                break
+            step /= 2.0
+
+        if(step < min_step):
+            break
+
+    return (a, b)
+
+
+class PlattClassifier(object):
+    '''
+    Two class classifier of which the probabilities are the Platt scaled
+    (see platt_scaling) decision function values of the trained classifier.
+    The sigmoid (a, b) gives the probability of the second class.
+    '''
+
+    def __init__(self, classifier, a, b):
+        self.classifier = classifier
+        self.a = a
+        self.b = b
+
+    @property
+    def classes_(self):
+        return self.classifier.classes_
+
+    def predict(self, data):
+        return self.classifier.predict(data)
+
+    def decision_function(self, data):
+        return self.classifier.decision_function(data)
+
+    def predict_proba(self, data):
+        decision = numpy.ravel(self.decision_function(data))
+        proba = numpy.exp(-numpy.logaddexp(0.0, decision * self.a + self.b))
+        return numpy.column_stack((1.0 - proba, proba))
+
+
 def test_classifier(tst_data, tst_target, classifier, scoring):
 
     '''
@@ -634,35 +2615,25 @@ def test_classifier(tst_data, tst_target, classifier, scoring):
     '''
     tst_pred, tst_proba = classify(tst_data, classifier)
 
-    args_pred = [tst_target, tst_pred]
-    args_proba = [tst_target, tst_proba]
+    # all scores from one sort of the probas and one confusion matrix
+    scores = spice_metrics.all_scores(tst_target, tst_pred, tst_proba)
 
     # get score
-    if(scoring in all_score_input['proba']):
-        score = all_score_funcs[scoring](*args_proba)
-    else:
-        score = all_score_funcs[scoring](*args_pred)
+    if not(scoring in scores):
+        raise ValueError('%s is not defined for the test set.' % (scoring))
+    score = scores[scoring]
 
-    # some score functions only work for binary case, in that case add -1
+    # some score functions only work for binary case, in that case add -10
     # for a multiclass classifier
-    all_scores = []
-    for sn in all_score_names:
-        sf = all_score_funcs[sn]
-        try:
-            if(sn in all_score_input['proba']):
-                all_scores.append(sf(*args_proba))
-            else:
-                all_scores.append(sf(*args_pred))
-        except Exception:
-            all_scores.append(-10.0)
+    all_scores = [scores.get(sn, -10.0) for sn in all_score_names]
 
     # obtain confusion matrix
-    confusion = metrics.confusion_matrix(tst_target, tst_pred)
+    confusion = spice_metrics.confusion_matrix(tst_target, tst_pred)
 
     roc_curve = None
     if(len(set(tst_target)) == 2):
         # creat ROC curve
-        roc_curve = roc.ROC(*args_proba, class0=0, class1=1)
+        roc_curve = roc.ROC(tst_target, tst_proba, class0=0, class1=1)
 
     # TODO tst_probas do not are not always probabilities... maybe return both
     # raw predictions, probas, and decision_function?
@@ -750,10 +2721,30 @@ def get_timed_parameter_range(classifier, data, target, standardize,
 '''
 
 
-def get_classifier(classifier_str):
+def default_param_grid(classifier_str):
+    '''
+    This function returns the default parameter grid of the classifier with
+    classifier string classifier_str, a dictionary with the value range of
+    each parameter the classifier uses.
+    '''
+    param = {}
+    for par in classifier_params:
+        if(classifier_str in classifiers_per_param[par]):
+            param[par] = default_param_range[par]
+            # reduce C param range for rbf kernel
+            if(par == 'C' and classifier_str == 'svc_rbf'):
+                param[par] = 10.0 ** numpy.arange(-1, 2)
+    return param
+
+
+def get_classifier(classifier_str, probability=True):
     '''
     This functions maps the classifier string classifier_str to the
     corresponding classifier object with the default paramers set.
+
+    If probability is False, SVCs are trained without the probability model
+    of libsvm, which takes an internal 5-fold CV per fit (see cv_score for
+    Platt scaling of the final classifier instead).
     '''
 
     # SVC
@@ -804,6 +2795,9 @@ def get_classifier(classifier_str):
         # raise error if classifier not found
         raise ValueError('Classifier not implemented: %s' % (classifier_str))
 
+    if(isinstance(cl, svm.SVC) and not(probability)):
+        cl.set_params(probability=False)
+
     return (cl)
 
 
@@ -2,6 +2,8 @@
 
 import os
 import sys
+import shutil
+import tempfile
 
 # HACK TODO remove if sklearn is updated to 0.14 on compute servers...
 import sklearn
@@ -10,16 +12,68 @@ if not(sklearn.__version__ == '0.14.1'):
     reload(sklearn)
 assert(sklearn.__version__ == '0.14.1')
 
-from sklearn.externals import joblib
+import numpy
 
 from spice import classification
 from spice import featmat
+from spice import model_store
 from biopy import file_io
 
 
-def classify(fm_dir, cl_dir):
+def load_classifier(cl_dir):
+    '''
+    Returns the trained classifier in cl_dir, the ids of the features that
+    were used to train it, and the standardization statistics of its train
+    data, as tuple (classifier, feature_ids, train_stats). The train_stats
+    are the tuple (mean, std) stored with the classifier (see
+    model_store.save), both None if the train data was not standardized, or
+    None if the classifier was stored without statistics. The arrays of an
+    uncompressed classifier are memory-mapped (see model_store.load).
+    '''
+
+    (classifier, meta) = model_store.load(cl_dir)
+
+    if('mean' in meta):
+        if(meta['mean'] is None):
+            train_stats = (None, None)
+        else:
+            train_stats = (numpy.array(meta['mean']),
+                           numpy.array(meta['std']))
+    else:
+        train_stats = None
+
+    return (classifier, meta['feature_ids'], train_stats)
+
+
+def standardize(data, train_stats):
+    '''
+    Standardizes the rows of data (in place) with the train_stats of a
+    classifier (see load_classifier), if its train data was standardized.
+    '''
+    (mean, std) = train_stats
+    if not(mean is None):
+        data -= mean
+        data /= std
+
+
+def classify(fm_dir, cl_dir, classifier=None, feature_ids=None,
+             chunk_size=None, train_stats=None, data_stats=False):
     '''
     PRE: required features are available in fe_dir!
+
+    The classifier, feature_ids and train_stats are loaded from cl_dir if
+    the classifier or feature_ids are not provided (see load_classifier).
+    The data is standardized with the train_stats, or with the statistics of
+    the whole feature matrix if the classifier was stored without them or if
+    data_stats is True (as classify did before the train statistics were
+    stored).
+
+    If chunk_size is provided, the feature matrix is not loaded at once. Only
+    the classifier features are read, in blocks of chunk_size objects, which
+    are standardized (the statistics of the whole matrix are obtained in a
+    first pass over the blocks if required), classified, and appended to the
+    output files. This keeps the memory usage bounded for large feature
+    matrices.
     '''
 
     f_pre = os.path.basename(os.path.dirname(os.path.dirname(fm_dir)))
@@ -29,29 +83,70 @@ def classify(fm_dir, cl_dir):
     if not(os.path.exists(out_dir)):
         os.makedirs(out_dir)
 
-    # read feature ids that were used to train the classifier
-    cl_settings_f = os.path.join(cl_dir, 'settings.txt')
-    settings_dict = file_io.read_settings_dict(cl_settings_f)
-    feature_ids = settings_dict['feature_names']
+    pred_f = os.path.join(out_dir, '%s_pred.txt' % (f_pre))
+    proba_f = os.path.join(out_dir, '%s_proba.txt' % (f_pre))
+
+    # load trained classifier and the feature ids used to train it
+    if(classifier is None or feature_ids is None):
+        (classifier, feature_ids, train_stats) = load_classifier(cl_dir)
 
-    # obtain feature matrix STANDARDIZED DATA
-    fm = featmat.FeatureMatrix.load_from_dir(fm_dir)
-    feat_is = fm.feature_indices(feature_ids)
-    object_is = range(len(fm.object_ids))
-    data = fm.standardized_slice(feat_is, object_is)
+    if(data_stats):
+        train_stats = None
 
-    # load trained classifier
-    cl_f = os.path.join(cl_dir, 'classifier.joblib.pkl')
-    classifier = joblib.load(cl_f)
+    if(chunk_size is None):
 
-    # run classify method
-    preds, probas = classification.classify(data, classifier)
+        # obtain feature matrix STANDARDIZED DATA
+        fm = featmat.FeatureMatrix.load_from_dir(fm_dir)
+        feat_is = fm.feature_indices(feature_ids)
+        object_is = range(len(fm.object_ids))
+        if(train_stats is None):
+            data = fm.standardized_slice(feat_is, object_is)
+        else:
+            data = fm.slice(feat_is, object_is)
+            standardize(data, train_stats)
 
-    pred_f = os.path.join(out_dir, '%s_pred.txt' % (f_pre))
-    proba_f = os.path.join(out_dir, '%s_proba.txt' % (f_pre))
+        # run classify method
+        preds, probas = classification.classify(data, classifier)
+
+        file_io.write_tuple_list(pred_f, zip(fm.object_ids, preds))
+        file_io.write_tuple_list(proba_f, zip(fm.object_ids, probas))
+
+    else:
+
+        # first pass, standardization statistics of the whole matrix, if the
+        # classifier was stored without those of its train data
+        if(train_stats is None):
+            train_stats = featmat.FeatureMatrix.standardization_stats(
+                fm_dir, feature_ids, chunk_size)
 
-    file_io.write_tuple_list(pred_f, zip(fm.object_ids, preds))
-    file_io.write_tuple_list(proba_f, zip(fm.object_ids, probas))
+        # second pass, classify the STANDARDIZED blocks
+        with open(pred_f, 'w') as pred_out, open(proba_f, 'w') as proba_out:
+            for object_ids, data in featmat.FeatureMatrix.iter_feature_blocks(
+                    fm_dir, feature_ids, chunk_size):
+
+                standardize(data, train_stats)
+
+                preds, probas = classification.classify(data, classifier)
+
+                _append_tuple_list(pred_out, zip(object_ids, preds), out_dir)
+                _append_tuple_list(proba_out, zip(object_ids, probas),
+                                   out_dir)
+
+
+def _append_tuple_list(fout, tuples, tmp_dir):
+    '''
+    Appends the tuples to the open file fout, formatted by
+    file_io.write_tuple_list as the unchunked output. The tuples are written
+    to a temporary file in tmp_dir first, because the writer takes a path.
+    '''
+    (fd, tmp_f) = tempfile.mkstemp(dir=tmp_dir)
+    os.close(fd)
+    try:
+        file_io.write_tuple_list(tmp_f, tuples)
+        with open(tmp_f, 'r') as fin:
+            shutil.copyfileobj(fin, fout)
+    finally:
+        os.remove(tmp_f)
 
 #if __name__ == '__main__':
 # TODO add test runs
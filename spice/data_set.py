@@ -34,6 +34,42 @@ class ProteinDataSet(object):
 
         self.proteins = [Protein(pid) for pid in protein_ids]
 
+    def add_proteins(self, protein_ids, data=None):
+        '''
+        Appends proteins to the data set. The data argument maps a data source
+        id to a list of (protein_id, data_item) tuples for the new proteins.
+        Data is required for each data source that is already available,
+        otherwise the data sources would not correspond to the proteins
+        anymore.
+        '''
+        assert(self.proteins)
+
+        if(data is None):
+            data = {}
+
+        if not(len(protein_ids) == len(set(protein_ids))):
+            raise ValueError('Duplicate ids encoutered.')
+
+        if(set(protein_ids) & set(self.get_protein_ids())):
+            raise ValueError('Protein ids already in the data set.')
+
+        assert(all([type(pid) == str for pid in protein_ids]))
+
+        for ds in self.data_sources:
+            if not(ds.available() == (ds.uid in data)):
+                raise ValueError('%s data should be provided for the new ' %
+                                 (ds.name) + 'proteins if, and only if, it ' +
+                                 'is available for the current proteins.')
+
+        # check and add the data before changing the proteins list
+        for src_id in data.keys():
+            self.ds_dict[src_id].add_data(data[src_id], protein_ids)
+
+        self.proteins.extend([Protein(pid) for pid in protein_ids])
+
+        for src_id in data.keys():
+            self.propagate_data_source_data(self.ds_dict[src_id])
+
     def set_root_dir(self, root_dir):
         self.root_dir = root_dir
         for ds in self.data_sources:
@@ -259,11 +295,34 @@ class DataSource():
             d = dict(self.data)
             self.data = [(i, d[i]) for i in object_ids]
 
+        try:
+            self._check_data(self.data)
+        except ValueError:
+            self.data = None
+            raise
+
+    def add_data(self, data, object_ids):
+        '''
+        Appends data for the new objects with object_ids to the available
+        data, data is a list of (object_id, data_item) tuples.
+        '''
+        d = dict(data)
+        new_data = [(i, d[i]) for i in object_ids]
+
+        self._check_data(new_data)
+
+        # new objects use our own ids if a mapping is used
+        if(self.data_mapping):
+            for i in object_ids:
+                self.data_mapping.setdefault(i, i)
+
+        self.data = self.data + new_data
+
+    def _check_data(self, data):
         for func in self.check_funcs:
             # check only the non-None items
-            items_to_check = [s[1] for s in self.data if not s[1] is None]
+            items_to_check = [s[1] for s in data if not s[1] is None]
             if (any(map(func, items_to_check))):
-                self.data = None
                 raise ValueError('Error in %s data, contains item that %s.' %
                                  (self.name.lower(),
                                  ' '.join(func.__name__.split('_'))))
@@ -461,6 +461,18 @@ class FeatureExtraction(object):
 
         assert(self.fm_protein.object_ids)
 
+        (feat_ids, names, fm) = self._protein_feature_matrix(
+            featcat_id, self.protein_data_set.get_proteins())
+
+        self.fm_protein.add_features(feat_ids, fm, feature_names=names)
+
+    def _protein_feature_matrix(self, featcat_id, proteins):
+        '''
+        Returns the feature ids, feature names, and the feature matrix with
+        the feature values of the provided proteins for the feature category
+        featcat_id.
+        '''
+
         if('_' in featcat_id):
 
             # split feature id and paramaters string
@@ -491,13 +503,63 @@ class FeatureExtraction(object):
         feat_ids = ['%s_%s' % (featcat_id, i) for i in ids]
 
         # initialize empty feature matrix
-        fm = numpy.empty((len(self.fm_protein.object_ids), len(feat_ids)))
+        fm = numpy.empty((len(proteins), len(feat_ids)))
 
         # fill the matrix
-        for index, o in enumerate(self.protein_data_set.get_proteins()):
+        for index, o in enumerate(proteins):
             fm[index, :] = featcat.feature_func(o, *args)
 
-        self.fm_protein.add_features(feat_ids, fm, feature_names=names)
+        return (feat_ids, names, fm)
+
+    def add_proteins(self, protein_ids, data=None):
+        '''
+        Appends proteins to the protein data set and the protein feature
+        matrix. Feature values are only calculated for the new proteins, for
+        the feature categories that are available in the feature matrix.
+
+        The data argument maps a data source id to a list of (protein_id,
+        data_item) tuples, it should contain the data of the new proteins for
+        each data source that is available for the current proteins.
+        '''
+
+        assert(self.fm_protein.object_ids)
+
+        # feature category ids in feature matrix column order
+        featcat_ids = []
+        for fid in self.fm_protein.feature_ids:
+            tokens = fid.split('_')
+            if(len(tokens) == 2):
+                featcat_id = tokens[0]
+            else:
+                featcat_id = '_'.join(tokens[:2])
+            if not(featcat_id in featcat_ids):
+                featcat_ids.append(featcat_id)
+
+        # custom features can not be calculated for the new proteins
+        for featcat_id in featcat_ids:
+            if not(featcat_id.split('_')[0] in
+                   self.PROTEIN_FEATURE_CATEGORIES.keys()):
+                raise ValueError('Features %s can not be calculated for ' %
+                                 (featcat_id) + 'new proteins.')
+
+        self.protein_data_set.add_proteins(protein_ids, data)
+        new_proteins = self.protein_data_set.get_proteins()[
+            -len(protein_ids):]
+
+        fm = None
+        if(featcat_ids):
+
+            col_dict = dict([(fid, index) for index, fid in
+                             enumerate(self.fm_protein.feature_ids)])
+            fm = numpy.empty((len(protein_ids),
+                              len(self.fm_protein.feature_ids)))
+
+            for featcat_id in featcat_ids:
+                (feat_ids, _, cat_fm) = self._protein_feature_matrix(
+                    featcat_id, new_proteins)
+                fm[:, [col_dict[fid] for fid in feat_ids]] = cat_fm
+
+        self.fm_protein.add_objects(protein_ids, fm)
 
     def calculate_missense_features(self, featcat_id):
 
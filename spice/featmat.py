@@ -9,6 +9,8 @@ import os
 #import sys
 import glob
 import json
+import itertools
+import hashlib
 
 import numpy
 from scipy import stats
@@ -23,8 +25,6 @@ from matplotlib import pyplot
 #    reload(sklearn)
 #assert(sklearn.__version__ == '0.14.1')
 
-from sklearn.datasets.base import Bunch
-
 from biopy import file_io
 from spice.plotpy import heatmap
 
@@ -37,9 +37,9 @@ class FeatureMatrix(object):
 
     The feature matrix is initiated as an empty matrix. First the objects
     (`object_ids`) need to be set. These cannot be altered afterwards or
-    a ValueError will be raised. This is to make life a bit easier for now.
-    Thus far, for our functionality, there is no need to modify the objects
-    after creation of the feature matrix.
+    a ValueError will be raised. New objects can however be appended using
+    the `add_objects` function, which requires the feature values of the new
+    objects for all available features.
 
     When the objects are set, the `add_features` function can be used to add
     features and thereby fill the feature matrix with values. A list with
@@ -63,11 +63,18 @@ class FeatureMatrix(object):
     ONE_CLASS_LABELING = 'one_class'
     ONE_CLASS_LABEL = 'all'
 
+    # class name that is assigned to appended objects in existing labelings
+    UNLABELED_LABEL = 'unlabeled'
+
+    # join types used to match the objects or features of two feature matrices
+    JOIN_TYPES = ['inner', 'left']
+
     # file names and directory structure used when saving a feature matrix
     OBJECT_IDS_F = 'object_ids.txt'
     FEATURE_MATRIX_F = 'feature_matrix.mat'
     FEATURE_IDS_F = 'feature_ids.txt'
     FEATURE_NAMES_F = 'feature_names.txt'
+    FEATURE_STATS_F = 'feature_stats.json'
     LABELING_D = 'labels'
     IMG_D = 'img'
     HISTOGRAM_D = os.path.join(IMG_D, 'histogram')
@@ -91,6 +98,13 @@ class FeatureMatrix(object):
         # labelings
         self._labeling_dict = {}
 
+        # (dir, number of objects) of the last load or save, used to append
+        # new objects to the stored files instead of rewriting them
+        self._stored = None
+
+        # per feature, per class summary statistics (FeatureStatistics)
+        self._feature_stats = None
+
     @property
     def object_ids(self):
         return self._object_ids
@@ -115,6 +129,8 @@ class FeatureMatrix(object):
         self._feature_matrix = None
         self._feature_ids = []
         self._feature_names = {}
+        self._stored = None
+        self._feature_stats = None
 
     @property
     def feature_names(self):
@@ -229,8 +245,8 @@ class FeatureMatrix(object):
         This function extends the feature matrix, adding the provided features.
 
         It is the users responsebility that the rows of the feature matrix are
-        in the same order as the object ids. TODO how to improve this? Use
-        merge instead?
+        in the same order as the object ids. Use merge to add the features of
+        a feature matrix with a different object order.
 
         Args:
             feature_ids ([str]): List with feature ids.
@@ -291,6 +307,14 @@ class FeatureMatrix(object):
         # add feature names
         self.feature_names.update(feat_name_dict)
 
+        # stored feature matrix can not be appended anymore
+        self._stored = None
+
+        # only calculate statistics of the new features
+        if not(self._feature_stats is None):
+            self._feature_stats.add_features(feature_ids, feature_matrix,
+                                             self.labeling_dict)
+
     def remove_features(self, feature_ids):
         '''
         This function removes the feature with id feat_id from the feature
@@ -320,20 +344,296 @@ class FeatureMatrix(object):
                     self.feature_ids.remove(fid)
                     del self.feature_names[fid]
 
+                self._stored = None
+
+                if not(self._feature_stats is None):
+                    self._feature_stats.remove_features(fis)
+
         except ValueError:
             raise ValueError('Feature id not in the feature matrix.')
 
-    def merge(self, other):
+    def add_objects(self, object_ids, feature_matrix=None):
+        '''
+        This function appends objects (rows) to the feature matrix.
 
-        # check if other has the same objects and labels (same order as well)
-        if not(self.object_ids == other.object_ids):
-            raise ValueError('Object of the two feature matrices ' +
-                             'do not correspond.')
+        The rows of the provided feature matrix should be in the same order
+        as the provided object ids and the columns in the same order as the
+        feature ids of this feature matrix. Existing labelings are extended,
+        the new objects obtain the UNLABELED_LABEL class (or the single class
+        of the one class labeling).
 
-        # TODO merge labelings???
+        Args:
+            object_ids ([str]): List with the new object ids.
+
+        Kwargs:
+            feature_matrix (numpy.array): The feature values of the new
+                                          objects, required if this feature
+                                          matrix contains features.
+
+        Raises:
+            ValueError: If the object ids are not set yet.
+            ValueError: If object_ids is empty or contains duplicates.
+            ValueError: If any of the object ids already exists.
+            ValueError: If the feature matrix is missing or if its shape does
+                        not correspond to the objects and features.
+        '''
+
+        if(self.object_ids is None):
+            raise ValueError('Object ids are not set yet.')
+
+        if(len(object_ids) == 0):
+            raise ValueError('The object ids list is empty.')
+
+        if not(len(object_ids) == len(set(object_ids))):
+            raise ValueError('The list of object ids contains duplicates.')
+
+        inter = set(object_ids) & set(self.object_ids)
+        if not(len(inter) == 0):
+            raise ValueError('Object ids %s already exist.' % (inter))
+
+        if not(self.feature_matrix is None):
+
+            if(feature_matrix is None):
+                raise ValueError('Feature values of the new objects are ' +
+                                 'required.')
+
+            if not(feature_matrix.shape ==
+                   (len(object_ids), len(self.feature_ids))):
+                raise ValueError('The shape of the feature matrix does not ' +
+                                 'correspond to the number of objects and ' +
+                                 'features.')
+
+            self._feature_matrix = numpy.vstack([self._feature_matrix,
+                                                 feature_matrix])
+
+        # new list, the labelings share the (old) object ids list
+        self._object_ids = self._object_ids + list(object_ids)
+
+        # extend the labelings with a default label for the new objects
+        for lname, l in self.labeling_dict.items():
+
+            class_names = l.class_names[:]
+            if(lname == self.ONE_CLASS_LABELING):
+                new_label = 0
+            else:
+                if not(self.UNLABELED_LABEL in class_names):
+                    class_names.append(self.UNLABELED_LABEL)
+                new_label = class_names.index(self.UNLABELED_LABEL)
+
+            labels = l.labels + [new_label] * len(object_ids)
+            self.labeling_dict[lname] = Labeling(lname, self.object_ids,
+                                                 labels, class_names)
+
+        # update the statistics with the new objects
+        if not(self._feature_stats is None):
+            if(feature_matrix is None):
+                self._feature_stats = None
+            else:
+                self._feature_stats.add_objects(feature_matrix,
+                                                self.labeling_dict)
+
+    def merge(self, other, how='inner', fill_value=numpy.nan):
+        '''
+        This function adds the features of the other feature matrix to this
+        feature matrix.
+
+        The rows of the two feature matrices are matched on object id (hash
+        join), so the objects do not need to be in the same order. With the
+        'inner' join, only the objects that are in both feature matrices are
+        kept. With the 'left' join, all objects of this feature matrix are
+        kept and the values of objects that are not in other are set to
+        fill_value.
+
+        Labelings of other that are not available in this feature matrix are
+        added, objects that are not in other obtain the UNLABELED_LABEL class.
+
+        Args:
+            other (FeatureMatrix): The feature matrix to merge with.
+
+        Kwargs:
+            how (str): The join type, 'inner' or 'left'.
+            fill_value (float): Feature value for missing objects.
+
+        Raises:
+            ValueError: If how is not a valid join type.
+            ValueError: If the feature matrices have no objects in common.
+            ValueError: If any of the feature ids of other already exists.
+        '''
+
+        if not(how in self.JOIN_TYPES):
+            raise ValueError('Join type should be one of: %s.' %
+                             (', '.join(self.JOIN_TYPES)))
+
+        inter = set(other.feature_ids) & set(self.feature_ids)
+        if not(len(inter) == 0):
+            raise ValueError('Feature ids %s already exist.' % (inter))
+
+        other_index = other._object_index()
+
+        if(how == 'inner'):
+            object_is = [i for i, oid in enumerate(self.object_ids)
+                         if oid in other_index]
+            if(len(object_is) == 0):
+                raise ValueError('The feature matrices have no objects ' +
+                                 'in common.')
+            if(len(object_is) < len(self.object_ids)):
+                self._keep_objects(object_is)
+
+        # row index in other for each of our objects, -1 if missing
+        other_is = [other_index.get(oid, -1) for oid in self.object_ids]
 
         # add the feature ids and extend the feature matrix
-        self.add_features(other.feature_ids, other.feature_matrix)
+        if(other.feature_ids):
+            feat_names = [other.feature_names[fid] for fid in
+                          other.feature_ids]
+            self.add_features(list(other.feature_ids),
+                              other._join_values(other_is, None, fill_value),
+                              feature_names=feat_names)
+
+        # add labelings that we do not have yet
+        for lname, l in other.labeling_dict.items():
+            if not(lname in self.labeling_dict):
+                classes = [l.class_names[l.labels[i]] if i >= 0
+                           else self.UNLABELED_LABEL for i in other_is]
+                self.labeling_dict[lname] = self._labeling_from_classes(
+                    lname, classes, l.class_names + [self.UNLABELED_LABEL])
+
+    def concat(self, other, how='inner', fill_value=numpy.nan):
+        '''
+        This function appends the objects of the other feature matrix to this
+        feature matrix.
+
+        The columns of the two feature matrices are matched on feature id, so
+        the features do not need to be in the same order. With the 'inner'
+        join, only the features that are in both feature matrices are kept.
+        With the 'left' join, all features of this feature matrix are kept
+        and the missing values of the objects of other are set to fill_value.
+
+        Labelings that are available in both feature matrices are combined,
+        in other labelings the objects of other obtain the UNLABELED_LABEL
+        class. Labelings that are only in other are not added.
+
+        Args:
+            other (FeatureMatrix): The feature matrix with the new objects.
+
+        Kwargs:
+            how (str): The join type, 'inner' or 'left'.
+            fill_value (float): Feature value for missing features.
+
+        Raises:
+            ValueError: If how is not a valid join type.
+            ValueError: If any of the object ids of other already exists.
+            ValueError: If the feature matrices have no features in common.
+        '''
+
+        if not(how in self.JOIN_TYPES):
+            raise ValueError('Join type should be one of: %s.' %
+                             (', '.join(self.JOIN_TYPES)))
+
+        inter = set(other.object_ids) & set(self.object_ids)
+        if not(len(inter) == 0):
+            raise ValueError('Object ids %s already exist.' % (inter))
+
+        other_index = other._feature_index()
+
+        if(how == 'inner' and self.feature_ids):
+            missing = [fid for fid in self.feature_ids
+                       if not fid in other_index]
+            if(len(missing) == len(self.feature_ids)):
+                raise ValueError('The feature matrices have no features ' +
+                                 'in common.')
+            if(missing):
+                self.remove_features(missing)
+
+        # column index in other for each of our features, -1 if missing
+        other_is = [other_index.get(fid, -1) for fid in self.feature_ids]
+
+        feature_matrix = None
+        if(self.feature_ids):
+            feature_matrix = other._join_values(None, other_is, fill_value)
+
+        num_objects = len(self.object_ids)
+        labelings = dict(self.labeling_dict)
+
+        self.add_objects(list(other.object_ids), feature_matrix)
+
+        # use the labels of other for labelings that are in both
+        for lname, l in labelings.items():
+            if(lname in other.labeling_dict):
+                ol = other.labeling_dict[lname]
+                classes = [l.class_names[lab] for lab in l.labels]
+                classes.extend([ol.class_names[lab] for lab in ol.labels])
+                class_order = l.class_names + [c for c in ol.class_names
+                                               if not c in l.class_names]
+                self.labeling_dict[lname] = self._labeling_from_classes(
+                    lname, classes, class_order)
+
+        assert(len(self.object_ids) == num_objects + len(other.object_ids))
+
+        # labels changed, statistics will be recalculated when requested
+        self._feature_stats = None
+
+    def _object_index(self):
+        return dict(zip(self.object_ids, xrange(len(self.object_ids))))
+
+    def _feature_index(self):
+        return dict(zip(self.feature_ids, xrange(len(self.feature_ids))))
+
+    def _join_values(self, object_is, feature_is, fill_value):
+        '''
+        Returns the feature matrix values of the rows object_is and columns
+        feature_is (None for all), index -1 means a missing row or column
+        that is filled with fill_value.
+        '''
+
+        if(object_is is None):
+            object_is = numpy.arange(len(self.object_ids))
+        if(feature_is is None):
+            feature_is = numpy.arange(len(self.feature_ids))
+        object_is = numpy.asarray(object_is, dtype=int)
+        feature_is = numpy.asarray(feature_is, dtype=int)
+
+        if(self.feature_matrix is None):
+            result = numpy.empty((len(object_is), len(feature_is)))
+            result.fill(fill_value)
+            return result
+
+        result = self.feature_matrix[numpy.ix_(numpy.maximum(object_is, 0),
+                                               numpy.maximum(feature_is, 0))]
+        result[object_is < 0, :] = fill_value
+        result[:, feature_is < 0] = fill_value
+
+        return result
+
+    def _keep_objects(self, object_is):
+        '''
+        Removes all objects (rows) except the ones with indices object_is.
+        '''
+
+        self._object_ids = [self.object_ids[i] for i in object_is]
+
+        if not(self.feature_matrix is None):
+            self._feature_matrix = self.feature_matrix[object_is, :]
+
+        for lname, l in self.labeling_dict.items():
+            classes = [l.class_names[l.labels[i]] for i in object_is]
+            self.labeling_dict[lname] = self._labeling_from_classes(
+                lname, classes, l.class_names)
+
+        self._stored = None
+        self._feature_stats = None
+
+    def _labeling_from_classes(self, labeling_name, classes, class_order):
+        '''
+        Returns a labeling for our objects, given the class name of each
+        object. Classes are ordered as in class_order, unused classes are
+        left out.
+        '''
+        used = set(classes)
+        class_names = [c for c in class_order if c in used]
+        class_index = dict(zip(class_names, xrange(len(class_names))))
+        labels = [class_index[c] for c in classes]
+        return Labeling(labeling_name, self.object_ids, labels, class_names)
 
     def add_custom_features(self, feature_matrix):
         '''
@@ -365,17 +665,18 @@ class FeatureMatrix(object):
         self.add_features(feat_ids, feature_matrix, feature_names=feat_names)
 
     def slice(self, feat_is, object_is):
-        data = self.feature_matrix[:, feat_is]
-        return data[object_is, :]
+        # one copy, instead of a column and a row copy
+        return self.feature_matrix[numpy.ix_(object_is, feat_is)]
 
     def standardized(self):
         return self._standardize(self.feature_matrix)
 
     def standardized_slice(self, feat_is, object_is):
-        return self._standardize(self.slice(feat_is, object_is))
+        # the slice is a copy already, standardize it in place
+        return self._standardize(self.slice(feat_is, object_is), copy=False)
 
-    def _standardize(self, mat):
-        result = numpy.copy(mat)
+    def _standardize(self, mat, copy=True):
+        result = numpy.copy(mat) if copy else mat
         # column wise (features)
         mean = numpy.mean(result, axis=0)
         std = numpy.std(result, axis=0)
@@ -397,7 +698,11 @@ class FeatureMatrix(object):
         Raises:
             ValueError: if one of the feature_ids is not in the list.
         '''
-        return [self.feature_ids.index(fid) for fid in feature_ids]
+        index = self._feature_index()
+        try:
+            return [index[fid] for fid in feature_ids]
+        except KeyError as e:
+            raise ValueError('%s is not in list' % (e))
 
     def object_indices(self, object_ids):
         '''
@@ -411,7 +716,11 @@ class FeatureMatrix(object):
         Raises:
             ValueError: if one of the object_ids is not in the list.
         '''
-        return [self.object_ids.index(oid) for oid in object_ids]
+        index = self._object_index()
+        try:
+            return [index[oid] for oid in object_ids]
+        except KeyError as e:
+            raise ValueError('%s is not in list' % (e))
 
     def filtered_object_indices(self, labeling_name, class_ids):
         labeling = self.labeling_dict[labeling_name]
@@ -424,6 +733,236 @@ class FeatureMatrix(object):
         labeling = self.labeling_dict[labeling_name]
         return sorted([labeling.class_names.index(c) for c in class_ids])
 
+    def feature_statistics(self, labeling_name=None):
+        '''
+        This function returns summary statistics of each feature per class of
+        the labeling: count, min, max, mean, var (population variance), and
+        the approximate quantiles at FeatureStatistics.QUANTILES.
+
+        The statistics of a labeling are calculated when they are first
+        requested, stored with the feature matrix, and updated when features
+        or objects are added.
+
+        Kwargs:
+            labeling_name (str): The labeling, one class labeling by default.
+        Returns:
+            {class_name: {stat_name: numpy.array}}, in which the arrays have
+            a value per feature (in feature_ids order), and a row per
+            feature for the quantiles.
+        Raises:
+            ValueError: If the labeling does not exist.
+        '''
+
+        if(labeling_name is None):
+            labeling_name = self.ONE_CLASS_LABELING
+
+        try:
+            labeling = self.labeling_dict[labeling_name]
+        except KeyError:
+            raise ValueError('Labeling does not exist: %s.' % (labeling_name))
+
+        if(self._feature_stats is None):
+            self._feature_stats = FeatureStatistics(self.feature_ids,
+                                                    len(self.object_ids))
+
+        if not(labeling_name in self._feature_stats.labeling_stats):
+            self._feature_stats.add_labeling(labeling, self.feature_matrix)
+
+        return self._feature_stats.labeling_stats[labeling_name]
+
+    def save_feature_statistics(self, d):
+        '''
+        This function stores the feature statistics in feature matrix
+        directory d, without storing the feature matrix itself. Only the
+        statistics of the labelings that were requested are stored, the
+        others are not calculated (see feature_statistics).
+        '''
+        self._save_feature_stats(os.path.join(d, self.FEATURE_STATS_F))
+
+    @classmethod
+    def load_feature_statistics(cls, d, labeling_name=None):
+        '''
+        This class method returns the stored feature statistics of the
+        feature matrix in directory d (see feature_statistics), without
+        loading the feature matrix itself. Only the feature and object ids
+        are read, to check that the statistics belong to the stored feature
+        matrix. It returns None if no (up to date) statistics are stored for
+        the labeling.
+        '''
+
+        if(labeling_name is None):
+            labeling_name = cls.ONE_CLASS_LABELING
+
+        f = os.path.join(d, cls.FEATURE_STATS_F)
+        if not(os.path.exists(f)):
+            return None
+
+        fs = FeatureStatistics.load_from_file(f)
+
+        feature_ids = []
+        f = os.path.join(d, cls.FEATURE_IDS_F)
+        if(os.path.exists(f)):
+            with open(f, 'r') as fin:
+                feature_ids = [i for i in file_io.read_ids(fin)]
+
+        num_objects = 0
+        f = os.path.join(d, cls.OBJECT_IDS_F)
+        if(os.path.exists(f)):
+            with open(f, 'r') as fin:
+                num_objects = len([i for i in file_io.read_ids(fin)])
+
+        if(fs.feature_ids == feature_ids and fs.num_objects == num_objects):
+            return fs.labeling_stats.get(labeling_name, None)
+        else:
+            return None
+
+    def _feature_mean_std(self, feature_is):
+        '''
+        Returns the mean and standard deviation of the feature columns
+        feature_is over all objects, from the feature statistics. Zero
+        standard deviations are set to one, as in standardized.
+        '''
+        fstats = self.feature_statistics()[self.ONE_CLASS_LABEL]
+        mean = fstats['mean'][feature_is]
+        std = numpy.sqrt(fstats['var'][feature_is])
+        std[std == 0.0] = 1.0
+        return (mean, std)
+
+    def _feature_columns(self, feature_is, object_is, standardized=False):
+        '''
+        Returns the feature columns feature_is of the rows object_is. If
+        standardized, the columns are standardized with the statistics of all
+        objects, which gives the rows of standardized without standardizing
+        the whole matrix.
+        '''
+        mat = self.feature_matrix[numpy.ix_(object_is, feature_is)]
+        if(standardized):
+            (mean, std) = self._feature_mean_std(feature_is)
+            mat -= mean
+            mat /= std
+        return mat
+
+    def _feature_range(self, feature_i, labeling_name, class_ids,
+                       standardized=False):
+        '''
+        Returns the tuple (min, max) of feature column feature_i over the
+        objects of the classes class_ids of the labeling, from the feature
+        statistics (standardized as in _feature_columns if requested).
+        '''
+        fstats = self.feature_statistics(labeling_name)
+        min_val = numpy.nanmin([fstats[c]['min'][feature_i]
+                                for c in class_ids])
+        max_val = numpy.nanmax([fstats[c]['max'][feature_i]
+                                for c in class_ids])
+        if(standardized):
+            (mean, std) = self._feature_mean_std([feature_i])
+            min_val = (min_val - mean[0]) / std[0]
+            max_val = (max_val - mean[0]) / std[0]
+        return (float(min_val), float(max_val))
+
+    @classmethod
+    def iter_feature_blocks(cls, d, feature_ids, block_size):
+        '''
+        This class method yields the values of the features feature_ids of
+        the feature matrix in directory d, in blocks of at most block_size
+        objects, without loading the whole feature matrix. Only the values of
+        one block are kept in memory.
+
+        Args:
+            d (str): The path to the feature matrix directory.
+            feature_ids ([str]): The features, in column order.
+            block_size (int): The maximal number of objects per block.
+        Returns:
+            generator of (object_ids, data) tuples, in which data is a
+            len(object_ids) x len(feature_ids) matrix.
+        Raises:
+            ValueError: If one of the feature_ids is not in the matrix.
+        '''
+
+        with open(os.path.join(d, cls.FEATURE_IDS_F), 'r') as fin:
+            index = dict([(fid, i)
+                          for i, fid in enumerate(file_io.read_ids(fin))])
+        try:
+            cols = [index[fid] for fid in feature_ids]
+        except KeyError as e:
+            raise ValueError('%s is not in list' % (e))
+
+        with open(os.path.join(d, cls.OBJECT_IDS_F), 'r') as oin,\
+                open(os.path.join(d, cls.FEATURE_MATRIX_F), 'r') as fin:
+
+            object_ids = file_io.read_ids(oin)
+
+            while(True):
+                block_ids = list(itertools.islice(object_ids, block_size))
+                if not(block_ids):
+                    break
+                data = numpy.loadtxt(itertools.islice(fin, len(block_ids)),
+                                     usecols=cols, ndmin=2)
+                yield (block_ids, data)
+
+    @classmethod
+    def standardization_stats(cls, d, feature_ids, block_size):
+        '''
+        This class method returns the mean and standard deviation of the
+        features feature_ids of the feature matrix in directory d, as used by
+        standardized. The feature matrix is read in blocks of block_size
+        objects (see iter_feature_blocks), and the statistics of the blocks
+        are combined.
+
+        Returns:
+            (mean, std) tuple of arrays, standard deviations of zero are set
+            to one.
+        '''
+
+        count = 0
+        mean = numpy.zeros(len(feature_ids))
+        # sum of squared differences from the mean
+        ssd = numpy.zeros(len(feature_ids))
+
+        for object_ids, data in cls.iter_feature_blocks(d, feature_ids,
+                                                        block_size):
+            n = data.shape[0]
+            block_mean = numpy.mean(data, axis=0)
+            block_ssd = ((data - block_mean) ** 2).sum(axis=0)
+            delta = block_mean - mean
+            ssd += block_ssd + delta ** 2 * count * n / float(count + n)
+            mean += delta * n / float(count + n)
+            count += n
+
+        std = numpy.sqrt(ssd / max(count, 1))
+        # reset zeros to one, to avoid NaN
+        std[std == 0.0] = 1.0
+
+        return (mean, std)
+
+    def feature_ranking(self, labeling_name, class_ids=None, feat_ids=None,
+                        measure='f'):
+        '''
+        This function ranks the features by how well they separate the
+        classes of the labeling, using a univariate score (see
+        univariate_scores).
+
+        Args:
+            labeling_name (str): The labeling.
+        Kwargs:
+            class_ids ([str]): The classes to use, all by default.
+            feat_ids ([str]): The features to rank, all by default.
+            measure (str): One of UNIVARIATE_SCORES.
+        Returns:
+            List with (feature_id, score) tuples, best feature first.
+        Raises:
+            ValueError: If the measure does not exist, or if it is only
+                        defined for two classes and there are more.
+        '''
+
+        (fm, sample_names, feature_names, target, target_names) =\
+            self.get_dataset(feat_ids, labeling_name, class_ids,
+                             standardized=False)
+
+        scores = univariate_scores(fm, target)
+        return [(feature_names[i], scores[measure][i])
+                for i in rank_scores(scores, measure)]
+
     def get_custom_features(self):
         '''
         This function returns the available custom feature vector ids.
@@ -442,13 +981,123 @@ class FeatureMatrix(object):
                     feat_dict.setdefault(pre, []).append(fid)
         return feat_dict
 
+    def pruning_plan(self, feat_ids=None, max_corr=0.99, block_size=256):
+        '''
+        This function detects redundant features: constant features, exact
+        duplicates, and near-collinear features.
+
+        Constant features are obtained from the feature statistics,
+        duplicates by hashing the feature columns, and near-collinear
+        features by calculating the Pearson correlations of the remaining
+        features, block_size x block_size features at a time. Of each group of
+        duplicate or near-collinear features, the first one in feature matrix
+        order is kept.
+
+        Kwargs:
+            feat_ids ([str]): The features to check, all by default.
+            max_corr (float): Features with an absolute correlation of at
+                              least max_corr with a kept feature are
+                              near-collinear.
+            block_size (int): Number of features per correlation block.
+        Returns:
+            Dictionary with the pruning plan:
+            | **constant**: List with constant feature ids.
+            | **duplicate**: Kept feature id to list of duplicate ids.
+            | **collinear**: Kept feature id to list of near-collinear ids.
+            | **remove**: List with all feature ids that can be removed.
+        '''
+
+        if(feat_ids is None):
+            feat_ids = self.feature_ids
+        feat_is = sorted(self.feature_indices(feat_ids))
+
+        plan = {'constant': [], 'duplicate': {}, 'collinear': {},
+                'remove': []}
+
+        if not(feat_is):
+            return plan
+
+        fstats = self.feature_statistics()[self.ONE_CLASS_LABEL]
+
+        # constant (or all missing) features
+        constant = set([fi for fi in feat_is
+                        if not(fstats['min'][fi] < fstats['max'][fi])])
+        plan['constant'] = [self.feature_ids[fi] for fi in sorted(constant)]
+        feat_is = [fi for fi in feat_is if not fi in constant]
+
+        # exact duplicates, same column hash (and same values)
+        kept = []
+        hash_dict = {}
+        for fi in feat_is:
+            col = numpy.ascontiguousarray(self.feature_matrix[:, fi])
+            h = hashlib.sha1(col.tostring()).hexdigest()
+            for ki in hash_dict.get(h, []):
+                if(numpy.array_equal(col, self.feature_matrix[:, ki])):
+                    plan['duplicate'].setdefault(
+                        self.feature_ids[ki], []).append(self.feature_ids[fi])
+                    break
+            else:
+                hash_dict.setdefault(h, []).append(fi)
+                kept.append(fi)
+
+        # near-collinear features, correlations of the standardized columns
+        mean = fstats['mean'][kept]
+        std = numpy.sqrt(fstats['var'][kept])
+        z = (self.feature_matrix[:, kept] - mean) / std
+        num_obj = float(z.shape[0])
+
+        neighbors = {}
+        for start0 in xrange(0, len(kept), block_size):
+            z0 = z[:, start0:start0 + block_size]
+            for start1 in xrange(start0, len(kept), block_size):
+                z1 = z[:, start1:start1 + block_size]
+                corr = numpy.dot(z0.T, z1) / num_obj
+                with numpy.errstate(invalid='ignore'):
+                    is0, is1 = numpy.where(numpy.abs(corr) >= max_corr)
+                for i0, i1 in zip(is0 + start0, is1 + start1):
+                    if(i0 < i1):
+                        neighbors.setdefault(i0, []).append(i1)
+
+        removed = set()
+        for i in xrange(len(kept)):
+            if not(i in removed):
+                for j in sorted(neighbors.get(i, [])):
+                    if not(j in removed):
+                        removed.add(j)
+                        plan['collinear'].setdefault(
+                            self.feature_ids[kept[i]], []).append(
+                                self.feature_ids[kept[j]])
+
+        plan['remove'] = plan['constant'][:]
+        for fids in plan['duplicate'].values() + plan['collinear'].values():
+            plan['remove'].extend(fids)
+
+        return plan
+
     def get_dataset(self, feat_ids=None, labeling_name=None, class_ids=None,
-                    standardized=True):
+                    standardized=True, pruning_plan=None, copy=False):
+        '''
+        This function returns the (standardized) data of the features
+        feat_ids and the objects in classes class_ids of the labeling
+        labeling_name, as a tuple (data, sample_names, feature_names, target,
+        target_names). The features in the remove list of a pruning_plan (see
+        pruning_plan) are left out.
+
+        The unstandardized data of all features and objects is the feature
+        matrix itself, unless copy is True. Otherwise the data is a new array
+        (a single copy), which the caller may modify in place.
+        '''
 
         if (labeling_name is None):
             labeling_name = 'one_class'
         labeling = self.labeling_dict[labeling_name]
 
+        if(pruning_plan):
+            if not(feat_ids):
+                feat_ids = self.feature_ids
+            remove = set(pruning_plan['remove'])
+            feat_ids = [fid for fid in feat_ids if not fid in remove]
+
         if(feat_ids or class_ids):
 
             if not(feat_ids):
@@ -477,6 +1126,8 @@ class FeatureMatrix(object):
         else:
             if standardized:
                 fm = self.standardized()
+            elif(copy):
+                fm = numpy.copy(self.feature_matrix)
             else:
                 fm = self.feature_matrix
             target = numpy.array([float(l) for l in labeling.labels])
@@ -486,11 +1137,32 @@ class FeatureMatrix(object):
 
         return (fm, sample_names, feature_names, target, target_names)
 
+    def dataset_feature_ids(self, feat_ids=None, pruning_plan=None):
+        '''
+        This function returns the ids of the features that get_dataset uses
+        for feat_ids (all features by default) and the pruning_plan, in
+        feature matrix column order.
+        '''
+
+        if not(feat_ids):
+            feat_ids = self.feature_ids
+        if(pruning_plan):
+            remove = set(pruning_plan['remove'])
+            feat_ids = [fid for fid in feat_ids if not fid in remove]
+
+        return [self.feature_ids[i]
+                for i in sorted(self.feature_indices(feat_ids))]
+
     def get_sklearn_dataset(self, feat_ids=None, labeling_name=None,
-                            class_ids=None, standardized=True):
+                            class_ids=None, standardized=True,
+                            pruning_plan=None, copy=False):
+
+        # imported here, readers of feature matrices do not need sklearn
+        from sklearn.datasets.base import Bunch
 
         (fm, sample_names, feature_names, target, target_names) =\
-            self.get_dataset(feat_ids, labeling_name, class_ids, standardized)
+            self.get_dataset(feat_ids, labeling_name, class_ids, standardized,
+                             pruning_plan, copy)
 
         return Bunch(data=fm,
                      target=target,
@@ -556,6 +1228,16 @@ class FeatureMatrix(object):
             if not(featmat is None):
                 fm.add_features(fids, featmat, fnames)
 
+            fm._stored = (os.path.abspath(d), len(fm.object_ids))
+
+            # read feature statistics, if they correspond to the matrix
+            f = os.path.join(d, cls.FEATURE_STATS_F)
+            if(os.path.exists(f)):
+                fs = FeatureStatistics.load_from_file(f)
+                if(fs.feature_ids == fm.feature_ids and
+                        fs.num_objects == len(fm.object_ids)):
+                    fm._feature_stats = fs
+
         return fm
 
     def save_to_dir(self, d):
@@ -570,17 +1252,44 @@ class FeatureMatrix(object):
         '''
         if not(os.path.exists(d)):
             os.makedirs(d)
-        self._save_object_ids(os.path.join(d, self.OBJECT_IDS_F))
-        self._save_feature_ids(os.path.join(d, self.FEATURE_IDS_F))
-        self._save_feature_names(os.path.join(d, self.FEATURE_NAMES_F))
-        self._save_feature_matrix(os.path.join(d, self.FEATURE_MATRIX_F))
+
+        # only append the new objects if the features did not change since
+        # the feature matrix was loaded from or saved to this directory
+        if(self.object_ids and not(self._stored is None) and
+                self._stored[0] == os.path.abspath(d)):
+            num_stored = self._stored[1]
+            self._append_object_ids(os.path.join(d, self.OBJECT_IDS_F),
+                                    num_stored)
+            self._append_feature_matrix(
+                os.path.join(d, self.FEATURE_MATRIX_F), num_stored)
+        else:
+            self._save_object_ids(os.path.join(d, self.OBJECT_IDS_F))
+            self._save_feature_ids(os.path.join(d, self.FEATURE_IDS_F))
+            self._save_feature_names(os.path.join(d, self.FEATURE_NAMES_F))
+            self._save_feature_matrix(os.path.join(d, self.FEATURE_MATRIX_F))
         self._save_labelings(os.path.join(d, self.LABELING_D))
+        self.save_feature_statistics(d)
+
+        if(self.object_ids):
+            self._stored = (os.path.abspath(d), len(self.object_ids))
 
     def _save_object_ids(self, f):
         if(self.object_ids):
             with open(f, 'w') as fout:
                 file_io.write_ids(fout, self.object_ids)
 
+    def _append_object_ids(self, f, num_stored):
+        if(len(self.object_ids) > num_stored):
+            with open(f, 'a') as fout:
+                file_io.write_ids(fout, self.object_ids[num_stored:])
+
+    def _append_feature_matrix(self, f, num_stored):
+        if not(self.feature_matrix is None) and\
+                self.feature_matrix.shape[0] > num_stored:
+            with open(f, 'a') as fout:
+                numpy.savetxt(fout, self.feature_matrix[num_stored:, :],
+                              fmt='%.4e')
+
     def _save_feature_ids(self, f):
         if not(self.feature_ids is None):
             with open(f, 'w') as fout:
@@ -602,6 +1311,12 @@ class FeatureMatrix(object):
         elif(os.path.exists(f)):
             os.remove(f)
 
+    def _save_feature_stats(self, f):
+        if not(self._feature_stats is None):
+            self._feature_stats.save_to_file(f)
+        elif(os.path.exists(f)):
+            os.remove(f)
+
     def _save_labelings(self, d):
         if(self.labeling_dict):
             if not(os.path.exists(d)):
@@ -636,6 +1351,15 @@ class FeatureMatrix(object):
             except KeyError:
                 raise ValueError('Labeling does not exist: %s.' %
                                  (labeling_name))
+            # use the feature statistics for the full set of objects
+            if(object_is is None):
+                fstats = self.feature_statistics(labeling_name)
+                try:
+                    return FeatureStatistics.ttest(fstats[label1],
+                                                   fstats[label0])
+                except KeyError:
+                    raise ValueError('Non-existing label provided.')
+
             try:
                 obj_is_per_class = labeling.get_obj_is_per_class(object_is)
                 lab0_indices = obj_is_per_class[label0]
@@ -686,29 +1410,21 @@ class FeatureMatrix(object):
         # get the name of the feature
         feat_name = self.feature_names[feat_id]
 
-        # get the feature matrix, standardize data if requested
-        if(standardized):
-            fm = self.standardized()
-        else:
-            fm = self.feature_matrix
+        # value range of the classes, from the feature statistics
+        (min_val, max_val) = self._feature_range(
+            feature_index, labeling_name, class_ids, standardized)
 
         # generate histogram data
         hist_data = {}
 
-        # TODO check what is the proper python way to this
-        min_val = 10000.0
-        max_val = -10000.0
-
         for lab in class_ids:
 
             lab_indices = labeling.object_indices_per_class[lab]
 
-            # fetch feature column with only the object rows with label lab
-            h_data = fm[lab_indices, feature_index]
-
-            min_val = min(min_val, min(h_data))
-            max_val = max(max_val, max(h_data))
-            hist_data[lab] = h_data
+            # fetch feature column with only the object rows with label lab,
+            # standardize data if requested
+            hist_data[lab] = self._feature_columns(
+                [feature_index], lab_indices, standardized)[:, 0]
 
         # round step size
         # quick and dirty, there's probably some elegant way to do this
@@ -830,12 +1546,6 @@ class FeatureMatrix(object):
 
         feat_name = self.feature_names[feat_id]
 
-        # standardize data
-        if(standardized):
-            fm = self.standardized()
-        else:
-            fm = self.feature_matrix
-
         #feat_hists = []
         lab_str = labeling_name + '_' + '_'.join([str(l) for l in class_ids])
 
@@ -849,8 +1559,10 @@ class FeatureMatrix(object):
 
             lab_indices = labeling.object_indices_per_class[lab]
 
-            # fetch feature column with only the object rows with label lab
-            h_data = fm[lab_indices, feature_index]
+            # fetch feature column with only the object rows with label lab,
+            # standardize data if requested
+            h_data = self._feature_columns([feature_index], lab_indices,
+                                           standardized)[:, 0]
             hist_data.append(h_data)
 
         fig = pyplot.figure(figsize=(8.8, 2.5))
@@ -898,36 +1610,29 @@ class FeatureMatrix(object):
         if(feat1_pre):
             feat_name1 = ' - '.join([feat1_pre, feat_name1])
 
-        if(standardized):
-            # standardize data NOTE that fm is standardized before the objects
-            # are sliced out!!!
-            # not sure if this is the desired situation...
-            fm = self.standardized()
-        else:
-            fm = self.feature_matrix
+        # axis ranges, from the feature statistics
+        # NOTE that the data is standardized with the statistics of all
+        # objects, not only the objects of the classes
+        # not sure if this is the desired situation...
+        (xmin, xmax) = self._feature_range(feature_index0, labeling_name,
+                                           class_ids, standardized)
+        (ymin, ymax) = self._feature_range(feature_index1, labeling_name,
+                                           class_ids, standardized)
 
         legend = []
         scatters = {}
 
-        xmin = 10000
-        xmax = -10000
-        ymin = 10000
-        ymax = -10000
-
         # for each class id, add object ids that have that class label
         for index, class_id in enumerate(class_ids):
 
             object_is = labeling.object_indices_per_class[class_id]
-            x = fm[object_is, feature_index0]
-            y = fm[object_is, feature_index1]
+            xy = self._feature_columns([feature_index0, feature_index1],
+                                       object_is, standardized)
+            x = xy[:, 0]
+            y = xy[:, 1]
             #test x = list(numpy.arange(0.0, 1.0, 0.005))
             #test y = list(numpy.arange(0.0, 1.0, 0.005))
 
-            xmin = min(xmin, min(x))
-            xmax = max(xmax, max(x))
-            ymin = min(ymin, min(y))
-            ymax = max(ymax, max(y))
-
             legend.append(class_id)
             scatters[class_id] = zip(x, y)
 
@@ -994,13 +1699,9 @@ class FeatureMatrix(object):
             os.makedirs(d)
         out_f = os.path.join(d, 'scatter.%s' % (img_format))
 
-        if(standardized):
-            # standardize data NOTE that fm is standardized before the objects
-            # are sliced out!!!
-            # not sure if this is the desired situation...
-            fm = self.standardized()
-        else:
-            fm = self.feature_matrix
+        # NOTE that the data is standardized with the statistics of all
+        # objects, not only the objects of the classes
+        # not sure if this is the desired situation...
 
         fig = pyplot.figure(figsize=(6, 6))
         ax = fig.add_subplot(1, 1, 1)
@@ -1008,8 +1709,10 @@ class FeatureMatrix(object):
         # for each class id, add object ids that have that class label
         for index, class_id in enumerate(class_ids):
             object_is = labeling.object_indices_per_class[class_id]
-            x = fm[object_is, feature_index0]
-            y = fm[object_is, feature_index1]
+            xy = self._feature_columns([feature_index0, feature_index1],
+                                       object_is, standardized)
+            x = xy[:, 0]
+            y = xy[:, 1]
             c = colors[index]
             ax.scatter(x, y, s=30, c=c, marker='o', label=class_id)
 
@@ -1231,3 +1934,364 @@ class Labeling(object):
         object_ids = sorted(label_dict.keys())
         labels = [label_dict[oid] for oid in object_ids]
         return cls(labeling_name, object_ids, labels, class_names)
+
+
+class FeatureStatistics(object):
+    '''
+    This class manages per feature, per labeling class summary statistics:
+    count, min, max, mean, var (population variance), and quantiles.
+
+    The statistics of a class are calculated in one vectorized pass over the
+    rows of that class. The quantiles are stored as a fixed size quantile
+    summary, the feature values at QUANTILES. Two summaries are combined by
+    inverting the count-weighted mixture of their (piecewise linear)
+    cumulative distributions, which makes it possible to update the
+    statistics with appended objects without the original feature values.
+    The quantiles of updated statistics are therefore approximate.
+
+    Missing values (NaN) are not counted.
+    '''
+
+    QUANTILES = numpy.linspace(0.0, 1.0, 21)
+    STAT_NAMES = ['count', 'min', 'max', 'mean', 'var', 'quantiles']
+
+    def __init__(self, feature_ids, num_objects, labeling_stats=None):
+
+        self._feature_ids = list(feature_ids)
+        self._num_objects = num_objects
+
+        # {labeling_name: {class_name: {stat_name: numpy.array}}}
+        if(labeling_stats is None):
+            labeling_stats = {}
+        self._labeling_stats = labeling_stats
+
+    @property
+    def feature_ids(self):
+        return self._feature_ids
+
+    @property
+    def num_objects(self):
+        return self._num_objects
+
+    @property
+    def labeling_stats(self):
+        return self._labeling_stats
+
+    def add_labeling(self, labeling, feature_matrix):
+        '''
+        Calculates the statistics of all classes in labeling.
+        '''
+        self._labeling_stats[labeling.name] = self._labeling_class_stats(
+            labeling, feature_matrix, len(self.feature_ids))
+
+    def add_features(self, feature_ids, feature_matrix, labeling_dict):
+        '''
+        Calculates the statistics of the new features (columns), for the
+        labelings that are available in these statistics.
+        '''
+        for lname, class_stats in self._labeling_stats.items():
+            new_stats = self._labeling_class_stats(
+                labeling_dict[lname], feature_matrix, len(feature_ids))
+            for c in class_stats.keys():
+                for sn in self.STAT_NAMES:
+                    class_stats[c][sn] = numpy.concatenate(
+                        [class_stats[c][sn], new_stats[c][sn]])
+        self._feature_ids.extend(feature_ids)
+
+    def remove_features(self, feature_is):
+        for class_stats in self._labeling_stats.values():
+            for stats in class_stats.values():
+                for sn in self.STAT_NAMES:
+                    stats[sn] = numpy.delete(stats[sn], feature_is, 0)
+        removed = set(feature_is)
+        self._feature_ids = [fid for i, fid in enumerate(self._feature_ids)
+                             if not i in removed]
+
+    def add_objects(self, feature_matrix, labeling_dict):
+        '''
+        Updates the statistics with the feature values of appended objects,
+        these are the last rows of the (updated) labelings.
+        '''
+        num_new = feature_matrix.shape[0]
+        for lname, class_stats in self._labeling_stats.items():
+            labeling = labeling_dict[lname]
+            new_labels = numpy.array(labeling.labels[-num_new:])
+            for label, c in enumerate(labeling.class_names):
+                rows = numpy.where(new_labels == label)[0]
+                if(len(rows) > 0):
+                    new_stats = self.class_stats(feature_matrix[rows, :])
+                    if(c in class_stats):
+                        class_stats[c] = self.merge_class_stats(
+                            class_stats[c], new_stats)
+                    else:
+                        class_stats[c] = new_stats
+        self._num_objects += num_new
+
+    def _labeling_class_stats(self, labeling, feature_matrix, num_features):
+        if(feature_matrix is None):
+            feature_matrix = numpy.empty((len(labeling.labels), 0))
+        class_stats = {}
+        for c, object_is in labeling.object_indices_per_class.items():
+            class_stats[c] = self.class_stats(feature_matrix[object_is, :])
+        return class_stats
+
+    @classmethod
+    def class_stats(cls, mat):
+        '''
+        Returns the statistics of each column of mat.
+        '''
+
+        mask = ~numpy.isnan(mat)
+        count = mask.sum(axis=0)
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+
+            mean = numpy.where(mask, mat, 0.0).sum(axis=0) / count
+            var = (numpy.where(mask, mat - mean, 0.0) ** 2).sum(axis=0) /\
+                count
+            if(mat.shape[0] > 0):
+                min_val = numpy.where(mask, mat, numpy.inf).min(axis=0)
+                max_val = numpy.where(mask, mat, -numpy.inf).max(axis=0)
+            else:
+                min_val = numpy.empty(mat.shape[1])
+                max_val = numpy.empty(mat.shape[1])
+
+            # NaN values are sorted to the end of each column
+            sorted_mat = numpy.sort(mat, axis=0)
+            pos = cls.QUANTILES[:, None] * numpy.maximum(count - 1, 0)
+            lo = numpy.floor(pos).astype(int)
+            hi = numpy.ceil(pos).astype(int)
+            cols = numpy.arange(mat.shape[1])
+            if(mat.shape[0] > 0):
+                quantiles = (sorted_mat[lo, cols] * (1.0 - (pos - lo)) +
+                             sorted_mat[hi, cols] * (pos - lo)).T
+            else:
+                quantiles = numpy.empty((mat.shape[1], len(cls.QUANTILES)))
+
+        empty = count == 0
+        for a in [mean, var, min_val, max_val]:
+            a[empty] = numpy.nan
+        quantiles[empty, :] = numpy.nan
+
+        return {'count': count, 'min': min_val, 'max': max_val, 'mean': mean,
+                'var': var, 'quantiles': quantiles}
+
+    @classmethod
+    def merge_class_stats(cls, s0, s1):
+        '''
+        Combines the statistics of two disjoint sets of objects.
+        '''
+
+        n0 = s0['count'].astype(float)
+        n1 = s1['count'].astype(float)
+        n = n0 + n1
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            w0 = numpy.where(n > 0, n0 / n, 0.0)
+            w1 = numpy.where(n > 0, n1 / n, 0.0)
+            m0 = numpy.where(n0 > 0, s0['mean'], 0.0)
+            m1 = numpy.where(n1 > 0, s1['mean'], 0.0)
+            v0 = numpy.where(n0 > 0, s0['var'], 0.0)
+            v1 = numpy.where(n1 > 0, s1['var'], 0.0)
+            mean = w0 * m0 + w1 * m1
+            var = w0 * (v0 + (m0 - mean) ** 2) + w1 * (v1 + (m1 - mean) ** 2)
+            mean[n == 0] = numpy.nan
+            var[n == 0] = numpy.nan
+
+        quantiles = numpy.empty(s0['quantiles'].shape)
+        for fi in xrange(len(n)):
+            if(n0[fi] == 0):
+                quantiles[fi] = s1['quantiles'][fi]
+            elif(n1[fi] == 0):
+                quantiles[fi] = s0['quantiles'][fi]
+            else:
+                q0 = s0['quantiles'][fi]
+                q1 = s1['quantiles'][fi]
+                x = numpy.unique(numpy.concatenate([q0, q1]))
+                cdf = w0[fi] * cls._cdf(x, q0) + w1[fi] * cls._cdf(x, q1)
+                quantiles[fi] = numpy.interp(cls.QUANTILES, cdf, x)
+
+        return {'count': s0['count'] + s1['count'],
+                'min': numpy.fmin(s0['min'], s1['min']),
+                'max': numpy.fmax(s0['max'], s1['max']),
+                'mean': mean, 'var': var, 'quantiles': quantiles}
+
+    @classmethod
+    def _cdf(cls, x, quantiles):
+        '''
+        Piecewise linear cumulative distribution given by a quantile summary.
+        '''
+        if(quantiles[0] == quantiles[-1]):
+            return numpy.where(x < quantiles[0], 0.0, 1.0)
+        return numpy.interp(x, quantiles, cls.QUANTILES, left=0.0, right=1.0)
+
+    @classmethod
+    def ttest(cls, stats1, stats0):
+        '''
+        Returns a list with (t-statistic, p-value) tuples, a two-sided
+        t-test (equal variances) per feature, as scipy.stats.ttest_ind.
+        '''
+        n0 = stats0['count'].astype(float)
+        n1 = stats1['count'].astype(float)
+        df = n0 + n1 - 2.0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            # pooled variance, from the population variances
+            svar = (n0 * stats0['var'] + n1 * stats1['var']) / df
+            t = (stats1['mean'] - stats0['mean']) /\
+                numpy.sqrt(svar * (1.0 / n0 + 1.0 / n1))
+            p = stats.t.sf(numpy.abs(t), df) * 2.0
+        return zip(t, p)
+
+    @classmethod
+    def load_from_file(cls, f):
+        with open(f, 'r') as fin:
+            d = json.load(fin)
+        labeling_stats = {}
+        for lname, class_stats in d['labelings'].iteritems():
+            labeling_stats[lname] = {}
+            for c, st in class_stats.iteritems():
+                labeling_stats[lname][c] = dict(
+                    [(sn, numpy.array(st[sn], dtype=float))
+                     for sn in cls.STAT_NAMES])
+                labeling_stats[lname][c]['count'] =\
+                    labeling_stats[lname][c]['count'].astype(int)
+                if(len(labeling_stats[lname][c]['quantiles']) == 0):
+                    labeling_stats[lname][c]['quantiles'] = numpy.empty(
+                        (0, len(cls.QUANTILES)))
+        return cls(d['feature_ids'], d['num_objects'], labeling_stats)
+
+    def save_to_file(self, f):
+        labelings = {}
+        for lname, class_stats in self._labeling_stats.iteritems():
+            labelings[lname] = {}
+            for c, st in class_stats.iteritems():
+                labelings[lname][c] = dict([(sn, st[sn].tolist())
+                                            for sn in self.STAT_NAMES])
+        d = {'feature_ids': self.feature_ids,
+             'num_objects': self.num_objects,
+             'quantiles': self.QUANTILES.tolist(),
+             'labelings': labelings}
+        with open(f, 'w') as fout:
+            json.dump(d, fout)
+
+
+# univariate feature scores, see univariate_scores
+UNIVARIATE_SCORES = ['f', 't', 'pbcorr', 'mi']
+
+# univariate scores that are only defined for two classes
+TWO_CLASS_SCORES = ['t', 'pbcorr']
+
+
+def univariate_scores(data, target, num_bins=10):
+    '''
+    This function calculates univariate scores for each feature (column) of
+    data, given the class labels in target (0, 1, 2, ...). The class sums and
+    sums of squares of all features are obtained with a single matrix
+    product, from which all scores are derived.
+
+    Returns a dictionary with an array of scores per measure:
+
+    - f: ANOVA F-statistic
+    - t: t-statistic, class 1 versus class 0 (equal variances)
+    - pbcorr: point-biserial correlation with class 1
+    - mi: mutual information (nats) between the class and the feature values
+          discretized into num_bins equal width bins (approximate)
+
+    The t-statistic and the point-biserial correlation (TWO_CLASS_SCORES) are
+    None if there are more than two classes.
+    '''
+
+    data = numpy.asarray(data, dtype=float)
+    labels = numpy.asarray(target).astype(int)
+    num_obj, num_feat = data.shape
+    num_classes = labels.max() + 1
+
+    # class indicator matrix
+    indicator = numpy.zeros((num_obj, num_classes))
+    indicator[numpy.arange(num_obj), labels] = 1.0
+
+    n = indicator.sum(axis=0)
+    sums = numpy.dot(indicator.T, data)
+    sqsums = numpy.dot(indicator.T, data ** 2)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        means = sums / n[:, None]
+        total_mean = sums.sum(axis=0) / num_obj
+
+        # between and within class sum of squares
+        ssb = (n[:, None] * (means - total_mean) ** 2).sum(axis=0)
+        ssw = (sqsums - n[:, None] * means ** 2).sum(axis=0)
+        ssw = numpy.maximum(ssw, 0.0)
+
+        f = (ssb / (num_classes - 1)) / (ssw / (num_obj - num_classes))
+
+        if(num_classes == 2):
+            diff = means[1] - means[0]
+            pooled_var = ssw / (num_obj - 2)
+            t = diff / numpy.sqrt(pooled_var * (1.0 / n[0] + 1.0 / n[1]))
+            std = numpy.sqrt((ssb + ssw) / num_obj)
+            pbcorr = diff / std * numpy.sqrt(n[0] * n[1]) / num_obj
+        else:
+            t = None
+            pbcorr = None
+
+        # discretize features, bin index per value
+        min_val = data.min(axis=0)
+        width = (data.max(axis=0) - min_val) / num_bins
+        width[width == 0.0] = 1.0
+        bins = numpy.minimum(((data - min_val) / width).astype(int),
+                             num_bins - 1)
+
+        # joint (feature, bin, class) counts in one bincount
+        index = (numpy.arange(num_feat) * num_bins * num_classes +
+                 bins * num_classes + labels[:, None])
+        joint = numpy.bincount(index.ravel(),
+                               minlength=num_feat * num_bins * num_classes)
+        joint = joint.reshape((num_feat, num_bins, num_classes)) /\
+            float(num_obj)
+
+        p_bin = joint.sum(axis=2)[:, :, None]
+        p_class = (n / num_obj)[None, None, :]
+        mi = numpy.where(joint > 0,
+                         joint * numpy.log(joint / (p_bin * p_class)),
+                         0.0).sum(axis=(1, 2))
+
+    return {'f': f, 't': t, 'pbcorr': pbcorr, 'mi': mi}
+
+
+def rank_features(data, target, measure='f'):
+    '''
+    This function returns the column indices of data, ordered from best to
+    worst feature according to the univariate score measure.
+    '''
+    return rank_scores(univariate_scores(data, target), measure)
+
+
+def rank_scores(scores, measure):
+    '''
+    This function orders the features, given the output of
+    univariate_scores. The absolute value is used for the t-statistic and the
+    point-biserial correlation, features with an undefined score (e.g.
+    constant features) come last.
+
+    Raises:
+        ValueError: If the measure does not exist, or if it is only defined
+                    for two classes and there are more.
+    '''
+
+    if not(measure in UNIVARIATE_SCORES):
+        raise ValueError('Univariate score should be one of: %s.' %
+                         (', '.join(UNIVARIATE_SCORES)))
+
+    scores = scores[measure]
+    if(scores is None):
+        raise ValueError('Univariate score %s is only defined for two '
+                         'classes.' % (measure))
+
+    if(measure in ['t', 'pbcorr']):
+        scores = numpy.abs(scores)
+    scores = numpy.where(numpy.isnan(scores), -numpy.inf, scores)
+
+    # stable sort, ties keep the column order
+    return list(numpy.argsort(-scores, kind='mergesort'))
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+import os
+import json
+import socket
+import threading
+import traceback
+import SocketServer
+from collections import OrderedDict
+from daemon import Daemon
+
+# server socket file in the projects root dir, only accessible by the user
+# that runs the server
+socket_name = 'prediction_server.sock'
+
+# maximal number of trained classifiers kept in memory
+default_cache_size = 10
+
+# seconds that a client waits for the server
+default_timeout = 600
+
+
+class PredictionServer(Daemon):
+    '''
+    Daemon that serves predictions of trained classifiers on a UNIX socket.
+
+    Recently used classifiers are kept in memory (see ClassifierCache), so
+    that sklearn is imported and a classifier is loaded only once instead of
+    for each classify job. A request is a JSON object on one line, the
+    response as well (see handle_request). Requests are handled in a thread
+    each.
+
+    Only classifiers and feature matrices in the projects root_dir are
+    served. The socket is created in root_dir (see socket_file) unless
+    socket_f is provided, with permissions 0600.
+    '''
+
+    def __init__(self, pidfile, root_dir, socket_f=None,
+                 cache_size=default_cache_size, stdin='/dev/null',
+                 stdout='/dev/null', stderr='/dev/null'):
+
+        super(PredictionServer, self).__init__(pidfile, stdin, stdout, stderr)
+
+        self.root_dir = os.path.realpath(root_dir)
+        if(socket_f is None):
+            socket_f = socket_file(self.root_dir)
+        self.socket_f = os.path.abspath(socket_f)
+        self.cache_size = cache_size
+
+    def run(self):
+
+        # remove socket file of previous run
+        if(os.path.exists(self.socket_f)):
+            os.remove(self.socket_f)
+
+        # create the socket file without permissions for others
+        prev_umask = os.umask(0177)
+        try:
+            server = ThreadingUnixStreamServer(self.socket_f,
+                                               PredictionRequestHandler)
+        finally:
+            os.umask(prev_umask)
+        os.chmod(self.socket_f, 0600)
+
+        server.root_dir = self.root_dir
+        server.cl_cache = ClassifierCache(self.cache_size)
+        server.serve_forever()
+
+
+class ThreadingUnixStreamServer(SocketServer.ThreadingMixIn,
+                                SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class PredictionRequestHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            response = handle_request(request, self.server.cl_cache,
+                                      self.server.root_dir)
+        except Exception:
+            response = {'error': traceback.format_exc()}
+        self.wfile.write('%s\n' % (json.dumps(response)))
+
+
+class ClassifierCache(object):
+    '''
+    Least recently used cache of trained classifiers, the feature ids they
+    were trained with, and the standardization statistics of their train
+    data, per classifier dir. A classifier is reloaded if its file changed.
+    The cache can be used by multiple threads.
+    '''
+
+    def __init__(self, max_size=default_cache_size):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, cl_dir):
+        '''
+        Returns the tuple (classifier, feature_ids, train_stats) of the
+        classifier in cl_dir (see classify.load_classifier).
+        '''
+
+        # imported here, clients of the server do not need sklearn
+        from spice import classify
+
+        cl_dir = os.path.abspath(cl_dir)
+        mtime = os.path.getmtime(os.path.join(cl_dir, 'classifier.joblib.pkl'))
+
+        with self._lock:
+
+            item = self._cache.pop(cl_dir, None)
+            if(item is None or not item[0] == mtime):
+                item = (mtime, classify.load_classifier(cl_dir))
+
+            # (re)insert as most recently used, remove least recently used
+            self._cache[cl_dir] = item
+            while(len(self._cache) > self.max_size):
+                self._cache.popitem(last=False)
+
+        return item[1]
+
+
+def socket_file(root_dir):
+    '''
+    Returns the path of the server socket of the projects root_dir.
+    '''
+    return os.path.join(root_dir, socket_name)
+
+
+def check_path(path, root_dir):
+    '''
+    Returns the real path of path (str), which should be inside root_dir
+    (a real path), the server does not load files of other dirs.
+
+    Raises:
+        ValueError: If path is not inside root_dir.
+    '''
+    path = os.path.realpath(str(path))
+    if not(path.startswith(os.path.join(root_dir, ''))):
+        raise ValueError('Path is not in the projects dir: %s' % (path))
+    return path
+
+
+def handle_request(request, cl_cache, root_dir):
+    '''
+    Handles a prediction request, a dictionary with the classifier dir
+    (cl_dir) and either (the dirs should be inside root_dir, see
+    check_path):
+
+    - fm_dir: feature matrix dir, the classify output files are written as
+      classify.classify does, optionally in blocks of chunk_size objects and
+      with the statistics of the feature matrix if data_stats is true.
+      The response is {'status': 'done'}.
+    - rows: list of feature rows, with the classifier features in the order
+      of feature_ids. The rows are standardized with the statistics of the
+      classifier's train data, as the classify feature matrix. Classifiers
+      that were stored without these statistics, or requests with data_stats
+      true, require rows that are standardized already. The response
+      contains the predictions (preds), the probabilities or decision
+      function values (probas), and the feature_ids.
+    '''
+
+    # imported here, clients of the server do not need sklearn
+    import numpy
+    from spice import classify
+    from spice import classification
+
+    cl_dir = check_path(request['cl_dir'], root_dir)
+
+    (classifier, feature_ids, train_stats) = cl_cache.get(cl_dir)
+
+    if('fm_dir' in request):
+        classify.classify(check_path(request['fm_dir'], root_dir), cl_dir,
+                          classifier=classifier, feature_ids=feature_ids,
+                          chunk_size=request.get('chunk_size', None),
+                          train_stats=train_stats,
+                          data_stats=request.get('data_stats', False))
+        return {'status': 'done'}
+
+    elif('rows' in request):
+        data = numpy.array(request['rows'], dtype=float)
+        if not(data.ndim == 2 and data.shape[1] == len(feature_ids)):
+            raise ValueError('Rows should contain %i features.' %
+                             (len(feature_ids)))
+        if not(train_stats is None or request.get('data_stats', False)):
+            classify.standardize(data, train_stats)
+        (preds, probas) = classification.classify(data, classifier)
+        return {'preds': numpy.asarray(preds).tolist(),
+                'probas': numpy.asarray(probas).tolist(),
+                'feature_ids': feature_ids}
+
+    else:
+        raise ValueError('Request should contain fm_dir or rows.')
+
+
+def send_request(request, socket_f, timeout=default_timeout):
+    '''
+    Sends the request to the prediction server listening on socket_f, and
+    returns the response (see handle_request). Waits at most timeout
+    seconds for each socket operation.
+
+    Raises:
+        socket.error: If the server is not available, or if it did not
+                      respond in time (socket.timeout).
+        ValueError: If the server could not handle the request.
+    '''
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_f)
+        sock.sendall('%s\n' % (json.dumps(request)))
+        response = json.loads(sock.makefile('r').readline())
+    finally:
+        sock.close()
+
+    if('error' in response):
+        raise ValueError('Prediction server error:\n%s' % (response['error']))
+
+    return response
+
+
+#if __name__ == "__main__":
+# TODO add test runs
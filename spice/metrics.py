@@ -0,0 +1,257 @@
+'''
+Classification performance measures that are derived from one sort of the
+scores and one confusion matrix, instead of a separate pass (and separate
+input validation) per measure.
+
+The results are the same as those of the scikit-learn 0.14 metrics that
+classification used before: roc_auc_score, average_precision_score (the
+trapezoidal area under the precision-recall curve), matthews_corrcoef,
+f1_score, precision_score, recall_score (positive class 1 for two classes,
+weighted average otherwise), accuracy_score, and confusion_matrix.
+'''
+
+import numpy
+
+# measures that use the class predictions, or the scores (probabilities or
+# decision function values) of the positive class
+pred_score_names = ['mcc', 'f1', 'precision', 'recall', 'accuracy']
+proba_score_names = ['roc_auc', 'average_precision']
+
+# label of the positive class in two class problems
+POS_LABEL = 1
+
+
+def binary_curve(target, proba):
+    '''
+    Returns the number of false positives and true positives at each
+    distinct score threshold, in decreasing threshold order, as the tuple
+    (fps, tps). The scores are sorted once, tied scores share a threshold.
+
+    Raises:
+        ValueError: If target contains other labels than 0 and 1.
+    '''
+
+    target = numpy.asarray(target)
+    proba = numpy.asarray(proba)
+
+    classes = numpy.unique(target)
+    if not(numpy.all(numpy.in1d(classes, [0, POS_LABEL]))):
+        raise ValueError('Data is not binary.')
+
+    order = numpy.argsort(proba, kind='mergesort')[::-1]
+    proba = proba[order]
+    is_pos = target[order] == POS_LABEL
+
+    # last index of each distinct score, and of the curve
+    threshold_is = numpy.r_[numpy.where(numpy.diff(proba))[0],
+                            is_pos.size - 1]
+
+    tps = is_pos.cumsum()[threshold_is]
+    fps = 1 + threshold_is - tps
+
+    return (fps, tps)
+
+
+def roc_points(fps, tps):
+    '''
+    Returns the ROC curve given by binary_curve, as the tuple (fpr, tpr) of
+    false and true positive rates, starting at (0, 0).
+
+    Raises:
+        ValueError: If there are no positives or no negatives.
+    '''
+
+    if(fps[-1] == 0 or tps[-1] == 0):
+        raise ValueError('AUC is defined for binary classification only')
+
+    # the curve starts at (0, 0)
+    if not(fps[0] == 0):
+        fps = numpy.r_[0, fps]
+        tps = numpy.r_[0, tps]
+
+    return (fps / float(fps[-1]), tps / float(tps[-1]))
+
+
+def roc_auc(fps, tps):
+    '''
+    Returns the area under the ROC curve given by binary_curve.
+
+    Raises:
+        ValueError: If there are no positives or no negatives.
+    '''
+    (fpr, tpr) = roc_points(fps, tps)
+    return numpy.trapz(tpr, fpr)
+
+
+def average_precision(fps, tps):
+    '''
+    Returns the (trapezoidal) area under the precision-recall curve given by
+    binary_curve, nan if there are no positives (as average_precision_score).
+    '''
+
+    if(tps[-1] == 0):
+        return numpy.nan
+
+    precision = tps / (tps + fps).astype(float)
+    recall = tps / float(tps[-1])
+
+    # stop at full recall, in decreasing recall order, ending at (0, 1)
+    last_i = tps.searchsorted(tps[-1])
+    precision = numpy.r_[precision[last_i::-1], 1]
+    recall = numpy.r_[recall[last_i::-1], 0]
+
+    if(numpy.any(numpy.diff(recall) < 0)):
+        return -numpy.trapz(precision, recall)
+    else:
+        return numpy.trapz(precision, recall)
+
+
+def confusion_matrix(target, pred):
+    '''
+    Returns the confusion matrix of the class predictions pred, with a row
+    per true class and a column per predicted class, in label order.
+    '''
+    return _confusion(target, pred)[1]
+
+
+def _confusion(target, pred):
+    '''
+    Returns the tuple (labels, confusion matrix), the labels are all labels
+    in target and pred.
+    '''
+    target = numpy.asarray(target)
+    pred = numpy.asarray(pred)
+    labels = numpy.union1d(target, pred)
+    target_is = numpy.searchsorted(labels, target)
+    pred_is = numpy.searchsorted(labels, pred)
+    cm = numpy.bincount(target_is * labels.size + pred_is,
+                        minlength=labels.size ** 2)
+    return (labels, cm.reshape((labels.size, labels.size)))
+
+
+def pred_scores(target, pred):
+    '''
+    Returns the measures in pred_score_names that are defined for the class
+    predictions pred, as dictionary, all derived from one confusion matrix.
+    The mcc is only defined for two classes, it is 0.0 if target and pred
+    contain only one class.
+    '''
+
+    (labels, cm) = _confusion(target, pred)
+
+    tp = numpy.diag(cm)
+    fp = cm.sum(axis=0) - tp
+    fn = cm.sum(axis=1) - tp
+    support = tp + fn
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+
+        precision = tp.astype(float) / (tp + fp)
+        recall = tp.astype(float) / (tp + fn)
+        precision[(tp + fp) == 0] = 0.0
+        recall[(tp + fn) == 0] = 0.0
+
+        f1 = 2.0 * precision * recall / (precision + recall)
+        f1[(precision + recall) == 0] = 0.0
+
+    scores = {'accuracy': tp.sum() / float(cm.sum())}
+
+    if(labels.size <= 2):
+
+        # scores of the positive class
+        if(POS_LABEL in labels):
+            pos_i = numpy.where(labels == POS_LABEL)[0][0]
+            scores.update({'f1': f1[pos_i], 'precision': precision[pos_i],
+                           'recall': recall[pos_i]})
+        elif(labels.size == 1):
+            scores.update({'f1': 0.0, 'precision': 0.0, 'recall': 0.0})
+
+        # mcc of the second class (as matthews_corrcoef), 0.0 if undefined
+        if(labels.size == 1):
+            scores['mcc'] = 0.0
+        else:
+            (tn, fp_, fn_, tp_) = cm.astype(numpy.int64).ravel()
+            num = tp_ * tn - fp_ * fn_
+            den = numpy.sqrt((tp_ + fp_) * (tp_ + fn_) * (tn + fp_) *
+                             (tn + fn_))
+            scores['mcc'] = 0.0 if den == 0 else num / den
+
+    else:
+
+        # averages weighted by the class sizes
+        if(support.sum() == 0):
+            scores.update({'f1': 0.0, 'precision': 0.0, 'recall': 0.0})
+        else:
+            scores.update({
+                'f1': numpy.average(f1, weights=support),
+                'precision': numpy.average(precision, weights=support),
+                'recall': numpy.average(recall, weights=support)})
+
+    return scores
+
+
+def proba_scores(target, proba):
+    '''
+    Returns the measures in proba_score_names that are defined for the
+    scores proba, as dictionary, derived from one binary_curve. These are
+    only defined for two classes.
+    '''
+
+    try:
+        (fps, tps) = binary_curve(target, proba)
+    except ValueError:
+        return {}
+
+    return curve_scores(fps, tps)
+
+
+def curve_scores(fps, tps):
+    '''
+    Returns the measures in proba_score_names that are defined for the curve
+    given by binary_curve, as dictionary.
+    '''
+
+    scores = {}
+
+    for name, func in [('roc_auc', roc_auc),
+                       ('average_precision', average_precision)]:
+        try:
+            scores[name] = func(fps, tps)
+        except ValueError:
+            pass
+
+    return scores
+
+
+def all_scores(target, pred, proba):
+    '''
+    Returns all measures that are defined for the class predictions pred and
+    the scores proba, as dictionary (see pred_scores and proba_scores).
+    '''
+    scores = pred_scores(target, pred)
+    scores.update(proba_scores(target, proba))
+    return scores
+
+
+def score(name, target, pred, proba):
+    '''
+    Returns the measure name for the class predictions pred or the scores
+    proba.
+
+    Raises:
+        ValueError: If the measure does not exist, or if it is not defined
+                    for the target.
+    '''
+
+    if(name in pred_score_names):
+        scores = pred_scores(target, pred)
+    elif(name in proba_score_names):
+        scores = proba_scores(target, proba)
+    else:
+        raise ValueError('Score does not exist: %s' % (name))
+
+    if not(name in scores):
+        raise ValueError('%s is not defined for the target.' % (name))
+
+    return scores[name]
+
@@ -0,0 +1,122 @@
+'''
+Storage of trained classifiers.
+
+A classifier is stored in a dir with joblib, by default uncompressed, in
+which case the numpy arrays of the classifier (support vectors, trees, ...)
+are stored as raw data (the joblib of scikit-learn 0.14 stores them in
+separate files next to the pickle). These are memory-mapped when the
+classifier is loaded, so that loading does not read the arrays eagerly, and
+processes that load the same classifier share its memory. Optionally the
+classifier is compressed (fast compression level 1 is usually enough),
+compressed classifiers are read at once.
+
+A small JSON metadata file is stored with the classifier, with the ids of
+the features it was trained with, the standardization statistics of the
+train data, the class labels, and how the classifier is stored. It can be
+read without loading the classifier (see load_meta).
+'''
+
+import os
+import glob
+import json
+
+import sklearn
+from sklearn.externals import joblib
+
+from biopy import file_io
+
+# file names of a stored classifier in its dir
+classifier_file = 'classifier.joblib.pkl'
+meta_file = 'classifier.json'
+
+# mode in which the arrays of uncompressed classifiers are memory-mapped,
+# copy-on-write, because the prediction code of some classifiers requires
+# writable arrays
+default_mmap_mode = 'c'
+
+
+def save(classifier, cl_dir, feature_ids, mean=None, std=None, compress=0):
+    '''
+    Stores the trained classifier in cl_dir, with its metadata: the
+    feature_ids it was trained with and, if the train data was standardized,
+    the mean and std of the features (before standardization). The
+    classifier is compressed with compression level compress (0-9), 0 means
+    uncompressed and memory-mappable.
+
+    Raises:
+        ValueError: If compress is not in the range 0-9.
+    '''
+
+    if not(compress in range(10)):
+        raise ValueError('Compression level should be in range 0-9.')
+
+    cl_f = os.path.join(cl_dir, classifier_file)
+
+    # remove array files of a previously stored classifier
+    for f in glob.glob('%s*' % (cl_f)):
+        os.remove(f)
+
+    files = joblib.dump(classifier, cl_f, compress=compress)
+
+    classes = getattr(classifier, 'classes_', None)
+    if not(mean is None):
+        mean = [float(m) for m in mean]
+        std = [float(s) for s in std]
+
+    meta = {
+        'classifier': type(classifier).__name__,
+        'feature_ids': list(feature_ids),
+        'classes': None if classes is None else
+        [c.item() if hasattr(c, 'item') else c for c in classes],
+        'mean': mean,
+        'std': std,
+        'compress': compress,
+        'files': [os.path.basename(f) for f in files],
+        'sklearn_version': sklearn.__version__
+    }
+
+    with open(os.path.join(cl_dir, meta_file), 'w') as fout:
+        json.dump(meta, fout, indent=4, sort_keys=True)
+
+
+def load_meta(cl_dir):
+    '''
+    Returns the metadata dictionary of the classifier in cl_dir (see save).
+    For classifiers that were stored without metadata, only the feature_ids
+    (from the settings.txt file in cl_dir) and compress (None, unknown) are
+    provided.
+    '''
+
+    meta_f = os.path.join(cl_dir, meta_file)
+
+    if(os.path.exists(meta_f)):
+        with open(meta_f, 'r') as fin:
+            meta = json.load(fin)
+        # json provides unicode strings
+        meta['feature_ids'] = [str(f) for f in meta['feature_ids']]
+    else:
+        settings_f = os.path.join(cl_dir, 'settings.txt')
+        settings_dict = file_io.read_settings_dict(settings_f)
+        meta = {'feature_ids': settings_dict['feature_names'],
+                'compress': None}
+
+    return meta
+
+
+def load(cl_dir, mmap_mode=default_mmap_mode):
+    '''
+    Returns the tuple (classifier, meta) of the classifier stored in cl_dir,
+    meta is the metadata dictionary (see load_meta). The arrays of an
+    uncompressed classifier are memory-mapped with mmap_mode, unless it is
+    None.
+    '''
+
+    meta = load_meta(cl_dir)
+
+    cl_f = os.path.join(cl_dir, classifier_file)
+    if(meta['compress'] == 0):
+        classifier = joblib.load(cl_f, mmap_mode=mmap_mode)
+    else:
+        classifier = joblib.load(cl_f)
+
+    return (classifier, meta)
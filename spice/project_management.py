@@ -3,21 +3,33 @@ import operator
 import glob
 import datetime
 import time
+import hashlib
 import numpy
 import shutil
+import tarfile
+import tempfile
 import traceback
 #import urllib2
 #import random
 
 from spice import featext
 from spice import featmat
+from spice import telemetry
+from spice.job_runner import prediction_server
 from biopy import sequtil
 from biopy import file_io
 
 
 class ProjectManager(object):
 
-    TIMEOUT = 20  # sec
+    TIMEOUT = 20  # sec, budget of each parameter search
+
+    # file in the output dir of a classification job with its cache key
+    CACHE_KEY_F = 'cache_key.txt'
+    # number of objects of which the feature values are hashed at once
+    CACHE_KEY_BLOCK_SIZE = 1000
+    # archive with the stored classifier files, see get_classifier_f
+    CLASSIFIER_ARCHIVE_F = 'classifier.tar.gz'
 
     def __init__(self, root_dir, ref_data_dir):
         self.root_dir = root_dir
@@ -54,6 +66,8 @@ class ProjectManager(object):
             self.fe_dir = os.path.join(self.project_dir, 'feature_extraction')
             self.fm_dir = os.path.join(self.fe_dir, 'feature_matrix_protein')
             self.cl_dir = os.path.join(self.project_dir, 'classification')
+            self.cl_cache_dir = os.path.join(self.project_dir,
+                                             'classification_cache')
 
             # set paths to jobs dir, and job status sub-directories
             self.job_dir = os.path.join(self.project_dir, 'jobs')
@@ -120,6 +134,24 @@ class ProjectManager(object):
             fm = featmat.FeatureMatrix.load_from_dir(self.fm_dir)
         return fm
 
+    def get_feature_statistics(self, labeling_name=None):
+        '''
+        Returns the feature statistics of the labeling (see
+        FeatureMatrix.feature_statistics) of the project with project_id, for
+        overview pages. The stored statistics are read without loading the
+        feature matrix, the feature matrix is only loaded (and the statistics
+        stored) if they are not available yet.
+        '''
+        fstats = None
+        if not(self.project_id is None):
+            fstats = featmat.FeatureMatrix.load_feature_statistics(
+                self.fm_dir, labeling_name)
+            if(fstats is None):
+                fm = self.get_feature_matrix()
+                fstats = fm.feature_statistics(labeling_name)
+                fm.save_feature_statistics(self.fm_dir)
+        return fstats
+
     # helper function
     def timestamp_str(self):
         return datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
@@ -297,21 +329,81 @@ class ProjectManager(object):
         return pred_f
 
     def get_classifier_f(self, cl_id):
-        cl_f = os.path.join(self.get_cl_dir(cl_id), 'classifier.joblib.pkl')
-        if(os.path.exists(cl_f)):
-            return cl_f
-        else:
+        '''
+        Returns the path of an archive with all files of the stored
+        classifier (see spice.model_store): the pickle, the array files of
+        an uncompressed classifier, and the classifier.json metadata. The
+        archive is created in the classifier dir if it does not exist or if
+        the classifier changed. Returns None if there is no classifier.
+        '''
+
+        cl_dir = self.get_cl_dir(cl_id)
+        cl_f = os.path.join(cl_dir, 'classifier.joblib.pkl')
+        if not(os.path.exists(cl_f)):
             return None
 
+        files = sorted(glob.glob('%s*' % (cl_f)))
+        meta_f = os.path.join(cl_dir, 'classifier.json')
+        if(os.path.exists(meta_f)):
+            files.append(meta_f)
+
+        archive_f = os.path.join(cl_dir, self.CLASSIFIER_ARCHIVE_F)
+        if not(os.path.exists(archive_f) and
+               os.path.getmtime(archive_f) >=
+               max([os.path.getmtime(f) for f in files])):
+
+            # write to a temporary file first, so that a download never gets
+            # a partial archive
+            (fd, tmp_f) = tempfile.mkstemp(dir=cl_dir)
+            os.close(fd)
+            with tarfile.open(tmp_f, 'w:gz') as tar:
+                for f in files:
+                    tar.add(f, arcname=os.path.basename(f))
+            os.chmod(tmp_f, 0644)
+            os.rename(tmp_f, archive_f)
+
+        return archive_f
+
     def get_classifier_progress(self, cl_id):
+        '''
+        Returns the progress output of the classification job, preceded by a
+        line with the percentage done and the ETA if the job records them
+        (see get_classifier_eta).
+        '''
 
         f = os.path.join(self.cl_dir, cl_id, 'progress.txt')
         result = ''
+
+        eta = self.get_classifier_eta(cl_id)
+        if(eta):
+            (percentage, seconds) = eta
+            if(seconds is None):
+                result += 'progress: %i%%\n' % (percentage)
+            else:
+                result += 'progress: %i%%, ETA: %s\n' % (
+                    percentage, datetime.timedelta(seconds=int(seconds)))
+
         with open(f, 'r') as fin:
             for line in fin:
                 result += line
         return result
 
+    def get_classifier_eta(self, cl_id):
+        '''
+        Returns the tuple (percentage, eta) of the classification job, the
+        percentage done and the estimated number of seconds until it is done
+        (None if it cannot be estimated yet), from the telemetry records of
+        the job (see telemetry.progress). Returns None if there are no
+        records.
+        '''
+
+        f = os.path.join(self.cl_dir, cl_id, 'telemetry.jsonl')
+        if not(os.path.exists(f)):
+            return None
+
+        (fraction, eta) = telemetry.progress(telemetry.read(f))
+        return (100.0 * fraction, eta)
+
     def get_classifier_error(self, cl_id):
 
         f = os.path.join(self.cl_dir, cl_id, 'error.txt')
@@ -791,6 +883,55 @@ class ProjectManager(object):
             with open(os.path.join(self.job_waiting_dir, jobid), 'w') as fout:
                 fout.write(file_content)
 
+    def get_classification_cache_key(self, classifier, labeling_name,
+                                     feat_ids, options):
+        '''
+        Returns the result cache key of a classification job: a hash of the
+        classification command options, the default parameter grid of the
+        classifier, the object ids, the labeling, and the values of the
+        features feat_ids. The feature values are read in blocks of objects
+        (see FeatureMatrix.iter_feature_blocks), the feature matrix is not
+        loaded at once. Returns None if a feature does not exist.
+        '''
+
+        # imported here, the other project functions do not need sklearn
+        from spice import classification
+
+        fm_cls = featmat.FeatureMatrix
+
+        sha1 = hashlib.sha1()
+        sha1.update(' '.join(options))
+        grid = classification.default_param_grid(classifier)
+        sha1.update(str(sorted([(p, list(r)) for p, r in grid.iteritems()])))
+        for f in [os.path.join(self.fm_dir, fm_cls.OBJECT_IDS_F),
+                  os.path.join(self.fm_dir, fm_cls.LABELING_D,
+                               '%s.txt' % (labeling_name))]:
+            if(os.path.exists(f)):
+                with open(f, 'r') as fin:
+                    sha1.update(fin.read())
+        try:
+            for object_ids, data in fm_cls.iter_feature_blocks(
+                    self.fm_dir, feat_ids, self.CACHE_KEY_BLOCK_SIZE):
+                sha1.update(numpy.ascontiguousarray(data).tostring())
+        except ValueError:
+            return None
+        return sha1.hexdigest()
+
+    def get_cached_classification(self, cache_key):
+        '''
+        Returns the id of a done classification job with cache_key, or None
+        if there is none.
+        '''
+        for f in glob.glob(os.path.join(self.cl_dir, '*', self.CACHE_KEY_F)):
+            cl_id = os.path.basename(os.path.dirname(f))
+            with open(f, 'r') as fin:
+                key = fin.read().strip()
+            if(key == cache_key and
+               os.path.exists(os.path.join(self.job_done_dir, cl_id)) and
+               self.get_classifier_finished(cl_id)):
+                return cl_id
+        return None
+
     def run_classification(self, classifier, n_fold_cv, labeling_name,
                            class_ids, feat_ids, eval_score='roc_auc',
                            featsel=None):
@@ -827,13 +968,41 @@ class ProjectManager(object):
             '--features %s' % (' '.join(feat_ids.split(','))),
             '--standardize',
             '--timeout %i' % (self.TIMEOUT),
-            '-o %s' % (out_dir)]
+            '--cache_dir %s' % (self.cl_cache_dir)]
+
+        # the result of an identical job can be reused
+        cache_key = self.get_classification_cache_key(
+            classifier, labeling_name, feat_ids.split(','), options)
+        if not(cache_key is None):
+            with open(os.path.join(out_dir, self.CACHE_KEY_F), 'w') as fout:
+                fout.write('%s\n' % (cache_key))
+            cached_id = self.get_cached_classification(cache_key)
+        else:
+            cached_id = None
+
+        options.append('-o %s' % (out_dir))
 
         # create command
         cmd = 'classification %s' % (' '.join(options))
 
+        if(cached_id is None):
+            job_d = self.job_waiting_dir
+        else:
+            # copy the result of the identical job, the job is done without
+            # running it
+            cached_d = os.path.join(self.cl_dir, cached_id)
+            for d in glob.glob(os.path.join(cached_d, '*')):
+                if(os.path.isdir(d)):
+                    shutil.copytree(d, os.path.join(out_dir,
+                                                    os.path.basename(d)))
+            with open(progress_f, 'w') as fout:
+                fout.write('Result of identical classification job %s.\n' %
+                           (cached_id))
+            open(error_f, 'w').close()
+            job_d = self.job_done_dir
+
         # create job file
-        with open(os.path.join(self.job_waiting_dir, jobid), 'w') as fout:
+        with open(os.path.join(job_d, jobid), 'w') as fout:
             fout.write('%s\n' % (cmd))
             fout.write('%s\n' % (progress_f))
             fout.write('%s\n' % (error_f))
@@ -894,7 +1063,8 @@ class ProjectManager(object):
         # create the list of options for the classification command
         options = [
             '-f %s' % (fm_dir),
-            '-c %s' % (self.get_cl_dir(cl_id))
+            '-c %s' % (self.get_cl_dir(cl_id)),
+            '--socket %s' % (prediction_server.socket_file(self.root_dir))
         ]
 
         # create command
@@ -0,0 +1,191 @@
+'''
+Structured progress and resource records of classification jobs.
+
+The records are written as JSON lines (one JSON object per line) to the
+telemetry file of the job. The file is set with start, in an environment
+variable, so that the worker processes of a job write to the same file.
+Without a telemetry file, record does nothing.
+
+Each record contains the event name, the time, the process id, the peak
+resident set size of the process in kB (peak_rss), and the number of
+classifiers fitted by the process so far (total_fits, see count_fits). The
+records that count towards the progress of an experiment contain units, the
+experiment record contains the expected total number of units (see
+progress).
+'''
+
+import os
+import json
+import time
+import uuid
+import resource
+
+# environment variables with the telemetry file and the running experiment
+telemetry_env = 'SPICE_TELEMETRY_FILE'
+experiment_env = 'SPICE_TELEMETRY_EXPERIMENT'
+
+# number of classifiers fitted by this process
+_num_fits = [0]
+
+
+def start(telemetry_f, **fields):
+    '''
+    Sets the telemetry file of this process and its workers, and records the
+    start of the job with the fields, such as the number of experiments.
+    '''
+    os.environ[telemetry_env] = os.path.abspath(telemetry_f)
+    record('job', **fields)
+
+
+def stop(**fields):
+    '''
+    Records the end of the job, including the peak resident set size of the
+    worker processes (peak_rss_children), and unsets the telemetry file.
+    '''
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    record('job_end', peak_rss_children=children_rss, **fields)
+    os.environ.pop(telemetry_env, None)
+    os.environ.pop(experiment_env, None)
+
+
+def start_experiment(units, **fields):
+    '''
+    Records the start of an experiment that consists of units progress
+    units, and returns its id. The records of this process and the workers
+    it starts afterwards belong to the experiment.
+    '''
+    experiment_id = uuid.uuid4().hex
+    os.environ[experiment_env] = experiment_id
+    record('experiment', units=units, **fields)
+    return experiment_id
+
+
+def end_experiment(**fields):
+    '''
+    Records the end of the running experiment.
+    '''
+    record('experiment_end', **fields)
+    os.environ.pop(experiment_env, None)
+
+
+def count_fits(num=1):
+    '''
+    Adds num to the number of classifiers fitted by this process.
+    '''
+    _num_fits[0] += num
+
+
+def num_fits():
+    return _num_fits[0]
+
+
+def record(event, **fields):
+    '''
+    Appends a record of event with the fields to the telemetry file, if
+    there is one.
+    '''
+
+    telemetry_f = os.environ.get(telemetry_env, None)
+    if(telemetry_f is None):
+        return
+
+    rec = {
+        'event': event,
+        'time': time.time(),
+        'pid': os.getpid(),
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'total_fits': _num_fits[0]
+    }
+    if(experiment_env in os.environ):
+        rec['experiment'] = os.environ[experiment_env]
+    rec.update(fields)
+
+    # one write per line, appended lines of the workers do not interleave
+    line = '%s\n' % (json.dumps(rec, sort_keys=True))
+    fd = os.open(telemetry_f, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read(telemetry_f):
+    '''
+    Returns the list of records in telemetry_f. Lines that cannot be parsed,
+    such as a line that is still being written, are skipped.
+    '''
+
+    records = []
+    with open(telemetry_f, 'r') as fin:
+        for line in fin:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def progress(records, now=None):
+    '''
+    Returns the tuple (fraction, eta) of a job given its records: the
+    fraction of the job that is done, and the estimated number of seconds
+    until it is done (None if this cannot be estimated yet).
+
+    The fraction done of an experiment is the number of units recorded for
+    it, divided by its expected number of units, or 1.0 if it ended. The
+    expected number of units is an upper bound for feature selection
+    experiments that can stop early. The fraction of the job is the average
+    over its experiments, the ones that did not start yet count as 0.0. The
+    ETA assumes that the rest of the job takes as long as the part that is
+    done.
+    '''
+
+    if(now is None):
+        now = time.time()
+
+    job = None
+    finished = False
+    units = {}
+    done = {}
+
+    for rec in records:
+
+        event = rec.get('event', None)
+        experiment_id = rec.get('experiment', None)
+
+        if(event == 'job'):
+            job = rec
+        elif(event == 'job_end'):
+            finished = True
+        elif(event == 'experiment'):
+            units[experiment_id] = rec.get('units', 0)
+            done.setdefault(experiment_id, 0.0)
+        elif(event == 'experiment_end'):
+            done[experiment_id] = None
+        elif(experiment_id in done and not(done[experiment_id] is None)):
+            done[experiment_id] += rec.get('units', 0)
+
+    if(finished):
+        return (1.0, 0.0)
+    if(job is None):
+        return (0.0, None)
+
+    fractions = []
+    for experiment_id, num_done in done.iteritems():
+        if(num_done is None):
+            fractions.append(1.0)
+        elif(units[experiment_id] > 0):
+            fractions.append(min(1.0, num_done / units[experiment_id]))
+        else:
+            fractions.append(0.0)
+
+    num_experiments = max(job.get('experiments', 1), len(fractions), 1)
+    fraction = sum(fractions) / float(num_experiments)
+
+    if(fraction > 0.0):
+        elapsed = now - job['time']
+        eta = elapsed * (1.0 - fraction) / fraction
+    else:
+        eta = None
+
+    return (fraction, eta)
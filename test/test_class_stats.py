@@ -0,0 +1,137 @@
+import unittest
+
+import numpy
+from sklearn import lda
+from sklearn import qda
+from sklearn import naive_bayes
+from sklearn import neighbors
+from sklearn import cross_validation
+
+from spice import class_stats
+from spice import metrics as spice_metrics
+
+
+class TestClassStats(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.target = numpy.repeat([0, 1], 30)
+        rng.shuffle(self.target)
+        self.data = rng.randn(60, 4) + self.target[:, None] * [1, 0, 0.5, 0]
+        # a constant feature
+        self.data[:, 3] = 2.0
+        self.tst_data = rng.randn(20, 4)
+        self.tst_data[:, 3] = 2.0
+
+    def _classifiers(self):
+        return [naive_bayes.GaussianNB(), lda.LDA(), qda.QDA(reg_param=0.1),
+                neighbors.NearestCentroid()]
+
+    def _stats(self, classifier, data, target):
+        return class_stats.class_stats(
+            data, target, 2, cov=class_stats.needs_cov(classifier))
+
+    def test_class_stats(self):
+        (counts, means, scatters) = class_stats.class_stats(
+            self.data, self.target, 2)
+        for c in [0, 1]:
+            class_data = self.data[self.target == c]
+            self.assertEqual(counts[c], class_data.shape[0])
+            numpy.testing.assert_allclose(means[c], class_data.mean(axis=0))
+            numpy.testing.assert_allclose(
+                scatters[c], numpy.cov(class_data.T, bias=1) * counts[c],
+                atol=1e-10)
+
+    def test_subtract_and_select(self):
+        part_is = numpy.arange(0, 60, 3)
+        rest_is = numpy.setdiff1d(numpy.arange(60), part_is)
+        for cov in [True, False]:
+            stats = class_stats.class_stats(self.data, self.target, 2,
+                                            cov=cov)
+            part = class_stats.class_stats(self.data[part_is],
+                                           self.target[part_is], 2, cov=cov)
+            rest = class_stats.class_stats(self.data[rest_is],
+                                           self.target[rest_is], 2, cov=cov)
+            feat_is = [2, 0]
+            diff = class_stats.select(class_stats.subtract(stats, part),
+                                      feat_is)
+            ref = class_stats.select(rest, feat_is)
+            for a, b in zip(diff, ref):
+                numpy.testing.assert_allclose(a, b, atol=1e-10)
+
+    def test_predict(self):
+        for classifier in self._classifiers():
+            stats = self._stats(classifier, self.data, self.target)
+            (pred, proba) = class_stats.predict(classifier, stats,
+                                                self.tst_data)
+            classifier.fit(self.data, self.target)
+            self.assertTrue(numpy.array_equal(
+                pred, classifier.predict(self.tst_data)), classifier)
+            if(isinstance(classifier, naive_bayes.GaussianNB)):
+                numpy.testing.assert_allclose(
+                    proba, classifier.predict_proba(self.tst_data)[:, 1],
+                    rtol=1e-6)
+            elif(isinstance(classifier, (lda.LDA, qda.QDA))):
+                numpy.testing.assert_allclose(
+                    proba, classifier.decision_function(self.tst_data),
+                    rtol=1e-6, atol=1e-8)
+            else:
+                self.assertTrue(proba is None)
+
+    def test_predict_single_class(self):
+        target = numpy.zeros(60, dtype=int)
+        for classifier in self._classifiers():
+            stats = self._stats(classifier, self.data, target)
+            if(isinstance(classifier, naive_bayes.GaussianNB)):
+                (pred, proba) = class_stats.predict(classifier, stats,
+                                                    self.tst_data)
+                self.assertTrue(numpy.all(pred == 0))
+            else:
+                self.assertRaises(ValueError, class_stats.predict,
+                                  classifier, stats, self.tst_data)
+
+    def test_cv_stats(self):
+        folds = list(cross_validation.StratifiedKFold(self.target, 5))
+        feat_is = [0, 2, 3]
+        for classifier in self._classifiers():
+            for scoring in ['accuracy', 'f1', 'roc_auc']:
+                if not(class_stats.possible(classifier, scoring, 2, 4,
+                                            len(folds))):
+                    continue
+                cv_stats = class_stats.CVStats(
+                    self.data, self.target, folds,
+                    cov=class_stats.needs_cov(classifier))
+                scores = cv_stats.scores(self.data, classifier, scoring,
+                                         feat_is)
+                for fold_i, (trn_is, tst_is) in enumerate(folds):
+                    classifier.fit(self.data[numpy.ix_(trn_is, feat_is)],
+                                   self.target[trn_is])
+                    tst_data = self.data[numpy.ix_(tst_is, feat_is)]
+                    if(isinstance(classifier, naive_bayes.GaussianNB)):
+                        proba = classifier.predict_proba(tst_data)[:, 1]
+                    elif(isinstance(classifier, (lda.LDA, qda.QDA))):
+                        proba = classifier.decision_function(tst_data)
+                    else:
+                        proba = None
+                    ref = spice_metrics.score(
+                        scoring, self.target[tst_is],
+                        classifier.predict(tst_data), proba)
+                    self.assertAlmostEqual(scores[fold_i], ref)
+
+    def test_cv_stats_rows_and_columns(self):
+        rows = numpy.arange(10, 60)
+        columns = [0, 1, 2]
+        folds = list(cross_validation.KFold(len(rows), 5))
+        classifier = lda.LDA()
+        cv_stats = class_stats.CVStats(self.data, self.target, folds,
+                                       columns=columns, rows=rows)
+        ref_stats = class_stats.CVStats(
+            self.data[numpy.ix_(rows, columns)], self.target[rows], folds)
+        self.assertTrue(numpy.allclose(
+            cv_stats.scores(self.data, classifier, 'accuracy', [0, 2]),
+            ref_stats.scores(self.data[numpy.ix_(rows, columns)],
+                             classifier, 'accuracy', [0, 2])))
+
+
+if __name__ == '__main__':
+    unittest.main()
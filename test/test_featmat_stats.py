@@ -0,0 +1,121 @@
+import unittest
+
+import numpy
+from scipy import stats
+from sklearn import metrics
+
+from spice import featmat
+
+
+class TestFeatureStatistics(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.mat = rng.randn(40, 5)
+        # tied values, a constant feature, and missing values
+        self.mat[:, 1] = numpy.round(self.mat[:, 1])
+        self.mat[:, 2] = 3.0
+        self.mat[::7, 4] = numpy.nan
+
+    def _assert_stats(self, st, mat):
+        numpy.testing.assert_array_equal(
+            st['count'], (~numpy.isnan(mat)).sum(axis=0))
+        for fi in xrange(mat.shape[1]):
+            col = mat[~numpy.isnan(mat[:, fi]), fi]
+            self.assertAlmostEqual(st['mean'][fi], col.mean())
+            self.assertAlmostEqual(st['var'][fi], col.var())
+            self.assertEqual(st['min'][fi], col.min())
+            self.assertEqual(st['max'][fi], col.max())
+
+    def test_class_stats(self):
+        st = featmat.FeatureStatistics.class_stats(self.mat)
+        self._assert_stats(st, self.mat)
+        for fi in xrange(self.mat.shape[1]):
+            col = self.mat[~numpy.isnan(self.mat[:, fi]), fi]
+            numpy.testing.assert_allclose(
+                st['quantiles'][fi],
+                numpy.percentile(col, featmat.FeatureStatistics.QUANTILES *
+                                 100.0))
+
+    def test_merge_class_stats(self):
+        fs = featmat.FeatureStatistics
+        merged = fs.merge_class_stats(fs.class_stats(self.mat[:15]),
+                                      fs.class_stats(self.mat[15:]))
+        self._assert_stats(merged, self.mat)
+        # the approximate quantiles keep the range and are sorted
+        numpy.testing.assert_allclose(merged['quantiles'][:, 0],
+                                      merged['min'])
+        numpy.testing.assert_allclose(merged['quantiles'][:, -1],
+                                      merged['max'])
+        self.assertTrue(numpy.all(numpy.diff(merged['quantiles'],
+                                             axis=1) >= 0))
+
+    def test_merge_empty(self):
+        fs = featmat.FeatureStatistics
+        st = fs.class_stats(self.mat)
+        merged = fs.merge_class_stats(st, fs.class_stats(self.mat[:0]))
+        self._assert_stats(merged, self.mat)
+        numpy.testing.assert_allclose(merged['quantiles'], st['quantiles'])
+
+    def test_ttest(self):
+        fs = featmat.FeatureStatistics
+        mat = self.mat[:, [0, 1, 3]]
+        tt = fs.ttest(fs.class_stats(mat[:25]), fs.class_stats(mat[25:]))
+        (t, p) = stats.ttest_ind(mat[:25], mat[25:])
+        numpy.testing.assert_allclose([v[0] for v in tt], t)
+        numpy.testing.assert_allclose([v[1] for v in tt], p)
+
+
+class TestUnivariateScores(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.target = rng.randint(2, size=50)
+        self.data = rng.randn(50, 4) + self.target[:, None] * [1, 0, 0, 0]
+        self.data[:, 1] = numpy.round(self.data[:, 1])
+        self.data[:, 2] = 1.0
+
+    def _reference_mi(self, col, target, num_bins):
+        edges = numpy.linspace(col.min(), col.max(), num_bins + 1)
+        return metrics.mutual_info_score(
+            target, numpy.digitize(col, edges[1:-1]))
+
+    def test_two_classes(self):
+        scores = featmat.univariate_scores(self.data, self.target)
+        for fi in [0, 1, 3]:
+            col = self.data[:, fi]
+            (f, _) = stats.f_oneway(col[self.target == 0],
+                                    col[self.target == 1])
+            (t, _) = stats.ttest_ind(col[self.target == 1],
+                                     col[self.target == 0])
+            (r, _) = stats.pearsonr(col, self.target)
+            self.assertAlmostEqual(scores['f'][fi], f)
+            self.assertAlmostEqual(scores['t'][fi], t)
+            self.assertAlmostEqual(scores['pbcorr'][fi], r)
+            self.assertAlmostEqual(scores['mi'][fi], self._reference_mi(
+                col, self.target, 10))
+
+    def test_multiclass(self):
+        target = numpy.arange(50) % 3
+        scores = featmat.univariate_scores(self.data, target, num_bins=5)
+        self.assertTrue(scores['t'] is None)
+        self.assertTrue(scores['pbcorr'] is None)
+        for fi in [0, 1, 3]:
+            col = self.data[:, fi]
+            (f, _) = stats.f_oneway(*[col[target == c] for c in xrange(3)])
+            self.assertAlmostEqual(scores['f'][fi], f)
+            self.assertAlmostEqual(scores['mi'][fi], self._reference_mi(
+                col, target, 5))
+        self.assertRaises(ValueError, featmat.rank_scores, scores, 't')
+
+    def test_constant_feature(self):
+        scores = featmat.univariate_scores(self.data, self.target)
+        for measure in ['f', 't', 'pbcorr']:
+            self.assertTrue(numpy.isnan(scores[measure][2]))
+        self.assertEqual(scores['mi'][2], 0.0)
+        for measure in featmat.UNIVARIATE_SCORES:
+            self.assertEqual(featmat.rank_scores(scores, measure)[-1], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
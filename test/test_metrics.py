@@ -0,0 +1,104 @@
+import unittest
+
+import numpy
+from sklearn import metrics
+
+from spice import metrics as spice_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = numpy.random.RandomState(0)
+
+    def _binary_case(self, n=50, ties=False):
+        target = self.rng.randint(2, size=n)
+        proba = self.rng.rand(n) + 0.3 * target
+        if(ties):
+            proba = numpy.round(proba, 1)
+        pred = (proba > 0.65).astype(int)
+        return (target, pred, proba)
+
+    def _reference_scores(self, target, pred, proba):
+        if(len(numpy.union1d(target, pred)) <= 2):
+            kwargs = {'pos_label': 1}
+        else:
+            kwargs = {'average': 'weighted'}
+        ref = {
+            'accuracy': metrics.accuracy_score(target, pred),
+            'f1': metrics.f1_score(target, pred, **kwargs),
+            'precision': metrics.precision_score(target, pred, **kwargs),
+            'recall': metrics.recall_score(target, pred, **kwargs)}
+        if(len(numpy.unique(target)) == 2):
+            ref['mcc'] = metrics.matthews_corrcoef(target, pred)
+            ref['roc_auc'] = metrics.roc_auc_score(target, proba)
+            ref['average_precision'] = metrics.average_precision_score(
+                target, proba)
+        return ref
+
+    def _assert_scores(self, target, pred, proba):
+        scores = spice_metrics.all_scores(target, pred, proba)
+        for name, value in self._reference_scores(target, pred,
+                                                  proba).iteritems():
+            self.assertAlmostEqual(scores[name], value, msg=name)
+            self.assertAlmostEqual(
+                spice_metrics.score(name, target, pred, proba), value,
+                msg=name)
+
+    def test_binary(self):
+        for i in xrange(10):
+            self._assert_scores(*self._binary_case())
+
+    def test_binary_ties(self):
+        for i in xrange(10):
+            self._assert_scores(*self._binary_case(ties=True))
+
+    def test_constant_proba(self):
+        (target, pred, proba) = self._binary_case()
+        self._assert_scores(target, pred, numpy.ones(target.size))
+
+    def test_multiclass(self):
+        for i in xrange(10):
+            target = self.rng.randint(3, size=60)
+            pred = numpy.where(self.rng.rand(60) < 0.6, target,
+                               self.rng.randint(3, size=60))
+            scores = spice_metrics.all_scores(target, pred, None)
+            self._assert_scores(target, pred, None)
+            for name in ['mcc'] + spice_metrics.proba_score_names:
+                self.assertFalse(name in scores)
+
+    def test_single_class_target(self):
+        (target, pred, proba) = self._binary_case()
+        target = numpy.ones(target.size, dtype=int)
+        scores = spice_metrics.all_scores(target, pred, proba)
+        self._assert_scores(target, pred, proba)
+        self.assertAlmostEqual(scores['mcc'],
+                               metrics.matthews_corrcoef(target, pred))
+        self.assertFalse('roc_auc' in scores)
+        self.assertRaises(ValueError, spice_metrics.score, 'roc_auc',
+                          target, pred, proba)
+
+    def test_single_class_target_and_pred(self):
+        target = numpy.zeros(20, dtype=int)
+        pred = numpy.zeros(20, dtype=int)
+        proba = self.rng.rand(20)
+        scores = spice_metrics.all_scores(target, pred, proba)
+        self._assert_scores(target, pred, proba)
+        self.assertEqual(scores['mcc'], 0.0)
+        self.assertTrue(numpy.isnan(scores['average_precision']))
+
+    def test_confusion_matrix(self):
+        target = self.rng.randint(3, size=60)
+        pred = self.rng.randint(3, size=60)
+        self.assertTrue(numpy.array_equal(
+            spice_metrics.confusion_matrix(target, pred),
+            metrics.confusion_matrix(target, pred)))
+
+    def test_unknown_score(self):
+        (target, pred, proba) = self._binary_case()
+        self.assertRaises(ValueError, spice_metrics.score, 'unknown',
+                          target, pred, proba)
+
+
+if __name__ == '__main__':
+    unittest.main()